@@ -1,10 +1,15 @@
+import asyncio
+import os
 from typing import Any, Annotated
 
-from fastapi import APIRouter, BackgroundTasks, Body
+from fastapi import APIRouter, Body, HTTPException
 
+from app.db.run_leases import RunLeaseStore
 from app.db.supabase_connection import SupabaseConnection
 from app.models.scraper_models import SalesScraperRequestBody
 from app.controllers.scraper_controller import run_scraper
+from app.services.scraper_services.http_cache import get_http_cache
+from app.services.scraper_services.job_queue import LeasedScraperJobQueue, ScraperJobQueue
 
 
 router = APIRouter()
@@ -12,14 +17,12 @@ db = SupabaseConnection()
 
 @router.post("/", response_model=dict)
 async def handle_sales_scraper_request(
-		request_body: Annotated[SalesScraperRequestBody, Body(..., description="Sales scraper request")],
-		background_tasks: BackgroundTasks):
+		request_body: Annotated[SalesScraperRequestBody, Body(..., description="Sales scraper request")]):
 	"""
-    Handles the sales scraper request, initiating the scraper run and adding the task to background tasks.
+    Handles the sales scraper request, creating the scraper run and adding it to the job queue.
 
     Parameters:
     request_body (SalesScraperRequestBody): The request body containing the necessary details to run the scraper.
-    background_tasks (BackgroundTasks): The background tasks manager for running tasks asynchronously.
 
     Returns:
     dict: Contains the run_id and a message regarding the status of the scraper run initiation.
@@ -34,24 +37,40 @@ async def handle_sales_scraper_request(
 		return None
 	
 	# Step 1: Create the scraper run in the database and immediately return the run_id to the client.
-	run_id = _create_scraper_run(request_body.email, request_body.company_description, request_body.url)
+	# The database calls are synchronous, so they run in a worker thread to keep the event loop and the running
+	# scraper workers going
+	run_id = await asyncio.to_thread(_create_scraper_run, request_body.email, request_body.company_description,
+	                                 request_body.url)
 	
 	# Step 2: Set scraper status to "Pending" if a valid run_id was returned.
 	if run_id is not None:
-		db.update_sales_scraper_run(run_id=run_id, run_status="Pending")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=run_id, run_status="Pending")
 	else:
 		print("Error! Run_ID is not valid, so no valid scraper was created.")
+		raise HTTPException(status_code=500, detail="Failed to create scraper run")
 	
-	# TODO: Delete
-	print("\n\n\nAdding background task\n\n\n")
-	# Step 3: Add the long-running scraper task to background tasks
-	# background_tasks.add_task(process_scraper_run, run_id, request_body)
-	print("\n\n\nAdded background task\n\n\n")
-	await process_scraper_run(run_id, request_body)
+	# Step 3: Hand the long-running scraper task to the worker pool and return immediately
+	try:
+		position = job_queue.enqueue(run_id, request_body)
+	except asyncio.QueueFull:
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=run_id, run_status="Error",
+		                        run_results="Scraper queue is full")
+		raise HTTPException(status_code=503, detail="Scraper queue is full, please try again later")
+	print(f"Queued scraper run {run_id} with {position} runs ahead of it")
 	
 	return {"run_id": run_id, "message": "Scraper run has been created and is processing in the background."}
 
 
+@router.get("/metrics", response_model=dict)
+async def get_sales_scraper_metrics():
+	"""
+	Returns the scraper job queue metrics (queue depth, wait time and run time) used for sizing instances,
+	and the HTTP cache hit ratio and bytes saved.
+	"""
+	http_cache = get_http_cache()
+	return {"queue": job_queue.stats(), "http_cache": http_cache.stats() if http_cache else None}
+
+
 def _create_scraper_run(email: str, description: str, url: str) -> Any | None:
 	"""
 	Creates a new scraper run and returns its unique identifier.
@@ -90,16 +109,32 @@ async def process_scraper_run(database_run_id: str, request_body: SalesScraperRe
 	
 	try:
 		# Step 4: Update the scraper run status to 'Started'
-		db.update_sales_scraper_run(run_id=database_run_id, run_status="Started")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=database_run_id, run_status="Started")
 		
 		# Run the scraper asynchronously
 		result = await run_scraper(database_run_id, request_body)
 		
 		# Step 5: If the scraper runs successfully, update the status to 'Success'
-		db.update_sales_scraper_run(run_id=database_run_id, run_results=result, run_status="Success")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=database_run_id, run_results=result,
+		                        run_status="Success")
 	
 	except Exception as e:
 		# Step 6: If an error occurs, update the status to 'Error'
-		db.update_sales_scraper_run(run_id=database_run_id, run_results=str(e), run_status="Error")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=database_run_id, run_results=str(e),
+		                        run_status="Error")
 		print(f"An error occurred during scraping: {e}")
 		raise e
+
+
+def _create_job_queue():
+	"""
+	Creates the worker pool for this node. With SCRAPER_WORKER_MODE=lease the workers claim Pending runs from the
+	shared sales_scraper_runs table, so several nodes can split the work; otherwise runs are queued in-process.
+	"""
+	if os.getenv("SCRAPER_WORKER_MODE", "local").lower() == "lease":
+		return LeasedScraperJobQueue(process_scraper_run, RunLeaseStore())
+	return ScraperJobQueue(process_scraper_run)
+
+
+# Fixed-size worker pool draining queued runs, started and stopped with the application
+job_queue = _create_job_queue()
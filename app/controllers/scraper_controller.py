@@ -1,22 +1,34 @@
+import asyncio
 import os
+import time
 from datetime import datetime
 from typing import LiteralString
 from urllib.parse import urlparse
 
 import requests
-from bs4 import SoupStrainer
+from bs4 import BeautifulSoup, SoupStrainer
 from dotenv import load_dotenv
 from fastapi import HTTPException
-from langchain_community.document_loaders.web_base import WebBaseLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from app.db.s3 import S3Connection
 from app.db.supabase_connection import SupabaseConnection
 from app.services.do_spaces_service import DigitalOceanSpacesUploader
+from app.services.scraper_services.crawl_state import CrawlStateStore, prioritize_entries
 from app.services.scraper_services.document_handling import DocumentHandler
-from app.services.scraper_services.sales_qa_agent import SalesQAAgent
-from app.services.scraper_services.url_ranking import URLRanker
-from app.services.scraper_services.web_requests import WebRequestHandler
+from app.services.scraper_services.embedding_cache import text_hash
+from app.services.scraper_services.http_cache import get_http_cache
+from app.services.scraper_services.http_fetcher import AsyncFetcher, CrawlBudget
+from app.services.scraper_services.ingest_pipeline import IngestPipeline
+from app.services.scraper_services.link_crawler import LinkCrawler
+from app.services.scraper_services.near_duplicates import remove_near_duplicates
+from app.services.scraper_services.sales_qa_agent import COMPANY_QUERY, SalesQAAgent, VectorQuery
+from app.services.scraper_services.url_normalization import canonicalize_url, dedupe_urls, resolve_canonical, \
+	site_domain
+from app.services.scraper_services.url_ranking import COMPANY_KEYWORDS, PEOPLE_KEYWORDS, URLRanker
+from app.services.scraper_services.url_templates import cluster_urls, expand_rankings
+from app.services.scraper_services.web_requests import SitemapEntry, WebRequestHandler
 from app.models.scraper_models import CompanySummaryResponse, ContactResponse, Summary, CheckResponse, PageRanked, \
 	SalesScraperRequestBody, Scraper
 
@@ -40,33 +52,338 @@ def get_filename_from_url(url):
 	return domain
 
 
-def get_pages(urls):
-	loader = WebBaseLoader(
-		web_paths=urls,
-		bs_kwargs=dict(
-			parse_only=SoupStrainer(
-				lambda tag, attrs: (
-					# Focus on tags that usually contain main content or links
-						tag in ["article", "main", "div", "section", "a", "h1", "h2", "h3", "h4", "h5", "h6"]
-						# Exclude elements with common repetitive classes or IDs
-						and not any(
-					cls in attrs.get("class", [])
-					for cls in ["sidebar", "footer", "header", "nav", "menu", "advertisement", "widget"]
-				)
-						and attrs.get("id") not in ["footer", "header", "navbar", "sidebar"]
-				)
-			)
-		),
+# Focus on tags that usually contain main content or links and exclude elements with common repetitive classes or IDs
+PAGE_CONTENT_STRAINER = SoupStrainer(
+	lambda tag, attrs: (
+			tag in ["article", "main", "div", "section", "a", "h1", "h2", "h3", "h4", "h5", "h6"]
+			and not any(
+		cls in attrs.get("class", [])
+		for cls in ["sidebar", "footer", "header", "nav", "menu", "advertisement", "widget"]
+	)
+			and attrs.get("id") not in ["footer", "header", "navbar", "sidebar"]
 	)
+)
+CANONICAL_LINK_STRAINER = SoupStrainer("link", rel="canonical")
+
+
+def parse_page(url, response) -> Document:
+	"""
+	Parses a fetched page into a Document, keeping only the main content tags.
+	"""
+	soup = BeautifulSoup(response.content, "html.parser", parse_only=PAGE_CONTENT_STRAINER,
+	                     from_encoding=response.encoding)
+	page_content = soup.get_text()
+	# The hash of the page as fetched, so it does not depend on the boilerplate removed across the other pages
+	return Document(page_content=page_content, metadata={"source": url, "page_hash": text_hash(page_content)})
+
+
+def find_canonical_url(url, response):
+	"""
+	Returns the URL a page declares with <link rel="canonical">, or None. Only the <head> is parsed.
+	"""
+	head_end = response.content.lower().find(b"</head>")
+	head = response.content[:head_end] if head_end != -1 else response.content
+	soup = BeautifulSoup(head, "html.parser", parse_only=CANONICAL_LINK_STRAINER, from_encoding=response.encoding)
+	link = soup.find("link", href=True)
+	return resolve_canonical(url, link["href"]) if link else None
+
+
+def load_page(url, response):
+	return parse_page(url, response), find_canonical_url(url, response)
+
+
+class DocumentWriter:
+	"""
+	Writes the fetched pages of one run to web_documents in worker threads, so the scrape goes on while they are sent.
+	`write` must be called from the event loop; `wait` waits for the run's pending writes and reports failures.
+	"""
+	
+	def __init__(self):
+		self.pending = set()
+		self.written = 0
+		self.failed = 0
 	
-	docs = loader.load()
+	def write(self, documents):
+		documents = list(documents)
+		task = asyncio.get_running_loop().create_task(asyncio.to_thread(self._store, documents))
+		self.pending.add(task)
+		task.add_done_callback(self.pending.discard)
+		return task
+	
+	def _store(self, documents):
+		if not db.store_documents(documents):
+			self.failed += len(documents)
+			raise Exception(f"Failed to store {len(documents)} pages in web_documents")
+		self.written += len(documents)
+	
+	async def wait(self):
+		results = await asyncio.gather(*self.pending, return_exceptions=True)
+		errors = [result for result in results if isinstance(result, Exception)]
+		if errors:
+			print(f"Error: {self.failed} pages were not stored in web_documents ({self.written} were): {errors[0]}")
+		return not errors
+
+
+async def get_pages(urls, fetcher: AsyncFetcher):
+	"""
+	Fetches the pages concurrently through the run's fetcher and parses them off the event loop.
+	Pages that fail to load are skipped, and so are pages whose canonical URL was already loaded.
+	"""
+	responses = await fetcher.get_many(urls)
+	pages = [(url, response) for url, response in zip(urls, responses) if response is not None]
+	loaded = await asyncio.gather(*[asyncio.to_thread(load_page, url, response) for url, response in pages])
+	docs = []
+	seen = set()
+	for doc, canonical_url in loaded:
+		keys = {canonicalize_url(doc.metadata["source"]), canonicalize_url(canonical_url or doc.metadata["source"])}
+		if keys & seen:
+			print(f"Skipping {doc.metadata['source']}, a page with the same canonical URL was already loaded")
+			continue
+		seen.update(keys)
+		docs.append(doc)
+	print(f"Loaded {len(docs)} of {len(urls)} pages")
 	return docs
 
 
+async def scrape_and_store(scraper, agent, doc_handler, fetcher, entries, incremental=False, document_writer=None):
+	"""
+	Ranks the candidate pages of a site, loads the relevant ones and stores their chunks as embeddings.
+	:param entries: The sitemap entries to consider, most promising first.
+	:param incremental: Whether the collection already holds the site's embeddings. Reloaded pages then replace
+	                    their previously stored chunks, and finding no relevant page is not an error.
+	:param document_writer: The run's DocumentWriter; without one the pages are written before returning.
+	:return: The URLs of the pages that were loaded, stored or found unchanged.
+	"""
+	ranker = URLRanker()
+	# Collapse http/https, trailing slash, tracking parameter and fragment variants of the same page
+	pages_response = dedupe_urls([entry.loc for entry in entries])
+	print(f"{len(pages_response)} unique pages out of {len(entries)} URLs")
+	print(f"Ranking URLs for {scraper.request_body.url}")
+	
+	if len(pages_response) == 0:
+		raise Exception("Error: No pages found to generate strategy or too many pages in sitemap")
+	
+	# Group the URLs by path template (/blog/*, /products/*) and collapse translations (/fr/*, /de/*), so one
+	# representative per group is ranked instead of the slice being filled with variants of the same page
+	groups = cluster_urls(pages_response)
+	pages_response = [member for group in groups for member in group.members]
+	print(f"{len(groups)} URL groups, {sum(group.locale_variants for group in groups)} locale variants dropped")
+	
+	# Extract urls based on keywords
+	keyword_urls = []
+	for page in pages_response:
+		if any(keyword in page for keyword in PEOPLE_KEYWORDS):
+			keyword_urls.append(PageRanked(url=page, company_likelihood=0, people_likelihood=1))
+		if any(keyword in page for keyword in COMPANY_KEYWORDS):
+			keyword_urls.append(PageRanked(url=page, company_likelihood=1, people_likelihood=0))
+	print(pages_response[:5])
+	selected_urls = [group.representative for group in groups if group.representative not in PEOPLE_KEYWORDS
+	                 and group.representative not in COMPANY_KEYWORDS][:80]
+	
+	print(selected_urls[:80])
+	ranked_urls = expand_rankings(await ranker.arank_urls(selected_urls), groups)
+	
+	# Extract relevant pages
+	company_pages = [page for page in ranked_urls if page.company_likelihood > 0.7]
+	people_pages = [page for page in ranked_urls if page.people_likelihood > 0.7]
+	if not company_pages and not people_pages:
+		if not incremental:
+			raise Exception("Error: Not enough information to generate strategy")
+		if not keyword_urls:
+			print("None of the changed pages are relevant, keeping the stored embeddings")
+			return []
+	print("ranking pages")
+	ranked_pages = {page.url: page for page in company_pages + people_pages + keyword_urls}
+	if not ranked_pages:
+		raise Exception("Error: No pages found to generate strategy")
+	# The ranker may echo a page back in another form, so variants are collapsed again before fetching
+	urls = dedupe_urls(list(ranked_pages.keys()))
+	print(urls)
+	
+	if not incremental and os.getenv("SCRAPER_STREAMING_INGEST", "true").lower() in ["true", "1"]:
+		# Embed the first pages while later ones are still downloading
+		page_metadata = {url: {"company_likelihood": page.company_likelihood,
+		                       "people_likelihood": page.people_likelihood} for url, page in ranked_pages.items()}
+		writer = document_writer or DocumentWriter()
+		pipeline = IngestPipeline(agent, doc_handler, fetcher, load_page, page_sink=writer.write)
+		pages_stored = await pipeline.run(urls, page_metadata)
+		if document_writer is None:
+			await writer.wait()
+		print(f"Fetcher stats: {fetcher.stats()}")
+		if not pages_stored:
+			raise Exception("Error: None of the relevant pages could be loaded")
+		return pipeline.sources
+	
+	print("loading documents")
+	docs = await get_pages(urls, fetcher)
+	print(f"Fetcher stats: {fetcher.stats()}")
+	print("removing duplicate content")
+	documents = await asyncio.to_thread(doc_handler.remove_duplicate_content, docs)
+	print("removing empty content")
+	documents = [doc for doc in documents if doc.page_content.strip()]
+	if incremental and not documents:
+		print("None of the changed pages could be loaded, keeping the stored embeddings")
+		return []
+	print("Storing documents")
+	for doc in documents:
+		# Check if 'source' exists in the document's metadata
+		if "source" in doc.metadata:
+			source = doc.metadata["source"]
+			# Check if the source exists in ranked_pages
+			if source in ranked_pages:
+				# Safely update the metadata without overwriting the whole dictionary
+				doc.metadata.update({
+					"company_likelihood": ranked_pages[source].company_likelihood,
+					"people_likelihood": ranked_pages[source].people_likelihood
+				})
+				print(f"Updated metadata for doc with source {source}: {doc.metadata}")
+			else:
+				print(f"Source {source} not found in ranked_pages")
+		else:
+			print(f"Document does not have 'source' in metadata: {doc}")
+	
+	# Print the metadata of the first document to check if it has been updated
+	# print(documents[0])
+	if "people_likelihood" not in documents[0].metadata:
+		print("No people likelihood")
+		raise Exception("Error: No people likelihood found in documents")
+	
+	await store_pages(agent, documents, incremental=incremental, document_writer=document_writer)
+	return [doc.metadata["source"] for doc in documents]
+
+
+def split_documents(documents):
+	"""
+	Splits the pages into chunks, dropping repeated and very short chunks.
+	"""
+	print("splitting documents")
+	text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=0)
+	splits = text_splitter.split_documents(documents=documents)
+	print(len(splits))
+	# Deduplicate the splits
+	unique_texts = set()
+	unique_splits = []
+	
+	for doc in splits:
+		text = doc.page_content.strip()
+		if text not in unique_texts:
+			unique_texts.add(text)
+			unique_splits.append(doc)
+		else:
+			print(f"Duplicate text found and skipped: {text[:30]}...")
+	
+	# Remove splits with content less than 100 characters
+	unique_splits = [doc for doc in unique_splits if len(doc.page_content) > 100]
+	# Remove splits that only differ from an earlier one by a few words or whitespace
+	unique_splits, near_duplicates = remove_near_duplicates(unique_splits)
+	print(f"Dropped {len(splits) - len(unique_texts)} duplicate and {near_duplicates} near-duplicate splits")
+	return unique_splits
+
+
+async def store_pages(agent, documents, incremental=False, document_writer=None):
+	"""
+	Stores the loaded pages and their chunk embeddings. Every chunk carries the content hash of its page, as set by
+	`parse_page`. The database, splitting and embedding calls run in worker threads to keep the event loop free.
+	:param incremental: Whether the collection already holds the site's embeddings. Pages whose content hash matches
+	                    the stored one are then skipped, and only the chunks of changed pages are replaced.
+	:param document_writer: The run's DocumentWriter; without one the pages are written before returning.
+	:return: The number of pages stored.
+	"""
+	for doc in documents:
+		doc.metadata.setdefault("page_hash", text_hash(doc.page_content))
+	stored_pages = {}
+	if incremental:
+		stored_pages = await asyncio.to_thread(agent.stored_pages, [doc.metadata["source"] for doc in documents])
+		documents = [doc for doc in documents if doc.metadata["source"] not in stored_pages
+		             or stored_pages[doc.metadata["source"]].page_hash != doc.metadata["page_hash"]]
+		print(f"{len(documents)} pages are new or changed since they were stored")
+		if not documents:
+			return 0
+	
+	if document_writer is not None:
+		document_writer.write(documents)
+	else:
+		await asyncio.to_thread(db.store_documents, documents)
+	splits = await asyncio.to_thread(split_documents, documents)
+	print("Creating vecs client and storing embeddings")
+	if incremental:
+		changed_pages = {doc.metadata["source"]: stored_pages[doc.metadata["source"]] for doc in documents
+		                 if doc.metadata["source"] in stored_pages}
+		upserted, deleted, unchanged = await asyncio.to_thread(agent.update_pages, splits, changed_pages)
+		print(f"{upserted} chunks upserted, {deleted} deleted, {unchanged} unchanged")
+	else:
+		# Store embeddings
+		await asyncio.to_thread(agent.store_embeddings, splits)
+	return len(documents)
+
+
+async def refresh_stored_pages(agent, doc_handler, fetcher, document_writer=None):
+	"""
+	Re-fetches the pages stored in the collection and re-embeds the ones whose content changed, keeping their scores.
+	Pages that fail to load keep their stored chunks.
+	:return: The URLs of the stored pages.
+	"""
+	stored_pages = await asyncio.to_thread(agent.stored_pages)
+	print(f"Refreshing {len(stored_pages)} stored pages")
+	docs = await get_pages(list(stored_pages), fetcher)
+	documents = await asyncio.to_thread(doc_handler.remove_duplicate_content, docs)
+	documents = [doc for doc in documents if doc.page_content.strip() and doc.metadata["source"] in stored_pages]
+	for doc in documents:
+		page = stored_pages[doc.metadata["source"]]
+		doc.metadata.update({
+			"company_likelihood": page.company_likelihood,
+			"people_likelihood": page.people_likelihood
+		})
+	await store_pages(agent, documents, incremental=True, document_writer=document_writer)
+	return set(stored_pages)
+
+
+async def record_loaded_entries(crawl_state, domain, entries, loaded_sources):
+	"""
+	Records the sitemap entries whose pages were loaded, so changed pages that were not selected or failed to load
+	are considered again on the next run.
+	"""
+	loaded = {canonicalize_url(source) for source in loaded_sources}
+	await asyncio.to_thread(crawl_state.record, domain,
+	                        [entry for entry in entries if canonicalize_url(entry.loc) in loaded])
+
+
+async def verify_person(agent, person, check_query, summary_query, check_context, summary_context, limit):
+	"""
+	Checks that a person is on the company's team and fills in the summary of what they do.
+	:param limit: A semaphore bounding how many people are processed at once.
+	:return: Whether the person is on the team.
+	"""
+	async with limit:
+		started = time.monotonic()
+		print(f"checking if {person.name} is on the team")
+		check_response = await agent.aask_question(
+			query=check_query,
+			response_model=CheckResponse,
+			context_docs=check_context
+		)
+		print(check_response)
+		on_team = bool(check_response and check_response.check)
+		if on_team:
+			print(f"getting summary of {person.name}")
+			summary_response = await agent.aask_question(
+				query=summary_query,
+				response_model=Summary,
+				context_docs=summary_context
+			)
+			print(summary_response)
+			if summary_response:
+				person.summary = summary_response.summary
+		print(f"Processed {person.name} in {time.monotonic() - started:.2f}s")
+		return on_team
+
+
 # scraper_controller.py
 async def run_scraper(database_run_id: str, request_body: SalesScraperRequestBody):
 	"""
-    Async function in charge of running the scraper functionality.
+    Async function in charge of running the scraper functionality. It runs on the server's event loop next to the
+    other workers and the API, so every synchronous database, vector store, LLM and HTTP call is made in a worker
+    thread.
     :param database_run_id: The scraper's database ID.
     :param request_body: The post-request body that is necessary to obtain the website's scraper.request_body.url and the description of the
                          company
@@ -75,7 +392,8 @@ async def run_scraper(database_run_id: str, request_body: SalesScraperRequestBod
 		print(f"Starting scraper run with run_id '{database_run_id}' and request_body '{request_body}'.")
 	elif database_run_id and not request_body:
 		print("Error: No request body was provided.")
-		db.update_sales_scraper_run(run_id=database_run_id, run_status="Error! No valid request body was provided.")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=database_run_id,
+		                        run_status="Error! No valid request body was provided.")
 		return
 	elif not database_run_id and request_body:
 		print("Error: No database run_id was provided.")
@@ -89,145 +407,84 @@ async def run_scraper(database_run_id: str, request_body: SalesScraperRequestBod
 	scraper = Scraper(request_body=request_body, run_id=database_run_id)
 	print("\n\n\n")
 	
+	# One pooled fetcher per run, shared by every network call of the crawl and bounded by the run's crawl budget
+	# (building its TLS context takes tens of milliseconds, so that happens in a worker thread too)
+	fetcher = await asyncio.to_thread(lambda: AsyncFetcher(budget=CrawlBudget(), cache=get_http_cache()))
+	# Pages are written to web_documents in the background and waited for once the run is over
+	document_writer = DocumentWriter()
+	
 	try:
-		db.update_sales_scraper_run(run_id=scraper.run_id, run_status="Started")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=scraper.run_id, run_status="Started")
 		
 		# Initialize the scraper agent
 		filename = get_filename_from_url(scraper.request_body.url)
-		agent = SalesQAAgent(collection_name=filename)
+		agent = await asyncio.to_thread(SalesQAAgent, collection_name=filename,
+		                                domain=site_domain(scraper.request_body.url))
 		doc_handler = DocumentHandler()
 		# ai_collector = AIDataCollector()
 		
-		# Initialize favicon_url
-		favicon_url = None
+		crawl_state = CrawlStateStore()
+		# The same key as the agent's partition, so www and apex runs share their crawl state like their pages
+		domain = site_domain(scraper.request_body.url)
+		
+		# Check if the embeddings already exist, creating the collection if needed
+		has_embeddings = await asyncio.to_thread(agent.open_collection)
 		
-		# Check if the embeddings (collection) already exist
-		if agent.collection_exists() and len(agent.client.get_collection(agent.collection_name)) > 0:
-			print("Embeddings for this URL already exist. Using cached embeddings.")
-			agent.collection = agent.client.get_collection(agent.collection_name)
-			# Get favicon_url
-			web_handler = WebRequestHandler()
-			favicon_url = web_handler.get_favicon(scraper.request_body.url)
+		web_handler = WebRequestHandler(fetcher=fetcher)
+		print(f"Generating sitemap for {scraper.request_body.url}")
+		sitemap_entries, favicon_url = await asyncio.gather(
+			web_handler.parse_sitemap_entries(scraper.request_body.url, scraper.request_body.url),
+			web_handler.get_favicon(scraper.request_body.url)
+		)
+		
+		if not has_embeddings:
+			print("Embeddings for this URL do not exist. Proceeding to scrape and store embeddings.")
+			entries = sitemap_entries
+			if len(entries) == 0:
+				print(f"No sitemap found, crawling links from {scraper.request_body.url}")
+				entries = [SitemapEntry(page) for page in await LinkCrawler(fetcher).crawl(scraper.request_body.url)]
+			loaded_sources = await scrape_and_store(scraper, agent, doc_handler, fetcher, prioritize_entries(entries),
+			                                        document_writer=document_writer)
+			await record_loaded_entries(crawl_state, domain, sitemap_entries, loaded_sources)
 		else:
-			if not agent.collection_exists():
-				# Create a new collection
-				print(f"Creating collection '{agent.collection_name}'.")
-				agent.collection = agent.client.create_collection(agent.collection_name, dimension=1536)
-			else:
-				print("Embeddings for this URL do not exist. Proceeding to scrape and store embeddings.")
-				agent.collection = agent.client.get_collection(agent.collection_name)
-			
-			# Proceed with scraping and processing
-			web_handler = WebRequestHandler()
-			ranker = URLRanker()
-			
-			print(f"Generating sitemap for {scraper.request_body.url}")
-			pages_response = web_handler.parse_sitemap(scraper.request_body.url, scraper.request_body.url)
-			
-			favicon_url = web_handler.get_favicon(scraper.request_body.url)
-			print(f"Ranking URLs for {scraper.request_body.url}")
-			
-			if len(pages_response) == 0:
-				raise Exception("Error: No pages found to generate strategy or too many pages in sitemap")
-			
-			# Extract urls based on keywords
-			keyword_urls = []
-			people_keywords = ["team", "people", "staff", "leadership", "executive", "management"]
-			company_keywords = ["about", "info", "company", "home"]
-			for page in pages_response:
-				if any(keyword in page for keyword in people_keywords):
-					keyword_urls.append(PageRanked(url=page, company_likelihood=0, people_likelihood=1))
-				if any(keyword in page for keyword in company_keywords):
-					keyword_urls.append(PageRanked(url=page, company_likelihood=1, people_likelihood=0))
-			print(pages_response[:5])
-			selected_urls = [url for url in pages_response if url not in people_keywords
-			                 and url not in company_keywords][:80]
-			
-			# Get a subset starting from the 50th URL onward
-			print(selected_urls[:80])
-			ranked_urls = ranker.rank_urls(selected_urls, batch_size=20)
-			
-			# Extract relevant pages
-			company_pages = [page for page in ranked_urls if page.company_likelihood > 0.7]
-			people_pages = [page for page in ranked_urls if page.people_likelihood > 0.7]
-			if not company_pages and not people_pages:
-				raise Exception("Error: Not enough information to generate strategy")
-			print("ranking pages")
-			ranked_pages = {page.url: page for page in company_pages + people_pages + keyword_urls}
-			if not ranked_pages:
-				raise Exception("Error: No pages found to generate strategy")
-			urls = list(ranked_pages.keys())
-			print(urls)
-			
-			print("loading documents")
-			docs = get_pages(urls)
-			print("removing duplicate content")
-			documents = doc_handler.remove_duplicate_content(docs)
-			print("removing empty content")
-			documents = [doc for doc in documents if doc.page_content.strip()]
-			print("Storing documents")
-			for doc in documents:
-				# Check if 'source' exists in the document's metadata
-				if "source" in doc.metadata:
-					source = doc.metadata["source"]
-					# Check if the source exists in ranked_pages
-					if source in ranked_pages:
-						# Safely update the metadata without overwriting the whole dictionary
-						doc.metadata.update({
-							"company_likelihood": ranked_pages[source].company_likelihood,
-							"people_likelihood": ranked_pages[source].people_likelihood
-						})
-						print(f"Updated metadata for doc with source {source}: {doc.metadata}")
-					else:
-						print(f"Source {source} not found in ranked_pages")
-				else:
-					print(f"Document does not have 'source' in metadata: {doc}")
-			
-			# Print the metadata of the first document to check if it has been updated
-			# print(documents[0])
-			if "people_likelihood" not in documents[0].metadata:
-				print("No people likelihood")
-				raise Exception("Error: No people likelihood found in documents")
-			
-			ret = db.store_documents(documents)
-			print("splitting documents")
-			text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=0)
-			splits = text_splitter.split_documents(documents=documents)
-			print(len(splits))
-			# Deduplicate the splits
-			unique_texts = set()
-			unique_splits = []
-			
-			for doc in splits:
-				text = doc.page_content.strip()
-				if text not in unique_texts:
-					unique_texts.add(text)
-					unique_splits.append(doc)
+			# Pages stored by earlier runs are fetched again and only those whose content changed are re-embedded
+			stored_sources = set()
+			if os.getenv("SCRAPER_INCREMENTAL_REFRESH", "true").lower() in ["true", "1"]:
+				stored_sources = {canonicalize_url(source) for source in await refresh_stored_pages(agent, doc_handler, fetcher, document_writer)}
+			if await asyncio.to_thread(crawl_state.known_domain, domain):
+				# Of the other pages, only those that are new, whose lastmod changed since the last crawl, or whose
+				# missing lastmod means they are due for another look are ranked
+				changed_entries = [entry for entry in
+				                   await asyncio.to_thread(crawl_state.changed_entries, domain, sitemap_entries)
+				                   if canonicalize_url(entry.loc) not in stored_sources]
+				print(f"{len(changed_entries)} of {len(sitemap_entries)} sitemap pages changed since the last crawl")
+				if changed_entries:
+					loaded_sources = await scrape_and_store(scraper, agent, doc_handler, fetcher,
+					                                        prioritize_entries(changed_entries), incremental=True,
+					                                        document_writer=document_writer)
+					await record_loaded_entries(crawl_state, domain, changed_entries, loaded_sources)
 				else:
-					print(f"Duplicate text found and skipped: {text[:30]}...")
-			
-			# Remove splits with content less than 100 characters
-			unique_splits = [doc for doc in unique_splits if len(doc.page_content) > 100]
-			
-			print("Creating vecs client and storing embeddings")
-			# Store embeddings
-			agent.store_embeddings(unique_splits)
-		# End of If-Else
+					print("Embeddings for this URL are up to date. Using cached embeddings.")
+			elif not stored_sources:
+				print("Embeddings for this URL already exist. Using cached embeddings.")
 		
 		# Proceed with the rest of the code using the agent and existing embeddings
-		db.update_sales_scraper_run(run_id=scraper.run_id, run_status="Getting People Info")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=scraper.run_id, run_status="Getting People Info")
 		
 		# Initialize appendix URLs list
 		appendix_urls = []
 		
 		# Get company information
 		print("Fetching company information")
-		company_query = "What company does this website belong to?"
-		company_context = agent.retrieve_documents(company_query, filters={"company_likelihood": {"$gt": 0.7}})
-		if not company_context:
-			company_context = agent.retrieve_documents(company_query)
+		company_query = COMPANY_QUERY
+		# The filtered search and its unfiltered fallback are sent together
+		company_context, fallback_context = await asyncio.to_thread(agent.retrieve_many, [
+			VectorQuery(company_query, filters={"company_likelihood": {"$gt": 0.7}}),
+			VectorQuery(company_query)
+		])
+		company_context = company_context or fallback_context
 		
-		company_response = agent.ask_question(
+		company_response = await agent.aask_question(
 			query=company_query,
 			response_model=CompanySummaryResponse,
 			context_docs=company_context
@@ -244,10 +501,12 @@ async def run_scraper(database_run_id: str, request_body: SalesScraperRequestBod
 		# Get people information
 		print("Fetching people")
 		people_query = f"Who is on the {company_response.name} team?"
-		people_context = agent.retrieve_documents(people_query, filters={"people_likelihood": {"$gt": 0.7}})
-		if not people_context:
-			people_context = agent.retrieve_documents(people_query)
-		people_response = agent.ask_question(
+		people_context, fallback_context = await asyncio.to_thread(agent.retrieve_many, [
+			VectorQuery(people_query, filters={"people_likelihood": {"$gt": 0.7}}),
+			VectorQuery(people_query)
+		])
+		people_context = people_context or fallback_context
+		people_response = await agent.aask_question(
 			query=people_query,
 			response_model=ContactResponse,
 			context_docs=people_context
@@ -259,48 +518,54 @@ async def run_scraper(database_run_id: str, request_body: SalesScraperRequestBod
 		# Fetching summaries for people
 		print("Fetching summaries for people")
 		valid_people = []
-		for person in people_response.people:
-			# Check if the person is associated with the company
-			check_query = f"Is {person.name} on the team at {company_response.name}?"
-			print("checking if person is on the team")
-			check_context = agent.retrieve_documents(check_query, filters={"people_likelihood": {"$gt": 0.7}})
-			print(check_context)
-			check_response = agent.ask_question(
-				query=check_query,
-				response_model=CheckResponse,
-				context_docs=check_context
-			)
-			print(check_response)
-			if not check_response or not check_response.check:
+		person_queries = [
+			(f"Is {person.name} on the team at {company_response.name}?",
+			 f"What does {person.name} do at {company_response.name}?")
+			for person in people_response.people
+		]
+		# The check and summary contexts of every person are retrieved in one batch
+		person_contexts = await asyncio.to_thread(agent.retrieve_many, [
+			VectorQuery(query, filters={"people_likelihood": {"$gt": 0.7}})
+			for queries in person_queries for query in queries
+		])
+		stage_started = time.monotonic()
+		verified = [None] * len(people_response.people)
+		if os.getenv("SCRAPER_PEOPLE_BATCHED", "true").lower() in ["true", "1"]:
+			# Groups of people are verified and summarized in one structured call each
+			verified = await agent.averify_people(company_response.name, people_response.people, [
+				person_contexts[2 * i] + person_contexts[2 * i + 1] for i in range(len(people_response.people))
+			])
+		# People no batch answered for are verified and summarized one by one, concurrently; gather keeps the
+		# order of the people response
+		limit = asyncio.Semaphore(int(os.getenv("SCRAPER_PEOPLE_CONCURRENCY", "5")))
+		unanswered = [i for i in range(len(people_response.people)) if verified[i] is None]
+		answers = await asyncio.gather(*[
+			verify_person(agent, people_response.people[i], *person_queries[i], person_contexts[2 * i],
+			              person_contexts[2 * i + 1], limit)
+			for i in unanswered
+		])
+		for i, on_team in zip(unanswered, answers):
+			verified[i] = on_team
+		print(f"Verified {len(people_response.people)} people in {time.monotonic() - stage_started:.2f}s")
+		for i, person in enumerate(people_response.people):
+			if not verified[i]:
 				continue
-			
-			# Get summary of the person
-			print("getting summary of the person")
-			summary_query = f"What does {person.name} do at {company_response.name}?"
-			summary_context = agent.retrieve_documents(summary_query, filters={"people_likelihood": {"$gt": 0.7}})
-			print(summary_context)
-			summary_response = agent.ask_question(
-				query=summary_query,
-				response_model=Summary,
-				context_docs=summary_context
-			)
-			print(summary_response)
-			if summary_response:
-				person.summary = summary_response.summary
-			
 			valid_people.append(person)
 			
 			# Collect appendix URLs from summary context
 			print("collecting appendix urls")
-			for doc in summary_context:
+			for doc in person_contexts[2 * i + 1]:
 				print(doc)
 				if 'source' in doc[2] and doc[2]['source'] not in appendix_urls:
 					appendix_urls.append(doc[2]['source'])
+		# Collapse variants of the same page, e.g. with and without a trailing slash
+		appendix_urls = dedupe_urls(appendix_urls)
 		
 		# Now you can proceed with generating the strategy and saving the report
-		db.update_sales_scraper_run(run_id=scraper.run_id, run_status="Generating Strategy")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=scraper.run_id, run_status="Generating Strategy")
 		print("Generating strategy")
-		strategy = agent.generate_strategy(scraper.request_body.company_description, company_response, valid_people)
+		strategy = await asyncio.to_thread(agent.generate_strategy, scraper.request_body.company_description,
+		                                   company_response, valid_people)
 		
 		# Proceed with saving to markdown, converting to PDF, uploading, etc.
 		print("Saving to markdown and converting to PDF")
@@ -311,7 +576,7 @@ async def run_scraper(database_run_id: str, request_body: SalesScraperRequestBod
 		current_timestamp = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
 		filename = filename + current_timestamp
 		
-		db.update_sales_scraper_run(run_id=scraper.run_id, run_status="Generating PDF")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=scraper.run_id, run_status="Generating PDF")
 		print("Generating PDF")
 		# Add a try-except block to catch and log any exceptions
 		try:
@@ -345,8 +610,8 @@ async def run_scraper(database_run_id: str, request_body: SalesScraperRequestBod
 			raise  # Re-raise the exception to be caught by the outer try-except block
 		
 		uploader = DigitalOceanSpacesUploader('inform')
-		upload = uploader.upload_file(filename + ".pdf")
-		s3.upload_file(filename + ".pdf")
+		upload = await asyncio.to_thread(uploader.upload_file, filename + ".pdf")
+		await asyncio.to_thread(s3.upload_file, filename + ".pdf")
 		
 		print(upload)
 		# Optionally delete the collection if not needed
@@ -361,13 +626,15 @@ async def run_scraper(database_run_id: str, request_body: SalesScraperRequestBod
 			"company": company_response.name,
 			"status": "success"
 		}
-		requests.post("https://hook.us1.make.com/3lbu58jf6zfd2rvktzkenwiqdghxw2ek", json=response)
-		db.update_sales_scraper_run(run_id=scraper.run_id, run_results={"strategy": strategy}, run_status="Success")
+		await asyncio.to_thread(requests.post, "https://hook.us1.make.com/3lbu58jf6zfd2rvktzkenwiqdghxw2ek", json=response)
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=scraper.run_id, run_results={"strategy": strategy},
+		                        run_status="Success")
 		os.remove(filename + ".pdf")
 		return response
 	
 	except Exception as e:
-		db.update_sales_scraper_run(run_id=scraper.run_id, run_results=str(e), run_status="Error")
+		await asyncio.to_thread(db.update_sales_scraper_run, run_id=scraper.run_id, run_results=str(e),
+		                        run_status="Error")
 		response = {
 			"message": str(e),
 			"scraper.request_body.url": "",
@@ -375,5 +642,9 @@ async def run_scraper(database_run_id: str, request_body: SalesScraperRequestBod
 			"email": scraper.request_body.email,
 			"status": "error"
 		}
-		requests.post("https://hook.us1.make.com/3lbu58jf6zfd2rvktzkenwiqdghxw2ek", json=response)
+		await asyncio.to_thread(requests.post, "https://hook.us1.make.com/3lbu58jf6zfd2rvktzkenwiqdghxw2ek", json=response)
 		raise HTTPException(status_code=500, detail=str(e))
+	
+	finally:
+		await document_writer.wait()
+		await fetcher.aclose()
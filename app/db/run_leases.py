@@ -0,0 +1,139 @@
+import os
+import socket
+import uuid
+
+from dotenv import load_dotenv
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+load_dotenv()
+
+
+class RunLeaseStore:
+    """
+    Coordinates which node processes which `sales_scraper_runs` row.
+
+    Runs are claimed straight from Postgres with `FOR UPDATE SKIP LOCKED`, so any number of nodes can poll
+    the same table without handing out a run twice. A claimed run carries a lease that the owner extends
+    with heartbeats; once the lease expires another node may take the run over.
+    """
+
+    def __init__(self, dsn=None, table="sales_scraper_runs", lease_seconds=None, max_attempts=None, max_connections=5):
+        dsn = dsn or os.getenv("SCRAPER_LEASE_DB_URI") or os.getenv("SUPABASE_URI")
+        if not dsn:
+            raise ValueError("SCRAPER_LEASE_DB_URI or SUPABASE_URI environment variable is not set.")
+        self.pool = ThreadedConnectionPool(1, max_connections, dsn)
+        self.table_name = table
+        self.table = sql.Identifier(table)
+        self.lease_seconds = lease_seconds or int(os.getenv("SCRAPER_LEASE_SECONDS", "120"))
+        self.max_attempts = max_attempts or int(os.getenv("SCRAPER_MAX_ATTEMPTS", "3"))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def _execute(self, query, params=None, fetch="one"):
+        conn = self.pool.getconn()
+        try:
+            with conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute(query, params)
+                    if fetch == "one":
+                        return cur.fetchone()
+                    if fetch == "all":
+                        return cur.fetchall()
+                    return cur.rowcount
+        finally:
+            self.pool.putconn(conn)
+
+    def ensure_schema(self):
+        """
+        Adds the lease columns and the index used to find claimable runs, if they are missing.
+        """
+        self._execute(sql.SQL("""
+            ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS lease_owner text,
+                ADD COLUMN IF NOT EXISTS lease_expires_at timestamptz,
+                ADD COLUMN IF NOT EXISTS heartbeat_at timestamptz,
+                ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0;
+            CREATE INDEX IF NOT EXISTS {index} ON {table} (run_status, lease_expires_at, created_at);
+        """).format(table=self.table, index=sql.Identifier(f"{self.table_name}_lease_idx")), fetch=None)
+
+    def claim_run(self):
+        """
+        Claims the oldest Pending run, or a run whose lease has expired, for this node.
+
+        Returns:
+            dict | None: The claimed row (id, email, description, url, attempts, waited_seconds), or None.
+        """
+        return self._execute(sql.SQL("""
+            UPDATE {table} AS r
+            SET lease_owner = %(owner)s,
+                lease_expires_at = now() + make_interval(secs => %(lease)s),
+                heartbeat_at = now(),
+                attempts = r.attempts + 1,
+                run_status = 'Started',
+                updated_at = now()
+            WHERE r.id = (
+                SELECT id FROM {table}
+                WHERE (
+                    (run_status = 'Pending' AND (lease_expires_at IS NULL OR lease_expires_at < now()))
+                    OR (lease_owner IS NOT NULL AND lease_expires_at < now()
+                        AND run_status <> 'Success' AND run_status NOT LIKE 'Error%%')
+                )
+                AND attempts < %(max_attempts)s
+                ORDER BY created_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING r.id, r.email, r.description, r.url, r.attempts,
+                extract(epoch FROM now() - r.created_at)::float AS waited_seconds
+        """).format(table=self.table), {"owner": self.owner, "lease": self.lease_seconds, "max_attempts": self.max_attempts})
+
+    def heartbeat(self, run_id):
+        """
+        Extends the lease on a run this node owns.
+
+        Returns:
+            bool: False if the lease was lost to another node.
+        """
+        row = self._execute(sql.SQL("""
+            UPDATE {table}
+            SET lease_expires_at = now() + make_interval(secs => %(lease)s), heartbeat_at = now()
+            WHERE id = %(id)s AND lease_owner = %(owner)s
+            RETURNING id
+        """).format(table=self.table), {"id": run_id, "owner": self.owner, "lease": self.lease_seconds})
+        return row is not None
+
+    def release(self, run_id):
+        """
+        Drops this node's lease on a run once it has finished.
+        """
+        self._execute(sql.SQL("""
+            UPDATE {table}
+            SET lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = %(id)s AND lease_owner = %(owner)s
+        """).format(table=self.table), {"id": run_id, "owner": self.owner}, fetch=None)
+
+    def fail_exhausted_runs(self):
+        """
+        Marks runs whose lease expired after the last allowed attempt as errored.
+
+        Returns:
+            int: The number of runs marked.
+        """
+        return self._execute(sql.SQL("""
+            UPDATE {table}
+            SET run_status = 'Error', lease_owner = NULL, lease_expires_at = NULL, updated_at = now(),
+                run_results = to_jsonb('Run abandoned after ' || attempts || ' attempts'::text)
+            WHERE lease_expires_at < now() AND attempts >= %(max_attempts)s
+                AND run_status <> 'Success' AND run_status NOT LIKE 'Error%%'
+        """).format(table=self.table), {"max_attempts": self.max_attempts}, fetch=None)
+
+    def pending_count(self):
+        """
+        Counts the runs waiting to be claimed by any node.
+        """
+        row = self._execute(sql.SQL("SELECT count(*) AS pending FROM {table} WHERE run_status = 'Pending'").format(table=self.table))
+        return row["pending"]
+
+    def close(self):
+        self.pool.closeall()
@@ -1,6 +1,8 @@
 import os
 import datetime
+import hashlib
 from dotenv import load_dotenv
+from postgrest.types import ReturnMethod
 from supabase import create_client, Client
 
 load_dotenv()
@@ -315,22 +317,45 @@ class SupabaseConnection:
             print(f"Error updating sales scraper run: {str(e)}")
             return None
 
-    def store_documents(self, documents):
+    def store_documents(self, documents, batch_size=None, batch_bytes=None):
         """
-        Store a list of documents in the database.
+        Store a list of documents in the database, keyed on (url, content_hash).
+        Documents are written in bulk requests of at most `batch_size` rows (SUPABASE_DOCUMENT_BATCH_SIZE, 100) and
+        about `batch_bytes` of page content (SUPABASE_DOCUMENT_BATCH_BYTES, 2 MB). A page whose content was already
+        stored for its URL is skipped, which needs a unique index on web_documents (url, content_hash).
         """
+        batch_size = batch_size or int(os.getenv('SUPABASE_DOCUMENT_BATCH_SIZE', '100'))
+        batch_bytes = batch_bytes or int(os.getenv('SUPABASE_DOCUMENT_BATCH_BYTES', str(2 * 1024 * 1024)))
         try:
+            rows = {}
             for doc in documents:
-                doc_data = {
+                content_hash = hashlib.sha256(doc.page_content.encode()).hexdigest()
+                url = doc.metadata.get('source', '')
+                rows[(url, content_hash)] = {
+                    'url': url,
+                    'content_hash': content_hash,
                     'metadata': doc.metadata,
                     'page_content': doc.page_content
                 }
-                response = self.supabase.table('web_documents').insert(doc_data).execute()
+            batch, size = [], 0
+            for row in rows.values():
+                row_bytes = len(row['page_content'].encode())
+                if batch and (len(batch) >= batch_size or size + row_bytes > batch_bytes):
+                    self._upsert_documents(batch)
+                    batch, size = [], 0
+                batch.append(row)
+                size += row_bytes
+            if batch:
+                self._upsert_documents(batch)
             return True
         except Exception as e:
             print(f"Error storing documents: {str(e)}")
             return False
 
+    def _upsert_documents(self, rows):
+        self.supabase.table('web_documents').upsert(rows, on_conflict='url,content_hash', ignore_duplicates=True,
+                                                    returning=ReturnMethod.minimal).execute()
+
     def get_documents(self):
         """
         Retrieve all documents.
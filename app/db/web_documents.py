@@ -0,0 +1,29 @@
+import os
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2 import sql
+
+load_dotenv()
+
+
+def ensure_web_documents_schema(dsn=None, table="web_documents"):
+    """
+    Adds the url and content_hash columns and the unique index that `SupabaseConnection.store_documents` upserts on,
+    if they are missing. Rows stored before have no content hash and never conflict.
+    """
+    dsn = dsn or os.getenv("SUPABASE_URI")
+    if not dsn:
+        raise ValueError("SUPABASE_URI environment variable is not set.")
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("""
+                    ALTER TABLE {table}
+                        ADD COLUMN IF NOT EXISTS url text,
+                        ADD COLUMN IF NOT EXISTS content_hash text;
+                    CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} (url, content_hash);
+                """).format(table=sql.Identifier(table), index=sql.Identifier(f"{table}_url_content_hash_key")))
+    finally:
+        conn.close()
@@ -85,6 +85,17 @@ class Summary(BaseModel):
     summary: str = Field("", description="A summary of the given context")
 
 
+class PersonVerification(BaseModel):
+    """Whether a candidate is on the team, and a summary of what they do."""
+    id: int = Field(..., description="The id the person was listed with")
+    on_team: bool = Field(False, description="Whether the context shows the person is on the company's team")
+    summary: str = Field("", description="A summary of what the person does at the company")
+
+
+class PeopleVerification(BaseModel):
+    people: List[PersonVerification] = Field(default_factory=list, description="One entry for each listed person")
+
+
 class SummaryResponse(BaseModel):
     """Pydantic model for summary response."""
     summary: str
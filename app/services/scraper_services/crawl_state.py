@@ -0,0 +1,101 @@
+# crawl_state.py
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class CrawlStateStore:
+    """
+    Remembers the sitemap entries of every crawled domain so a re-run only processes pages whose <lastmod>
+    changed, or which are new, since the last successful crawl. Entries without a <lastmod> cannot be compared, so
+    they are processed again once `max_age_days` (SCRAPER_CRAWL_STATE_MAX_AGE_DAYS, 7) have passed since they were.
+    """
+
+    def __init__(self, path=None, max_age_days=None):
+        self.path = path or os.getenv("SCRAPER_CRAWL_STATE_PATH", "tmp/crawl_state.sqlite")
+        self.max_age_seconds = (max_age_days or float(os.getenv("SCRAPER_CRAWL_STATE_MAX_AGE_DAYS", "7"))) * 86400
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                domain TEXT NOT NULL,
+                url TEXT NOT NULL,
+                lastmod TEXT,
+                crawled_at REAL NOT NULL,
+                PRIMARY KEY (domain, url)
+            )
+        """)
+        self._conn.commit()
+
+    def known_domain(self, domain):
+        """Whether a crawl of the domain has been recorded."""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM pages WHERE domain = ? LIMIT 1", (domain,)).fetchone()
+        return row is not None
+
+    def changed_entries(self, domain, entries):
+        """
+        Filters sitemap entries down to the ones that need to be processed again.
+
+        Args:
+            domain (str): The crawled domain.
+            entries (List[SitemapEntry]): The current sitemap entries of the domain.
+
+        Returns:
+            List[SitemapEntry]: The entries that were not seen before, whose lastmod differs from the recorded one, or
+            that have no lastmod and were last processed more than `max_age_days` ago.
+        """
+        with self._lock:
+            recorded = {url: (lastmod, crawled_at) for url, lastmod, crawled_at in self._conn.execute(
+                "SELECT url, lastmod, crawled_at FROM pages WHERE domain = ?", (domain,)).fetchall()}
+        expired = time.time() - self.max_age_seconds
+        return [entry for entry in entries if entry.loc not in recorded or recorded[entry.loc][0] != entry.lastmod
+                or (entry.lastmod is None and recorded[entry.loc][1] < expired)]
+
+    def record(self, domain, entries):
+        """
+        Records the sitemap entries whose pages a run loaded. Entries that were not selected or failed to load must
+        be left out, so they are still reported by `changed_entries` on the next run; the entries not passed keep
+        the time they were last processed.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages (domain, url, lastmod, crawled_at) VALUES (?, ?, ?, ?)",
+                [(domain, entry.loc, entry.lastmod, now) for entry in entries])
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def prioritize_entries(entries):
+    """
+    Orders sitemap entries by their declared <priority> (0.5 when missing), then by the most recent <lastmod>,
+    then by the shortest URL, so the most relevant pages are the ones sent to ranking.
+    """
+    return sorted(entries, key=lambda entry: (
+        -(entry.priority if entry.priority is not None else 0.5),
+        -_lastmod_timestamp(entry.lastmod),
+        len(entry.loc),
+    ))
+
+
+def _lastmod_timestamp(lastmod):
+    if not lastmod:
+        return 0.0
+    try:
+        parsed = datetime.fromisoformat(lastmod.replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
@@ -4,6 +4,7 @@ import re
 import os
 from pyppeteer import launch
 import asyncio
+from collections import Counter
 
 class DocumentHandler:
     def __init__(self):
@@ -208,36 +209,38 @@ class DocumentHandler:
         cleaned_text = cleaned_text.strip()
         return cleaned_text
     
-    def remove_duplicate_content(self, docs):
+    def boilerplate_key(self, line):
+        """Normalized form of a line used to recognize it on other pages."""
+        return " ".join(line.split()).lower()
+
+    def remove_duplicate_content(self, docs, max_page_fraction=None, min_pages=None):
+        """
+        Removes the boilerplate of a site's pages: lines that appear on more than `max_page_fraction` of the pages,
+        such as navigation menus, cookie banners and footers. Lines are compared after collapsing whitespace and
+        lower-casing, and a line repeated on one page counts once for it.
+
+        Args:
+            docs: The fetched pages of one site, cleaned and updated in place.
+            max_page_fraction: SCRAPER_BOILERPLATE_FRACTION (0.8) by default. The pages are the ranked ones, chosen
+                because they share company and people content, so only lines on nearly all of them are boilerplate.
+            min_pages: Below this many pages (SCRAPER_BOILERPLATE_MIN_PAGES, 5) no line is treated as boilerplate.
+        """
+        max_page_fraction = max_page_fraction or float(os.getenv('SCRAPER_BOILERPLATE_FRACTION', '0.8'))
+        min_pages = min_pages or int(os.getenv('SCRAPER_BOILERPLATE_MIN_PAGES', '5'))
         for doc in docs:
             doc.page_content = self.clean_text(doc.page_content)
-        
-        def remove_common_prefix_suffix(texts):
-            if not texts:
-                return texts
-            
-            # Find common prefix
-            prefix = os.path.commonprefix(texts)
-            
-            # Find common suffix
-            reversed_texts = [text[::-1] for text in texts]
-            reversed_suffix = os.path.commonprefix(reversed_texts)
-            suffix = reversed_suffix[::-1]
-            
-            # Remove common prefix and suffix
-            cleaned_texts = []
-            for text in texts:
-                start = len(prefix)
-                end = len(text) - len(suffix) if suffix else len(text)
-                cleaned = text[start:end]
-                cleaned_texts.append(cleaned.strip())
-            
-            return cleaned_texts
-    
-        texts = [doc.page_content for doc in docs]
-        cleaned_texts = remove_common_prefix_suffix(texts)
-        
-        for doc, cleaned_text in zip(docs, cleaned_texts):
-            doc.page_content = cleaned_text
-        
+        if len(docs) < min_pages:
+            return docs
+
+        # Count, for every distinct line, the number of pages it appears on
+        page_counts = Counter()
+        for doc in docs:
+            page_counts.update({self.boilerplate_key(line) for line in doc.page_content.split('\n')})
+        max_pages = max_page_fraction * len(docs)
+        boilerplate = {line for line, count in page_counts.items() if count > max_pages and line}
+        print(f"Removing {len(boilerplate)} boilerplate lines found on more than {max_pages:g} of {len(docs)} pages")
+
+        for doc in docs:
+            lines = [line for line in doc.page_content.split('\n') if self.boilerplate_key(line) not in boilerplate]
+            doc.page_content = '\n'.join(lines).strip()
         return docs
@@ -0,0 +1,128 @@
+# embedding_cache.py
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def normalize_text(text):
+    """Collapses whitespace so chunks that only differ in spacing share an embedding."""
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_hash(text, model=""):
+    """Hex sha256 of the model name and the normalized text."""
+    return hashlib.sha256(f"{model}\n{normalize_text(text)}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding store keyed by `text_hash`. Vectors are kept as float32 in SQLite, and the least recently
+    used entries are evicted past `max_entries`.
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or os.getenv("SCRAPER_EMBEDDING_CACHE_PATH", "tmp/embedding_cache.sqlite")
+        self.max_entries = max_entries or int(os.getenv("SCRAPER_EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed_idx ON embeddings (accessed_at)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """
+        Returns:
+            dict: {key: List[float]} for the keys that are cached.
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    found[key] = np.frombuffer(row[0], dtype=np.float32).tolist()
+            self._conn.executemany("UPDATE embeddings SET accessed_at = ? WHERE key = ?", [(now, key) for key in found])
+            self._conn.commit()
+        return found
+
+    def put_many(self, vectors):
+        """Stores {key: vector} and evicts the least recently used entries past the size bound."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in vectors.items()])
+            self._conn.execute("""
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self._conn.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0}
+
+
+class CachedEmbeddings:
+    """
+    Wraps a LangChain embeddings model so every distinct text is embedded once: identical texts within a call are
+    embedded together, and texts embedded by any earlier call or run are read from the `EmbeddingCache`.
+    """
+
+    def __init__(self, embeddings, cache, model=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model or getattr(embeddings, "model", "")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], lambda missing: [self.embeddings.embed_query(missing[0])])[0]
+
+    def _embed(self, texts, embed):
+        keys = [text_hash(text, self.model) for text in texts]
+        vectors = self.cache.get_many(keys)
+        # The normalized text is embedded, so every text with the same key gets the same vector
+        missing = {key: normalize_text(text) for key, text in zip(keys, texts) if key not in vectors}
+        self.cache.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.cache.misses += sum(1 for key in keys if key in missing)
+        if missing:
+            embedded = dict(zip(missing.keys(), embed(list(missing.values()))))
+            self.cache.put_many(embedded)
+            vectors.update(embedded)
+        return [vectors[key] for key in keys]
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache():
+    """
+    Returns the process-wide embedding cache, or None when it is disabled with SCRAPER_EMBEDDING_CACHE=false.
+    """
+    global _embedding_cache
+    if os.getenv("SCRAPER_EMBEDDING_CACHE", "true").lower() not in ["true", "1"]:
+        return None
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
@@ -0,0 +1,210 @@
+# http_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class CacheEntry:
+    """A cached response body, the URL it was served from after redirects and the validators to revalidate it."""
+
+    def __init__(self, url, etag, last_modified, content_type, path, size, final_url=None):
+        self.url = url
+        self.final_url = final_url or url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.path = path
+        self.size = size
+
+    def validators(self):
+        """Returns the conditional request headers for this entry."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    On-disk HTTP cache keyed by URL.
+
+    Bodies are stored as files under `cache_dir` and indexed in SQLite together with their ETag and Last-Modified
+    validators, so later requests for the same URL can be revalidated with a conditional GET and answered from disk
+    on a 304. The total size of the bodies is kept under `max_bytes` by evicting the least recently used entries.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None, max_entry_bytes=None):
+        self.cache_dir = cache_dir or os.getenv("SCRAPER_HTTP_CACHE_DIR", "tmp/http_cache")
+        self.max_bytes = max_bytes or int(float(os.getenv("SCRAPER_HTTP_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        self.max_entry_bytes = max_entry_bytes or self.max_bytes // 10
+        self.bodies_dir = os.path.join(self.cache_dir, "bodies")
+        os.makedirs(self.bodies_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_type TEXT,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                final_url TEXT
+            )
+        """)
+        # Indexes created before redirects were recorded
+        if "final_url" not in [row[1] for row in self._conn.execute("PRAGMA table_info(entries)")]:
+            self._conn.execute("ALTER TABLE entries ADD COLUMN final_url TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_idx ON entries (accessed_at)")
+        self._conn.commit()
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def lookup(self, url):
+        """
+        Returns the cached entry for a URL, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, etag, last_modified, content_type, path, size, final_url FROM entries WHERE url = ?",
+                (url,)).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def hit(self, entry):
+        """
+        Reads the body of an entry the server confirmed is unchanged (304) and marks it as recently used.
+
+        Returns:
+            bytes | None: The cached body, or None if its file has gone missing.
+        """
+        try:
+            with open(entry.path, "rb") as f:
+                content = f.read()
+        except OSError:
+            self._delete(entry.url)
+            return None
+        with self._lock:
+            self._conn.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (time.time(), entry.url))
+            self._conn.commit()
+            self.hits += 1
+            self.bytes_saved += len(content)
+        return content
+
+    def miss(self):
+        """Counts a response that had to be downloaded in full."""
+        with self._lock:
+            self.misses += 1
+
+    def cacheable(self, headers, size=0):
+        """
+        Whether a response can be stored: it needs a validator, must not forbid storing and must fit the entry limit.
+        """
+        if "no-store" in headers.get("cache-control", "").lower():
+            return False
+        if not (headers.get("etag") or headers.get("last-modified")):
+            return False
+        return size <= self.max_entry_bytes
+
+    def store(self, url, headers, content, final_url=None):
+        """
+        Stores a response body with its validators, replacing any previous entry, then evicts down to the size budget.
+
+        Args:
+            url (str): The requested URL.
+            headers (Mapping): The response headers.
+            content (bytes): The (decoded) response body.
+            final_url (str, optional): The URL the response came from after redirects, `url` by default.
+        """
+        if not self.cacheable(headers, len(content)):
+            return
+        path = os.path.join(self.bodies_dir, hashlib.sha256(url.encode()).hexdigest())
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM entries WHERE url = ?", (url,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (url, etag, last_modified, content_type, path, size, stored_at, "
+                "accessed_at, final_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, headers.get("etag"), headers.get("last-modified"), headers.get("content-type"), path,
+                 len(content), now, now, final_url or url))
+            self._conn.commit()
+            self.total_bytes += len(content) - (previous[0] if previous else 0)
+        self._evict()
+
+    def _delete(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM entries WHERE url = ?", (url,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._conn.commit()
+                self.total_bytes -= row[0]
+
+    def _evict(self):
+        with self._lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            target = int(self.max_bytes * 0.9)
+            evicted = []
+            for url, path, size in self._conn.execute("SELECT url, path, size FROM entries ORDER BY accessed_at"):
+                if self.total_bytes <= target:
+                    break
+                evicted.append((url, path))
+                self.total_bytes -= size
+            self._conn.executemany("DELETE FROM entries WHERE url = ?", [(url,) for url, _ in evicted])
+            self._conn.commit()
+            self.evictions += len(evicted)
+        for _, path in evicted:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "size_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_http_cache = None
+
+
+def get_http_cache():
+    """
+    Returns the process-wide HTTP cache, or None when it is disabled with SCRAPER_HTTP_CACHE=false.
+    """
+    global _http_cache
+    if os.getenv("SCRAPER_HTTP_CACHE", "true").lower() not in ["true", "1"]:
+        return None
+    if _http_cache is None:
+        _http_cache = HttpCache()
+    return _http_cache
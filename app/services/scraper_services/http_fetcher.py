@@ -0,0 +1,269 @@
+# http_fetcher.py
+import asyncio
+import os
+import time
+from contextlib import aclosing
+from urllib.parse import urlparse
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
+}
+
+
+class CrawlBudget:
+    """
+    Per-run crawl budget in fetched pages and wall-clock seconds. A value of 0 disables that limit.
+    """
+
+    def __init__(self, max_pages=None, max_seconds=None):
+        self.max_pages = max_pages if max_pages is not None else int(os.getenv("SCRAPER_CRAWL_MAX_PAGES", "200"))
+        self.max_seconds = max_seconds if max_seconds is not None else float(os.getenv("SCRAPER_CRAWL_MAX_SECONDS", "180"))
+        self.pages = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def time_left(self):
+        if not self.max_seconds:
+            return None
+        return max(0.0, self.max_seconds - self.elapsed)
+
+    @property
+    def exhausted(self):
+        if self.max_pages and self.pages >= self.max_pages:
+            return True
+        return self.time_left() == 0.0
+
+    def try_consume(self):
+        """Reserves one page fetch. Returns False once the page or time budget has run out."""
+        if self.exhausted:
+            return False
+        self.pages += 1
+        return True
+
+
+class FetchResult:
+    """The body and headers of a successful HTTP response."""
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def encoding(self):
+        content_type = self.headers.get("content-type", "")
+        for param in content_type.split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "charset" and value:
+                return value.strip('"\'')
+        return None
+
+    @property
+    def text(self):
+        try:
+            return self.content.decode(self.encoding or "utf-8", errors="replace")
+        except LookupError:
+            return self.content.decode("utf-8", errors="replace")
+
+
+class AsyncFetcher:
+    """
+    Shared asyncio HTTP client for a scraper run.
+
+    Connections are pooled and kept alive per host (HTTP/2 where the server supports it, so a host's requests
+    are multiplexed over one connection and its name is resolved once per connection rather than per request).
+    Concurrency is limited both globally and per host, and page fetches are charged against a `CrawlBudget`.
+    With an `HttpCache`, responses carrying an ETag or Last-Modified are stored on disk and later requests for the
+    same URL are revalidated, so unchanged pages and sitemaps are served from the cache on a 304.
+    """
+
+    def __init__(self, timeout=10, max_connections=None, max_per_host=None, budget=None, headers=None, transport=None,
+                 cache=None):
+        self.timeout = timeout
+        self.max_connections = max_connections or int(os.getenv("SCRAPER_MAX_CONNECTIONS", "32"))
+        self.max_per_host = max_per_host or int(os.getenv("SCRAPER_MAX_PER_HOST", "6"))
+        self.budget = budget
+        self.cache = cache
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=1,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections,
+                                    keepalive_expiry=30),
+            )
+        self.client = httpx.AsyncClient(
+            headers=headers or DEFAULT_HEADERS,
+            timeout=timeout,
+            follow_redirects=True,
+            transport=transport,
+        )
+        self._global_limit = asyncio.Semaphore(self.max_connections)
+        self._host_limits = {}
+        self.requests = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.cache_hits = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def _host_limit(self, url):
+        host = urlparse(url).netloc.lower()
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_limits[host]
+
+    def _request_timeout(self, timeout):
+        timeout = timeout or self.timeout
+        time_left = self.budget.time_left() if self.budget else None
+        if time_left is not None:
+            timeout = min(timeout, time_left)
+        return timeout
+
+    def _budget_allows(self, url, budgeted):
+        if self.budget is None:
+            return True
+        allowed = self.budget.try_consume() if budgeted else not self.budget.exhausted
+        if not allowed:
+            print(f"Crawl budget exhausted, skipping {url}")
+        return allowed
+
+    async def get(self, url, timeout=None, budgeted=True):
+        """
+        Fetches a URL under the concurrency limits.
+
+        Args:
+            url (str): The URL to fetch.
+            timeout (float, optional): Overrides the client timeout for this request.
+            budgeted (bool, optional): Whether the request counts as a page against the crawl budget.
+                Unbudgeted requests (sitemaps, robots.txt) still stop once the time budget runs out.
+
+        Returns:
+            FetchResult | None: The response, or None on a network error, an error status or an exhausted budget.
+        """
+        if not self._budget_allows(url, budgeted):
+            return None
+        entry = await self._cache_lookup(url)
+        async with self._global_limit, self._host_limit(url):
+            request_timeout = self._request_timeout(timeout)
+            if request_timeout <= 0:
+                return None
+            self.requests += 1
+            try:
+                response = await self.client.get(url, timeout=request_timeout,
+                                                  headers=entry.validators() if entry else None)
+                if response.status_code == 304 and entry is not None:
+                    cached = await self._cache_hit(url, entry)
+                    if cached is not None:
+                        return cached
+                    response = await self.client.get(url, timeout=request_timeout)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                self.errors += 1
+                print(f"Failed to fetch {url}: {e}")
+                return None
+        self.bytes_received += len(response.content)
+        if self.cache is not None:
+            self.cache.miss()
+            if self.cache.cacheable(response.headers, len(response.content)):
+                await asyncio.to_thread(self.cache.store, url, response.headers, response.content, str(response.url))
+        return FetchResult(str(response.url), response.status_code, response.headers, response.content)
+
+    async def _cache_lookup(self, url):
+        if self.cache is None:
+            return None
+        return await asyncio.to_thread(self.cache.lookup, url)
+
+    async def _cache_hit(self, url, entry):
+        content = await asyncio.to_thread(self.cache.hit, entry)
+        if content is None:
+            return None
+        self.cache_hits += 1
+        # The final URL after redirects, as a download would report it
+        return FetchResult(entry.final_url, 200, httpx.Headers({"content-type": entry.content_type or ""}), content)
+
+    async def iter_bytes(self, url, timeout=None, budgeted=True, chunk_size=65536):
+        """
+        Streams a response body in chunks (after any Content-Encoding has been decoded) under the same limits as
+        `get`. Nothing is yielded on a network error or an error status; closing the generator early closes the
+        connection's stream. Only bodies that were streamed to the end are written to the cache.
+        """
+        if not self._budget_allows(url, budgeted):
+            return
+        entry = await self._cache_lookup(url)
+        async with self._global_limit, self._host_limit(url):
+            request_timeout = self._request_timeout(timeout)
+            if request_timeout <= 0:
+                return
+            self.requests += 1
+            try:
+                async with self.client.stream("GET", url, timeout=request_timeout,
+                                              headers=entry.validators() if entry else None) as response:
+                    if response.status_code != 304 or entry is None:
+                        async with aclosing(self._stream_body(url, response, chunk_size)) as chunks:
+                            async for chunk in chunks:
+                                yield chunk
+                        return
+                    cached = await self._cache_hit(url, entry)
+                if cached is None:
+                    # The cached body has gone missing since the lookup, so download it again
+                    async with self.client.stream("GET", url, timeout=request_timeout) as response:
+                        async with aclosing(self._stream_body(url, response, chunk_size)) as chunks:
+                            async for chunk in chunks:
+                                yield chunk
+                    return
+                for offset in range(0, len(cached.content), chunk_size):
+                    yield cached.content[offset:offset + chunk_size]
+            except httpx.HTTPError as e:
+                self.errors += 1
+                print(f"Failed to fetch {url}: {e}")
+
+    async def _stream_body(self, url, response, chunk_size):
+        response.raise_for_status()
+        store = self.cache is not None and self.cache.cacheable(response.headers)
+        if self.cache is not None:
+            self.cache.miss()
+        body = []
+        size = 0
+        async for chunk in response.aiter_bytes(chunk_size):
+            self.bytes_received += len(chunk)
+            if store:
+                size += len(chunk)
+                store = size <= self.cache.max_entry_bytes
+                if store:
+                    body.append(chunk)
+                else:
+                    body = []
+            yield chunk
+        if store:
+            await asyncio.to_thread(self.cache.store, url, response.headers, b"".join(body), str(response.url))
+
+    async def get_many(self, urls, timeout=None, budgeted=True):
+        """
+        Fetches many URLs concurrently. Results are returned in the order of `urls`, with None for failures.
+        """
+        return await asyncio.gather(*[self.get(url, timeout=timeout, budgeted=budgeted) for url in urls])
+
+    def stats(self):
+        stats = {"requests": self.requests, "errors": self.errors, "bytes_received": self.bytes_received}
+        if self.budget is not None:
+            stats.update({"budget_pages": self.budget.pages, "budget_elapsed": round(self.budget.elapsed, 2)})
+        if self.cache is not None:
+            stats["cache_hits"] = self.cache_hits
+        return stats
@@ -0,0 +1,261 @@
+# ingest_pipeline.py
+import asyncio
+import os
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.services.scraper_services.near_duplicates import NearDuplicateIndex, near_duplicates_enabled
+from app.services.scraper_services.url_normalization import canonicalize_url
+
+load_dotenv()
+
+
+class StageStats:
+    """Items taken in and handed on by a pipeline stage, and the seconds it spent working rather than waiting."""
+
+    def __init__(self):
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+
+    def as_dict(self):
+        return {"in": self.items_in, "out": self.items_out, "busy_seconds": round(self.busy_seconds, 3),
+                "per_second": round(self.items_in / self.busy_seconds, 1) if self.busy_seconds else None}
+
+
+class StreamingBoilerplateFilter:
+    """
+    Line-frequency boilerplate removal, as in `DocumentHandler.remove_duplicate_content`, for pages arriving one at
+    a time. The first `warmup` pages are held back and cleaned together; each later page is cleaned against the line
+    counts of all pages seen so far, so it is released right away.
+    """
+
+    def __init__(self, doc_handler, warmup=None, max_page_fraction=None, min_pages=None):
+        self.doc_handler = doc_handler
+        self.max_page_fraction = max_page_fraction or float(os.getenv("SCRAPER_BOILERPLATE_FRACTION", "0.8"))
+        self.min_pages = min_pages or int(os.getenv("SCRAPER_BOILERPLATE_MIN_PAGES", "5"))
+        self.warmup = max(warmup or int(os.getenv("SCRAPER_BOILERPLATE_WARMUP", "8")), self.min_pages)
+        self.page_counts = Counter()
+        self.pages = 0
+        self.held = []
+
+    def _clean(self, doc):
+        max_pages = self.max_page_fraction * self.pages
+        keys = [(line, self.doc_handler.boilerplate_key(line)) for line in doc.page_content.split("\n")]
+        lines = [line for line, key in keys if not key or self.page_counts[key] <= max_pages]
+        doc.page_content = "\n".join(lines).strip()
+        return doc
+
+    def add(self, doc):
+        """Counts the page's lines and returns the pages that can be released, cleaned."""
+        doc.page_content = self.doc_handler.clean_text(doc.page_content)
+        self.page_counts.update({self.doc_handler.boilerplate_key(line) for line in doc.page_content.split("\n")})
+        self.pages += 1
+        if self.pages < self.warmup:
+            self.held.append(doc)
+            return []
+        held, self.held = self.held + [doc], []
+        return [self._clean(held_doc) for held_doc in held]
+
+    def flush(self):
+        """Releases the pages still held when fewer than `warmup` pages arrived."""
+        held, self.held = self.held, []
+        if self.pages < self.min_pages:
+            return held
+        return [self._clean(doc) for doc in held]
+
+
+class IngestPipeline:
+    """
+    Loads pages into the vector store as a pipeline of asyncio stages joined by bounded queues: pages are fetched,
+    parsed and cleaned as they arrive, split and de-duplicated, embedded in rolling batches and upserted in chunks,
+    so downloads, parsing and embedding calls overlap. A full queue blocks the stage feeding it, which bounds the
+    pages and chunks held in memory. Parsing, embedding and upserts run in worker threads to keep the loop free.
+    """
+
+    def __init__(self, agent, doc_handler, fetcher, load_page, page_sink=None, queue_size=None, embed_batch=None,
+                 upsert_batch=None, fetch_workers=None):
+        """
+        Args:
+            agent: The SalesQAAgent whose store receives the chunks.
+            doc_handler: The DocumentHandler used for text cleaning.
+            fetcher: The run's AsyncFetcher.
+            load_page: Parses a fetch result into a (Document, canonical URL or None) pair.
+            page_sink: Called on the event loop with batches of cleaned pages, so it must not block, e.g. it hands
+                them to a background database write.
+            queue_size: Items each queue holds before its producer waits, SCRAPER_INGEST_QUEUE_SIZE (32) by default.
+            embed_batch: The most chunks per embedding call, SCRAPER_INGEST_EMBED_BATCH (64) by default.
+            upsert_batch: The most records per upsert, SCRAPER_INGEST_UPSERT_BATCH (200) by default.
+            fetch_workers: Concurrent downloads, the fetcher's per-host limit by default.
+        """
+        self.agent = agent
+        self.doc_handler = doc_handler
+        self.fetcher = fetcher
+        self.load_page = load_page
+        self.page_sink = page_sink
+        self.queue_size = queue_size or int(os.getenv("SCRAPER_INGEST_QUEUE_SIZE", "32"))
+        self.embed_batch = embed_batch or int(os.getenv("SCRAPER_INGEST_EMBED_BATCH", "64"))
+        self.upsert_batch = upsert_batch or int(os.getenv("SCRAPER_INGEST_UPSERT_BATCH", "200"))
+        self.fetch_workers = fetch_workers or fetcher.max_per_host
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=0)
+        self.stats = {stage: StageStats() for stage in ["fetch", "parse", "split", "embed", "upsert"]}
+        self.pages_stored = 0
+        self.sources = []
+
+    async def _fetch(self, urls, pages):
+        stats = self.stats["fetch"]
+        url_iterator = iter(urls)
+
+        async def worker():
+            for url in url_iterator:
+                started = time.monotonic()
+                response = await self.fetcher.get(url)
+                stats.items_in += 1
+                stats.busy_seconds += time.monotonic() - started
+                if response is not None:
+                    stats.items_out += 1
+                    await pages.put((url, response))
+
+        await asyncio.gather(*[worker() for _ in range(max(1, min(self.fetch_workers, len(urls))))])
+        await pages.put(None)
+
+    async def _parse(self, pages, documents, page_metadata):
+        stats = self.stats["parse"]
+        boilerplate = StreamingBoilerplateFilter(self.doc_handler)
+        seen = set()
+        page_batch = []
+
+        async def release(docs):
+            docs = [doc for doc in docs if doc.page_content.strip()]
+            stats.items_out += len(docs)
+            self.pages_stored += len(docs)
+            self.sources.extend(doc.metadata["source"] for doc in docs)
+            page_batch.extend(docs)
+            if self.page_sink is not None and len(page_batch) >= self.queue_size:
+                self.page_sink(list(page_batch))
+                page_batch.clear()
+            for doc in docs:
+                await documents.put(doc)
+
+        while (item := await pages.get()) is not None:
+            url, response = item
+            started = time.monotonic()
+            stats.items_in += 1
+            doc, canonical_url = await asyncio.to_thread(self.load_page, url, response)
+            keys = {canonicalize_url(url), canonicalize_url(canonical_url or url)}
+            if keys & seen:
+                print(f"Skipping {url}, a page with the same canonical URL was already loaded")
+                stats.busy_seconds += time.monotonic() - started
+                continue
+            seen.update(keys)
+            doc.metadata.update(page_metadata.get(url, {}))
+            ready = boilerplate.add(doc)
+            stats.busy_seconds += time.monotonic() - started
+            await release(ready)
+        await release(boilerplate.flush())
+        if self.page_sink is not None and page_batch:
+            self.page_sink(list(page_batch))
+        await documents.put(None)
+
+    async def _split(self, documents, chunks):
+        stats = self.stats["split"]
+        unique_texts = set()
+        near_duplicates = NearDuplicateIndex() if near_duplicates_enabled() else None
+        while (doc := await documents.get()) is not None:
+            started = time.monotonic()
+            stats.items_in += 1
+            # Same splitting and filtering as split_documents, with the seen texts kept across pages
+            splits = []
+            for split in self.text_splitter.split_documents([doc]):
+                text = split.page_content.strip()
+                if text not in unique_texts and len(split.page_content) > 100:
+                    unique_texts.add(text)
+                    splits.append(split)
+            if near_duplicates is not None and splits:
+                keep = near_duplicates.add([split.page_content for split in splits])
+                splits = [split for split, kept in zip(splits, keep) if kept]
+            stats.busy_seconds += time.monotonic() - started
+            stats.items_out += len(splits)
+            for split in splits:
+                await chunks.put(split)
+        await chunks.put(None)
+
+    @staticmethod
+    def _drain(queue, first, limit):
+        """Takes `first` plus whatever is already queued, up to `limit` items, without waiting."""
+        batch = [first]
+        done = False
+        while len(batch) < limit and not queue.empty():
+            item = queue.get_nowait()
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        return batch, done
+
+    async def _embed(self, chunks, records):
+        stats = self.stats["embed"]
+        done = False
+        while not done and (first := await chunks.get()) is not None:
+            # Batches grow while the embedding calls are the bottleneck and stay small while chunks trickle in
+            batch, done = self._drain(chunks, first, self.embed_batch)
+            started = time.monotonic()
+            stats.items_in += len(batch)
+            embedded = await asyncio.to_thread(self.agent.embed_splits, batch)
+            stats.busy_seconds += time.monotonic() - started
+            stats.items_out += len(embedded)
+            for record in embedded:
+                await records.put(record)
+        await records.put(None)
+
+    async def _upsert(self, records):
+        stats = self.stats["upsert"]
+        done = False
+        while not done and (first := await records.get()) is not None:
+            batch, done = self._drain(records, first, self.upsert_batch)
+            started = time.monotonic()
+            stats.items_in += len(batch)
+            # The vector index is built once, after the last chunk
+            await asyncio.to_thread(self.agent.store.upsert, batch, False)
+            stats.busy_seconds += time.monotonic() - started
+            stats.items_out += len(batch)
+        if stats.items_out:
+            started = time.monotonic()
+            await asyncio.to_thread(self.agent.store.create_index)
+            stats.busy_seconds += time.monotonic() - started
+
+    async def run(self, urls, page_metadata=None):
+        """
+        Ingests the pages at `urls`.
+
+        Args:
+            urls: The page URLs, most relevant first.
+            page_metadata: {url: dict} merged into the metadata of each page and its chunks.
+
+        Returns:
+            int: The number of pages stored.
+        """
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(4)]
+        pages, documents, chunks, records = queues
+        started = time.monotonic()
+        tasks = [
+            asyncio.create_task(self._fetch(urls, pages)),
+            asyncio.create_task(self._parse(pages, documents, page_metadata or {})),
+            asyncio.create_task(self._split(documents, chunks)),
+            asyncio.create_task(self._embed(chunks, records)),
+            asyncio.create_task(self._upsert(records)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # A failed stage would leave its neighbours waiting on a queue forever
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        print(f"Ingested {self.pages_stored} pages in {time.monotonic() - started:.2f}s: "
+              f"{ {stage: stats.as_dict() for stage, stats in self.stats.items()} }")
+        return self.pages_stored
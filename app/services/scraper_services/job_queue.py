@@ -0,0 +1,235 @@
+# job_queue.py
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from app.models.scraper_models import SalesScraperRequestBody
+
+
+class ScraperJob:
+    """A queued scraper run waiting for a worker."""
+
+    def __init__(self, run_id, request_body, enqueued_at=None):
+        self.run_id = run_id
+        self.request_body = request_body
+        self.enqueued_at = enqueued_at if enqueued_at is not None else time.monotonic()
+
+
+class ScraperJobQueue:
+    """
+    Bounded in-process job queue drained by a fixed pool of async workers.
+
+    Each job is handed to `handler(run_id, request_body)`. The number of runs in flight never exceeds
+    the number of workers, and enqueueing fails fast once `max_size` jobs are waiting. The workers share the event
+    loop with the API, so the handler must make its synchronous calls in worker threads (`asyncio.to_thread`).
+    """
+
+    def __init__(self, handler, workers=None, max_size=None, stats_window=200):
+        self.handler = handler
+        self.workers = workers or int(os.getenv("SCRAPER_WORKERS", "2"))
+        self.max_size = max_size if max_size is not None else int(os.getenv("SCRAPER_QUEUE_SIZE", "50"))
+        self._queue = None
+        self._tasks = []
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait_times = deque(maxlen=stats_window)
+        self._run_times = deque(maxlen=stats_window)
+
+    @property
+    def started(self):
+        return bool(self._tasks)
+
+    async def start(self):
+        """Creates the queue and spawns the worker tasks on the running event loop."""
+        if self.started:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker(i), name=f"scraper-worker-{i}") for i in range(self.workers)]
+        print(f"Started {self.workers} scraper workers (queue size {self.max_size})")
+
+    async def stop(self):
+        """Cancels the workers. Jobs still waiting in the queue are dropped."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        print("Stopped scraper workers")
+
+    def enqueue(self, run_id, request_body):
+        """
+        Adds a run to the queue without waiting.
+
+        Returns:
+            int: The number of jobs waiting ahead of this one.
+
+        Raises:
+            RuntimeError: If the workers have not been started.
+            asyncio.QueueFull: If `max_size` jobs are already waiting.
+        """
+        if not self.started:
+            raise RuntimeError("Scraper job queue has not been started")
+        position = self._queue.qsize()
+        try:
+            self._queue.put_nowait(ScraperJob(run_id, request_body))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            raise
+        return position
+
+    async def _next_job(self):
+        return await self._queue.get()
+
+    async def _run_job(self, job):
+        await self.handler(job.run_id, job.request_body)
+
+    def _job_done(self, job):
+        self._queue.task_done()
+
+    async def _worker(self, index):
+        while True:
+            job = await self._next_job()
+            started_at = time.monotonic()
+            self._wait_times.append(started_at - job.enqueued_at)
+            self._running += 1
+            try:
+                print(f"Worker {index} processing run {job.run_id}")
+                await self._run_job(job)
+                self._completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                print(f"Worker {index} failed run {job.run_id}: {e}")
+            finally:
+                self._running -= 1
+                self._run_times.append(time.monotonic() - started_at)
+                self._job_done(job)
+
+    def stats(self):
+        """Returns queue depth, throughput counters and wait/run time summaries in seconds."""
+        return {
+            "workers": self.workers,
+            "max_size": self.max_size,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "wait_time": _summarize(self._wait_times),
+            "run_time": _summarize(self._run_times),
+        }
+
+
+class LeasedScraperJobQueue(ScraperJobQueue):
+    """
+    Worker pool that claims runs from the shared `sales_scraper_runs` table instead of a local queue.
+
+    Every node running this pool polls the same table through a `RunLeaseStore`, so throughput grows with
+    the number of nodes. A heartbeat keeps the lease alive while a run is processed; if the lease is lost the
+    local run is cancelled, and if a node dies its runs are taken over once their leases expire. The heartbeat runs
+    in its own thread, so a busy event loop cannot delay it past the lease.
+
+    Only the runs table is shared. The node-local SQLite state (the crawl state and the HTTP, embedding and ranking
+    caches) is not, so a run taken over by another node starts from that node's own state.
+    """
+
+    def __init__(self, handler, lease_store, workers=None, poll_interval=None, heartbeat_interval=None, stats_window=200):
+        super().__init__(handler, workers=workers, max_size=0, stats_window=stats_window)
+        self.lease_store = lease_store
+        self.poll_interval = poll_interval or float(os.getenv("SCRAPER_POLL_SECONDS", "5"))
+        self.heartbeat_interval = heartbeat_interval or lease_store.lease_seconds / 3
+        self._wakeup = None
+        self._pending = 0
+
+    async def start(self):
+        if self.started:
+            return
+        await asyncio.to_thread(self.lease_store.ensure_schema)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i), name=f"scraper-worker-{i}") for i in range(self.workers)]
+        print(f"Started {self.workers} leased scraper workers as {self.lease_store.owner}")
+
+    def enqueue(self, run_id, request_body):
+        """
+        The run is already Pending in the table, so this only wakes an idle local worker to claim it.
+
+        Returns:
+            int: The number of Pending runs last observed across all nodes.
+        """
+        if not self.started:
+            raise RuntimeError("Scraper job queue has not been started")
+        self._wakeup.set()
+        return self._pending
+
+    async def _next_job(self):
+        while True:
+            self._wakeup.clear()
+            row = await asyncio.to_thread(self.lease_store.claim_run)
+            if row is not None:
+                request_body = SalesScraperRequestBody(
+                    company_description=row["description"] or "", url=row["url"], email=row["email"])
+                print(f"Claimed run {row['id']} (attempt {row['attempts']})")
+                return ScraperJob(row["id"], request_body, time.monotonic() - row["waited_seconds"])
+
+            await asyncio.to_thread(self.lease_store.fail_exhausted_runs)
+            self._pending = await asyncio.to_thread(self.lease_store.pending_count)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_job(self, job):
+        run = asyncio.create_task(super()._run_job(job))
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, run, asyncio.get_running_loop(), stopped),
+                                     name=f"lease-heartbeat-{job.run_id}", daemon=True)
+        heartbeat.start()
+        try:
+            await asyncio.wait({run})
+        finally:
+            stopped.set()
+            if not run.done():
+                run.cancel()
+            # No heartbeat may extend the lease after it is released
+            await asyncio.to_thread(heartbeat.join)
+            await asyncio.to_thread(self.lease_store.release, job.run_id)
+        if run.cancelled():
+            raise RuntimeError(f"Lease on run {job.run_id} was lost")
+        run.result()
+
+    def _heartbeat(self, job, run, loop, stopped):
+        while not stopped.wait(self.heartbeat_interval):
+            try:
+                alive = self.lease_store.heartbeat(job.run_id)
+            except Exception as e:
+                print(f"Heartbeat for run {job.run_id} failed: {e}")
+                continue
+            if not alive:
+                print(f"Lost lease on run {job.run_id}, cancelling it on this node")
+                loop.call_soon_threadsafe(run.cancel)
+                return
+
+    def _job_done(self, job):
+        pass
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"mode": "lease", "owner": self.lease_store.owner, "queue_depth": self._pending})
+        return stats
+
+
+def _summarize(samples):
+    if not samples:
+        return {"count": 0, "avg": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return {
+        "count": len(ordered),
+        "avg": round(sum(ordered) / len(ordered), 3),
+        "p95": round(p95, 3),
+        "max": round(ordered[-1], 3),
+    }
@@ -0,0 +1,109 @@
+# near_duplicates.py
+import hashlib
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.services.scraper_services.embedding_cache import normalize_text
+
+load_dotenv()
+
+SIGNATURE_BITS = 64
+# Set bits of every byte value, used to count differing signature bits
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+# Rows of the pairwise distance matrix computed at a time, bounding memory to block x n x 8 bytes
+DISTANCE_BLOCK = 512
+
+
+def shingles(text, size=3):
+    """Overlapping word n-grams of the normalized, lower-cased text; short texts give a single shingle."""
+    words = normalize_text(text).lower().split()
+    if len(words) <= size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def simhash_signatures(texts, shingle_size=3):
+    """
+    Computes 64-bit SimHash signatures of the texts. Shingles are hashed one by one, then every signature is
+    built at once: the shingle hashes are unpacked into a +1/-1 bit matrix, summed per text and thresholded.
+
+    Returns:
+        np.ndarray: One uint64 signature per text.
+    """
+    if not texts:
+        return np.zeros(0, dtype=np.uint64)
+    text_shingles = [shingles(text, shingle_size) for text in texts]
+    hashes = np.frombuffer(b"".join(hashlib.blake2b(shingle.encode(), digest_size=8).digest()
+                                    for text in text_shingles for shingle in text), dtype=np.uint8)
+    bits = np.unpackbits(hashes.reshape(-1, 8), axis=1).astype(np.int32) * 2 - 1
+    starts = np.cumsum([0] + [len(text) for text in text_shingles[:-1]])
+    weights = np.add.reduceat(bits, starts, axis=0)
+    return np.packbits(weights > 0, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def hamming_distances(signatures, others):
+    """Differing bits between every signature in `signatures` and every one in `others`, as a matrix."""
+    xor = np.bitwise_xor(signatures[:, None], others[None, :])
+    return POPCOUNT[xor.view(np.uint8).reshape(len(signatures), len(others), 8)].sum(axis=2)
+
+
+class NearDuplicateIndex:
+    """
+    Signatures of the texts kept so far. Texts added later, in any number of batches, are dropped when their SimHash
+    similarity (the share of equal signature bits) to a kept text is at least `threshold`,
+    SCRAPER_NEAR_DUPLICATE_THRESHOLD (0.9) by default.
+    """
+
+    def __init__(self, threshold=None):
+        threshold = threshold if threshold is not None else float(os.getenv("SCRAPER_NEAR_DUPLICATE_THRESHOLD", "0.9"))
+        self.max_distance = int((1 - threshold) * SIGNATURE_BITS)
+        self.signatures = np.zeros(0, dtype=np.uint64)
+
+    def add(self, texts):
+        """
+        Returns:
+            np.ndarray: A boolean keep flag per text. Kept texts are added to the index.
+        """
+        signatures = simhash_signatures(texts)
+        keep = np.ones(len(texts), dtype=bool)
+        for start in range(0, len(texts), DISTANCE_BLOCK):
+            block = signatures[start:start + DISTANCE_BLOCK]
+            near_kept = (hamming_distances(block, self.signatures) <= self.max_distance).any(axis=1)
+            near = hamming_distances(block, block) <= self.max_distance
+            for row in range(len(block)):
+                # Only earlier texts that were kept count, so the first of a group of near-duplicates survives
+                if near_kept[row] or near[row, :row][keep[start:start + row]].any():
+                    keep[start + row] = False
+            self.signatures = np.concatenate([self.signatures, block[keep[start:start + len(block)]]])
+        return keep
+
+
+def near_duplicate_mask(texts, threshold=None):
+    """
+    Marks the texts to keep: a text is dropped when it is a near-duplicate of an earlier kept text, see
+    `NearDuplicateIndex`.
+
+    Returns:
+        np.ndarray: A boolean keep flag per text.
+    """
+    return NearDuplicateIndex(threshold).add(texts)
+
+
+def near_duplicates_enabled():
+    return os.getenv("SCRAPER_NEAR_DUPLICATES", "true").lower() in ["true", "1"]
+
+
+def remove_near_duplicates(docs, threshold=None):
+    """
+    Drops documents whose content is a near-duplicate of an earlier one, e.g. the same bio on a team page and a
+    person page, or the same call to action with different whitespace.
+
+    Returns:
+        tuple: The documents kept, in order, and the number dropped.
+    """
+    if not near_duplicates_enabled():
+        return docs, 0
+    keep = near_duplicate_mask([doc.page_content for doc in docs], threshold)
+    return [doc for doc, kept in zip(docs, keep) if kept], int((~keep).sum())
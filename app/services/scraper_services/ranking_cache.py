@@ -0,0 +1,118 @@
+# ranking_cache.py
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from app.models.scraper_models import PageRanked
+from app.services.scraper_services.url_normalization import canonicalize_url
+
+load_dotenv()
+
+# Paths that mean the same kind of page on any site, whose score is shared across domains
+GENERIC_PATHS = {
+    "/about", "/about-us", "/company", "/our-company", "/who-we-are", "/team", "/our-team", "/the-team", "/people",
+    "/leadership", "/management", "/executives", "/staff", "/founders", "/careers", "/jobs", "/contact",
+    "/contact-us",
+}
+
+
+class RankingCache:
+    """
+    Persistent cache of LLM URL rankings shared by all runs.
+
+    Scores are keyed by the canonical URL and a model/prompt version, so changing either starts from an empty cache.
+    The generic paths in GENERIC_PATHS (`/about`, `/team`, ...) are also keyed by path alone, which lets their score
+    be reused for other domains. Entries expire after `ttl_seconds` and the least recently used ones are evicted past `max_entries`.
+    """
+
+    def __init__(self, path=None, version="", ttl_seconds=None, max_entries=None):
+        self.path = path or os.getenv("SCRAPER_RANKING_CACHE_PATH", "tmp/ranking_cache.sqlite")
+        self.version = version
+        self.ttl_seconds = ttl_seconds or float(os.getenv("SCRAPER_RANKING_CACHE_TTL_DAYS", "30")) * 86400
+        self.max_entries = max_entries or int(os.getenv("SCRAPER_RANKING_CACHE_MAX_ENTRIES", "200000"))
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rankings (
+                key TEXT PRIMARY KEY,
+                company_likelihood REAL NOT NULL,
+                people_likelihood REAL NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS rankings_accessed_idx ON rankings (accessed_at)")
+        self._conn.commit()
+
+    def _keys(self, url):
+        canonical = canonicalize_url(url)
+        keys = [f"{self.version}|url|{canonical}"]
+        path = urlsplit(canonical).path.rstrip("/").lower()
+        if path in GENERIC_PATHS:
+            keys.append(f"{self.version}|path|{path}")
+        return keys
+
+    def lookup(self, urls):
+        """
+        Returns the cached scores of the URLs that have one.
+
+        Returns:
+            dict: {url: PageRanked} for every URL found in the cache.
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            for url in urls:
+                for key in self._keys(url):
+                    row = self._conn.execute(
+                        "SELECT company_likelihood, people_likelihood FROM rankings WHERE key = ? AND stored_at > ?",
+                        (key, now - self.ttl_seconds)).fetchone()
+                    if row:
+                        found[url] = PageRanked(url=url, company_likelihood=row[0], people_likelihood=row[1])
+                        self._conn.execute("UPDATE rankings SET accessed_at = ? WHERE key = ?", (now, key))
+                        break
+            self._conn.commit()
+        return found
+
+    def store(self, pages):
+        """Caches the LLM scores of ranked pages, then evicts expired and least recently used entries."""
+        now = time.time()
+        rows = [(key, page.company_likelihood, page.people_likelihood, now, now)
+                for page in pages for key in self._keys(page.url)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO rankings VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.execute("DELETE FROM rankings WHERE stored_at <= ?", (now - self.ttl_seconds,))
+            self._conn.execute("""
+                DELETE FROM rankings WHERE key IN (
+                    SELECT key FROM rankings ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rankings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_ranking_caches = {}
+
+
+def get_ranking_cache(version):
+    """
+    Returns the process-wide ranking cache for a model/prompt version, or None when it is disabled with
+    SCRAPER_RANKING_CACHE=false.
+    """
+    if os.getenv("SCRAPER_RANKING_CACHE", "true").lower() not in ["true", "1"]:
+        return None
+    if version not in _ranking_caches:
+        _ranking_caches[version] = RankingCache(version=version)
+    return _ranking_caches[version]
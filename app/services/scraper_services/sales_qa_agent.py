@@ -1,9 +1,8 @@
 # sales_qa_agent.py
 import json
 import os
-from typing import List, Type
+from typing import List, NamedTuple, Optional, Set, Type
 
-import vecs
 from dotenv import load_dotenv
 from langchain.output_parsers import OutputFixingParser
 from langchain_core.output_parsers.pydantic import PydanticOutputParser
@@ -11,19 +10,95 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from pydantic import BaseModel, ValidationError
 
-from app.models.scraper_models import CompanyResponse, CheckResponse, SummaryResponse, StrategyResponse, PeopleResponse
+from app.models.scraper_models import CompanyResponse, CheckResponse, SummaryResponse, StrategyResponse, PeopleResponse, \
+    PeopleVerification
+from app.services.scraper_services.embedding_cache import CachedEmbeddings, get_embedding_cache, text_hash
+from app.services.scraper_services.vector_store import VecsVectorStore, VectorQuery, VectorStore, get_numpy_store, \
+    get_vecs_client
 
 load_dotenv()
 
+COMPANY_QUERY = "What company does this website belong to?"
+# Queries asked on every run, embedded once at startup
+FIXED_QUERIES = [COMPANY_QUERY]
+EMBEDDING_DIMENSION = 1536
+# "per_domain" keeps one collection per site, "shared" one collection for all sites partitioned by domain metadata
+VECTOR_STORAGE = os.getenv("SCRAPER_VECTOR_STORAGE", "per_domain")
+SHARED_COLLECTION = os.getenv("SCRAPER_SHARED_COLLECTION", "web_pages")
+# "vecs" searches Postgres on every retrieval, "numpy" loads small collections into memory and searches them there
+VECTOR_BACKEND = os.getenv("SCRAPER_VECTOR_BACKEND", "vecs")
+# Estimated tokens of the verification and summary returned for one person in a batched verification
+PERSON_ANSWER_TOKENS = 120
+QA_SYSTEM_PROMPT = (
+    "You are an assistant for question-answering tasks. "
+    "Use the following pieces of retrieved context to answer "
+    "the question. If you don't know the answer, say that you "
+    "don't know. Use three sentences maximum and keep the "
+    "answer concise."
+)
+
+
+def create_embedding_model():
+    """OpenAI embeddings behind the persistent embedding cache, unless the cache is disabled."""
+    embeddings = OpenAIEmbeddings()
+    cache = get_embedding_cache()
+    return CachedEmbeddings(embeddings, cache) if cache is not None else embeddings
+
+
+def warm_query_embeddings():
+    """Embeds the fixed queries so the first runs read them from the embedding cache."""
+    embedding_model = create_embedding_model()
+    for query in FIXED_QUERIES:
+        embedding_model.embed_query(query)
+
+
+def record_id(text: str, domain: Optional[str] = None, source: Optional[str] = None) -> str:
+    """
+    Compact vecs record id derived from the chunk text, the page it is on and, in the shared collection, the domain.
+    Each page owns its records, so replacing the chunks of one page never removes the same text from another.
+    """
+    return text_hash("\n".join(part for part in [domain, source, text] if part))[:32]
+
+
+def context_text(doc) -> str:
+    """The text of a retrieved (id, distance, metadata) row."""
+    # Records stored before ids were hashed use the text itself as id
+    return doc[2].get("text", doc[0]) if len(doc) > 2 else doc[0]
+
+
+class StoredPage(NamedTuple):
+    """What the collection holds for one page: its content hash, ranking scores and chunk record ids."""
+    page_hash: Optional[str]
+    company_likelihood: float
+    people_likelihood: float
+    ids: Set[str]
+
 
 class SalesQAAgent:
-    def __init__(self, collection_name: str):
-        self.collection_name = collection_name
-        # Initialize vecs client
-        DB_CONNECTION = os.getenv("SUPABASE_URI")  # PostgresSQL connection string
-        if not DB_CONNECTION:
-            raise ValueError("DB_CONNECTION environment variable is not set.")
-        self.client = vecs.Client(DB_CONNECTION)
+    def __init__(self, collection_name: str, domain: Optional[str] = None, store: Optional[VectorStore] = None):
+        """
+        Args:
+            collection_name: The per-site collection, used unless SCRAPER_VECTOR_STORAGE is "shared".
+            domain: The site's full domain (see `site_domain`), which partitions the shared collection.
+            store: Where the embeddings are kept. By default a vecs collection, read through an in-memory copy when
+                   SCRAPER_VECTOR_BACKEND is "numpy".
+        """
+        # In shared storage every record is tagged with the domain and every query is filtered by it
+        self.domain = domain if VECTOR_STORAGE == "shared" else None
+        if VECTOR_STORAGE == "shared" and not domain:
+            raise ValueError("A domain is required with SCRAPER_VECTOR_STORAGE=shared.")
+        self.collection_name = SHARED_COLLECTION if self.domain else collection_name
+        self.client = None
+        if store is None:
+            # Initialize vecs client
+            DB_CONNECTION = os.getenv("SUPABASE_URI")  # PostgresSQL connection string
+            if not DB_CONNECTION:
+                raise ValueError("DB_CONNECTION environment variable is not set.")
+            self.client = get_vecs_client(DB_CONNECTION)
+            store = VecsVectorStore(self.client, self.collection_name, self.domain, dimension=EMBEDDING_DIMENSION)
+            if VECTOR_BACKEND == "numpy":
+                store = get_numpy_store(f"{self.collection_name}|{self.domain or ''}", store)
+        self.store = store
 
         # if self.collection_exists():
         #     self.collection = self.client.get_collection(self.collection_name)
@@ -32,70 +107,123 @@ class SalesQAAgent:
         #     print(f"Creating collection '{collection_name}'.")
         #     self.collection = self.client.create_collection(self.collection_name, dimension=1536)
         # Initialize the embedding model
-        self.embedding_model = OpenAIEmbeddings()
+        self.embedding_model = create_embedding_model()
 
         # Initialize the LLM with function calling capabilities
         self.llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2)
 
     def collection_exists(self):
-        print([x.name for x in self.client.list_collections()])
-        return self.collection_name in [x.name for x in self.client.list_collections()]
+        names = [x.name for x in self.client.list_collections()]
+        print(names)
+        return self.collection_name in names
+
+    def open_collection(self):
+        """
+        Opens the collection holding the site's embeddings, creating it if needed.
+
+        Returns:
+            bool: Whether embeddings of the site are already stored.
+        """
+        return self.store.open()
+
+    def _metadata(self, doc):
+        # The text is kept in the metadata now that the record id is a hash of it
+        return {**doc.metadata, "text": doc.page_content}
 
     def store_embeddings(self, splits):
         """Stores embeddings into the vecs collection."""
+        # TEST: if records ae empty 
+        # Upsert the embeddings into the collection
+        self.store.upsert(self.embed_splits(splits))
+
+    def embed_splits(self, splits):
+        """Embeds the splits into (id, vector, metadata) records ready for the vector store."""
         texts = [doc.page_content for doc in splits]
         embeddings = self.embedding_model.embed_documents(texts)
 
         records = []
         for i, text in enumerate(texts):
             embedding = embeddings[i]
-            metadata = splits[i].metadata
-            record = {
-                "id": f"doc_{i}",  # Ensure unique ID for each record
-                "value": text,
-                "embedding": embedding,
-                "metadata": metadata
-            }
-            records.append((text, embedding, metadata))
-            # records.append(record)
-        # TEST: if records ae empty 
-        # Upsert the embeddings into the collection
-        self.collection.upsert(records=records)
-        # Create an index if not already created
-        self.collection.create_index()
+            metadata = self._metadata(splits[i])
+            records.append((record_id(text, self.domain, metadata.get("source")), embedding, metadata))
+        return records
+
+    def delete_sources(self, sources: List[str]):
+        """Deletes the stored embeddings of the given page URLs."""
+        if sources:
+            self.store.delete(filters={"source": {"$in": list(dict.fromkeys(sources))}})
+
+    def stored_pages(self, sources=None):
+        """
+        Reads the pages stored in the collection, optionally only the given page URLs.
+
+        Returns:
+            dict: {source: StoredPage}. The hash is None for pages stored before content hashes were recorded.
+        """
+        pages = {}
+        for id, metadata in self.store.metadata(sources):
+            page_source, page_hash = metadata.get("source"), metadata.get("page_hash")
+            page = pages.get(page_source)
+            if page is None:
+                page = pages[page_source] = StoredPage(page_hash, float(metadata.get("company_likelihood") or 0),
+                                                       float(metadata.get("people_likelihood") or 0), set())
+            elif page.page_hash != page_hash:
+                # Chunks disagreeing on the hash mean the page was only partly stored
+                page = pages[page_source] = page._replace(page_hash=None)
+            page.ids.add(id)
+        return pages
+
+    def update_pages(self, splits, stored_pages):
+        """
+        Replaces the stored chunks of re-loaded pages with their new splits. Chunks that are gone from the pages are
+        deleted and new ones are embedded and upserted, while chunks that did not change only get their metadata
+        rewritten.
+
+        Args:
+            splits: The chunks of the re-loaded pages.
+            stored_pages: {source: StoredPage} as returned by `stored_pages` for these pages.
+
+        Returns:
+            tuple: The number of upserted, deleted and unchanged chunks.
+        """
+        stored_ids = {id for page in stored_pages.values() for id in page.ids}
+        split_ids = [record_id(doc.page_content, self.domain, doc.metadata.get("source")) for doc in splits]
+        stale_ids = stored_ids - set(split_ids)
+        kept = [(id, doc) for id, doc in zip(split_ids, splits) if id in stored_ids]
+        new_splits = [doc for id, doc in zip(split_ids, splits) if id not in stored_ids]
 
-    def retrieve_documents(self, query: str, filters=None, top_k: int = 5) -> List[dict]:
-        """Retrieves documents relevant to the query."""
+        if stale_ids:
+            self.store.delete(ids=list(stale_ids))
+        if kept:
+            self.store.update_metadata([(id, self._metadata(doc)) for id, doc in kept])
+        if new_splits:
+            self.store_embeddings(new_splits)
+        return len(new_splits), len(stale_ids), len(kept)
+
+    def retrieve_documents(self, query: str, filters=None, top_k: int = 5) -> List[tuple]:
+        """Retrieves documents relevant to the query, as (id, distance, metadata) rows closest first."""
         query_embedding = self.embedding_model.embed_query(query)
+        return self.store.query_many([query_embedding], [VectorQuery(query, filters, top_k)])[0]
 
-        # Query the collection
-        results = self.collection.query(
-            data=query_embedding,
-            limit=top_k,
-            include_value=True,
-            include_metadata=True,
-            filters=filters
-        )
+    def retrieve_many(self, queries: List[VectorQuery]) -> List[List[tuple]]:
+        """
+        Retrieves the documents relevant to several queries. The queries are embedded in one batch and searched
+        together, which for the vecs store is a single UNION ALL statement and database round-trip.
 
-        # results is a list of dictionaries with keys: 'id', 'score', 'value', 'metadata'
-        return results
+        Returns:
+            list: For each query, its (id, distance, metadata) rows closest first, like `retrieve_documents`.
+        """
+        if not queries:
+            return []
+        embeddings = self.embedding_model.embed_documents([query.query for query in queries])
+        return self.store.query_many(embeddings, queries)
 
-    def ask_question(self, query: str, response_model: Type[BaseModel], context_docs: List[dict]):
-        """Asks the LLM a question and ensures the response matches the Pydantic model."""
-        # Create the output parser
-        output_parser = PydanticOutputParser(pydantic_object=response_model)
-        
+    def _question_prompt(self, query: str, output_parser: PydanticOutputParser, context_docs: List[dict]):
+        """Formats the question-answering prompt for a query and its retrieved context."""
         # Create the prompt
         prompt_template = ChatPromptTemplate(
             [
-                (
-                    "system",
-                    "You are an assistant for question-answering tasks. "
-                    "Use the following pieces of retrieved context to answer "
-                    "the question. If you don't know the answer, say that you "
-                    "don't know. Use three sentences maximum and keep the "
-                    "answer concise."
-                ),
+                ("system", QA_SYSTEM_PROMPT),
                 (
                     "human",
                     "Context:\n{context}\n\n"
@@ -114,7 +242,7 @@ class SalesQAAgent:
         if len(context_docs) > 0:
             print(context_docs[0])
             print(context_docs[0][0])
-            context_texts = [doc[0] for doc in context_docs]
+            context_texts = [context_text(doc) for doc in context_docs]
         else:
             print("context_docs is empty")
             context_texts = []
@@ -125,6 +253,13 @@ class SalesQAAgent:
             question=query,
             format_instructions=format_instructions
         )
+        return prompt
+
+    def ask_question(self, query: str, response_model: Type[BaseModel], context_docs: List[dict]):
+        """Asks the LLM a question and ensures the response matches the Pydantic model."""
+        # Create the output parser
+        output_parser = PydanticOutputParser(pydantic_object=response_model)
+        prompt = self._question_prompt(query, output_parser, context_docs)
         # print(prompt)
         # Call the LLM
         response = self.llm.invoke(prompt)
@@ -146,9 +281,116 @@ class SalesQAAgent:
                 print(f"Failed to fix the output: {fix_error}")
                 return None
 
+    async def aask_question(self, query: str, response_model: Type[BaseModel], context_docs: List[dict]):
+        """Async version of `ask_question`, so several questions can wait on the LLM at once."""
+        output_parser = PydanticOutputParser(pydantic_object=response_model)
+        prompt = self._question_prompt(query, output_parser, context_docs)
+        response = await self.llm.ainvoke(prompt)
+
+        try:
+            parsed_output = output_parser.parse(response.content)
+            print(parsed_output)
+            return parsed_output
+        except (json.JSONDecodeError, ValidationError) as e:
+            print(f"Failed to parse response for query '{query}': {e}")
+
+            fixing_parser = OutputFixingParser.from_llm(parser=output_parser, llm=self.llm)
+            try:
+                return await fixing_parser.aparse(response.content)
+            except Exception as fix_error:
+                print(f"Failed to fix the output: {fix_error}")
+                return None
+
+    def _people_groups(self, people, contexts, batch_tokens):
+        """
+        Splits people into groups whose shared context, deduplicated, and answers stay within `batch_tokens`
+        (about 4 characters per token). A person whose context alone exceeds the budget gets a group of their own.
+
+        Returns:
+            list: Groups of (index, person, context rows) triples.
+        """
+        def tokens(docs, seen):
+            unseen = {doc[0]: doc for doc in docs if doc[0] not in seen}
+            return sum(len(context_text(doc)) // 4 for doc in unseen.values()) + PERSON_ANSWER_TOKENS
+
+        groups = []
+        group = []
+        group_docs = set()
+        group_tokens = 0
+        for i, (person, docs) in enumerate(zip(people, contexts)):
+            if group and group_tokens + tokens(docs, group_docs) > batch_tokens:
+                groups.append(group)
+                group = []
+                group_docs = set()
+                group_tokens = 0
+            group_tokens += tokens(docs, group_docs)
+            group.append((i, person, docs))
+            group_docs.update(doc[0] for doc in docs)
+        if group:
+            groups.append(group)
+        return groups
+
+    def _people_prompt(self, company_name: str, group):
+        docs = {doc[0]: doc for _, _, person_docs in group for doc in person_docs}
+        people_string = "\n".join(f"{i}: {person.name}" + (f" ({person.title})" if person.title else "")
+                                  for i, person, _ in group)
+        prompt_template = ChatPromptTemplate([
+            ("system", QA_SYSTEM_PROMPT),
+            (
+                "human",
+                "Context:\n{context}\n\n"
+                "For each person below, answer whether the context shows they are on the team at {company}, and "
+                "summarize what they do there. Return one entry per person with the id they are listed with.\n"
+                "{people}"
+            ),
+        ])
+        return prompt_template.format_messages(
+            context='\n\n'.join(context_text(doc) for doc in docs.values()),
+            company=company_name,
+            people=people_string
+        )
+
+    async def averify_people(self, company_name: str, people, contexts, batch_tokens=None, max_concurrency=None):
+        """
+        Checks which candidates are on the company's team and summarizes what they do, answering for a whole group of
+        people in one structured LLM call instead of a check and a summary question per person.
+
+        Args:
+            company_name: The company the people should work at.
+            people: The candidate Person objects. The summaries of people on the team are filled in.
+            contexts: For each person, the retrieved (id, distance, metadata) rows about them.
+            batch_tokens: Estimated context and answer tokens per call, SCRAPER_PEOPLE_BATCH_TOKENS by default.
+            max_concurrency: The most calls in flight, SCRAPER_PEOPLE_CONCURRENCY by default.
+
+        Returns:
+            list: For each person whether they are on the team, or None if no answer covered them.
+        """
+        batch_tokens = batch_tokens or int(os.getenv("SCRAPER_PEOPLE_BATCH_TOKENS", "6000"))
+        max_concurrency = max_concurrency or int(os.getenv("SCRAPER_PEOPLE_CONCURRENCY", "5"))
+        groups = self._people_groups(people, contexts, batch_tokens)
+        if not groups:
+            return []
+        print(f"Verifying {len(people)} people in {len(groups)} batched calls")
+        form_model = self.llm.with_structured_output(PeopleVerification)
+        responses = await form_model.abatch([self._people_prompt(company_name, group) for group in groups],
+                                            config={"max_concurrency": max_concurrency}, return_exceptions=True)
+        verified = [None] * len(people)
+        for group, response in zip(groups, responses):
+            if isinstance(response, Exception) or response is None:
+                print(f"Verification of {[person.name for _, person, _ in group]} failed: {response}")
+                continue
+            answers = {answer.id: answer for answer in response.people}
+            for i, person, _ in group:
+                if i not in answers:
+                    continue
+                verified[i] = answers[i].on_team
+                if answers[i].on_team and answers[i].summary:
+                    person.summary = answers[i].summary
+        return verified
+
     def get_company_info(self):
         """Retrieves company information."""
-        company_query = "What company does this website belong to?"
+        company_query = COMPANY_QUERY
         company_context = self.retrieve_documents(company_query)
         company_response = self.ask_question(
             query=company_query,
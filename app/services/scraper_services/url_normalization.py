@@ -0,0 +1,80 @@
+# url_normalization.py
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+# Query parameters that only track where a visitor came from and never change the page
+TRACKING_PARAMS = {
+    "gclid", "dclid", "fbclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl", "ref", "ref_src",
+    "hsa_acc", "hsa_cam", "hsa_grp", "hsa_ad", "hsa_src", "hsa_tgt", "hsa_kw", "hsa_mt", "hsa_net", "hsa_ver",
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "mtm_")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize_url(url):
+    """
+    Normalizes a URL so variants of the same page compare equal.
+
+    The scheme and host are lower-cased and http is treated as https, default ports, fragments, tracking
+    parameters and trailing slashes are dropped, and the remaining query parameters are sorted.
+
+    Args:
+        url (str): An absolute URL.
+
+    Returns:
+        str: The canonical form of the URL, used as a de-duplication key.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme == "http":
+        scheme = "https"
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port not in DEFAULT_PORTS.values():
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    while "//" in path:
+        path = path.replace("//", "/")
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def site_domain(url):
+    """
+    Returns the full host of a URL, lower-cased and without a leading `www.`, e.g. `acme.io` for
+    `https://www.Acme.io/about`. A non-default port is kept.
+    """
+    host = urlsplit(canonicalize_url(url)).netloc
+    return host[4:] if host.startswith("www.") else host
+
+
+def dedupe_urls(items, key=None):
+    """
+    Collapses URL variants of the same page, keeping the first one listed.
+
+    Args:
+        items (list): URLs, or objects holding a URL when `key` is given.
+        key (callable, optional): Returns the URL of an item.
+
+    Returns:
+        list: The items whose canonical URL had not been seen before, in their original order.
+    """
+    seen = set()
+    unique = []
+    for item in items:
+        canonical = canonicalize_url(key(item) if key else item)
+        if canonical not in seen:
+            seen.add(canonical)
+            unique.append(item)
+    return unique
+
+
+def resolve_canonical(url, href):
+    """Resolves the href of a page's <link rel="canonical"> against the page URL, ignoring non-http targets."""
+    if not href:
+        return None
+    canonical = urljoin(url, href.strip())
+    return canonical if urlsplit(canonical).scheme in ("http", "https") else None
@@ -0,0 +1,260 @@
+# url_preranker.py
+"""
+Local URL pre-ranker trained on the scores the LLM ranker has already given.
+
+Train or refresh the model from the ranking log (and optionally the stored documents), with a held-out report:
+    python -m app.services.scraper_services.url_preranker train --holdout 0.2
+Evaluate the saved model against newer LLM labels:
+    python -m app.services.scraper_services.url_preranker report --log tmp/new_rankings.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+from typing import List
+from urllib.parse import urlsplit
+
+import joblib
+from dotenv import load_dotenv
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.linear_model import LogisticRegression
+
+from app.models.scraper_models import PageRanked
+from app.services.scraper_services.url_normalization import canonicalize_url
+
+load_dotenv()
+
+# Same cut-off the controller uses to decide a page is relevant
+RELEVANT_LIKELIHOOD = 0.7
+TARGETS = ("company_likelihood", "people_likelihood")
+
+_loaded_models = {}
+
+
+def url_tokens(url):
+    """
+    Splits a URL path into the lexical features the ranking decision depends on: path words, the words of the
+    last segment, path depth and the shape of the last segment (e.g. a "john-doe" style person slug).
+    """
+    segments = [segment for segment in urlsplit(url).path.lower().split("/") if segment]
+    tokens = [f"depth:{min(len(segments), 5)}"]
+    if not segments:
+        tokens.append("root")
+    for index, segment in enumerate(segments):
+        words = [word for word in re.split(r"[^a-z0-9]+", segment) if word]
+        tokens.extend("num" if word.isdigit() else word for word in words)
+        if index == len(segments) - 1:
+            tokens.extend(f"last:{word}" for word in words if not word.isdigit())
+            tokens.append(f"last_words:{min(len(words), 6)}")
+            if 2 <= len(words) <= 3 and all(word.isalpha() and len(word) > 1 for word in words):
+                tokens.append("shape:name")
+    return tokens
+
+
+class URLPreRanker:
+    """
+    Predicts `company_likelihood` and `people_likelihood` from URL path tokens with one logistic regression per
+    score. Predictions between `low` and `high` are considered unsure and left to the LLM ranker.
+    """
+
+    def __init__(self, low=None, high=None):
+        self.low = low if low is not None else float(os.getenv("SCRAPER_PRERANKER_LOW", "0.2"))
+        self.high = high if high is not None else float(os.getenv("SCRAPER_PRERANKER_HIGH", "0.8"))
+        self.vectorizer = None
+        self.models = {}
+        self.samples = 0
+        self.trained_at = None
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        Loads a trained model, reusing it while the file is unchanged.
+
+        Returns:
+            URLPreRanker | None: The model, or None if none has been trained or it is disabled.
+        """
+        path = path or os.getenv("SCRAPER_PRERANKER_PATH", "tmp/url_preranker.joblib")
+        if os.getenv("SCRAPER_PRERANKER", "true").lower() not in ["true", "1"] or not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        cached = _loaded_models.get(path)
+        if cached is None or cached[0] != mtime:
+            try:
+                cached = (mtime, joblib.load(path))
+            except Exception as e:
+                print(f"Failed to load URL pre-ranker from {path}: {e}")
+                return None
+            _loaded_models[path] = cached
+        return cached[1]
+
+    def save(self, path=None):
+        path = path or os.getenv("SCRAPER_PRERANKER_PATH", "tmp/url_preranker.joblib")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        joblib.dump(self, path)
+        return path
+
+    def fit(self, pages: List[PageRanked]):
+        """
+        Trains both scores on LLM-ranked pages.
+
+        Raises:
+            ValueError: If a score has no positive or no negative example.
+        """
+        urls = [page.url for page in pages]
+        self.vectorizer = CountVectorizer(analyzer=url_tokens, binary=True)
+        features = self.vectorizer.fit_transform(urls)
+        for target in TARGETS:
+            labels = [int(getattr(page, target) > RELEVANT_LIKELIHOOD) for page in pages]
+            if len(set(labels)) < 2:
+                raise ValueError(f"Need both relevant and irrelevant examples to train {target}")
+            model = LogisticRegression(max_iter=1000, class_weight="balanced")
+            model.fit(features, labels)
+            self.models[target] = model
+        self.samples = len(pages)
+        self.trained_at = time.time()
+        return self
+
+    def predict(self, urls: List[str]) -> List[PageRanked]:
+        """Scores URLs with the local models."""
+        if not urls:
+            return []
+        features = self.vectorizer.transform(urls)
+        scores = {target: self.models[target].predict_proba(features)[:, 1] for target in TARGETS}
+        return [PageRanked(url=url, **{target: round(float(scores[target][i]), 3) for target in TARGETS})
+                for i, url in enumerate(urls)]
+
+    def is_confident(self, page: PageRanked):
+        return all(not self.low < getattr(page, target) < self.high for target in TARGETS)
+
+    def split(self, urls: List[str]):
+        """
+        Returns:
+            tuple[List[PageRanked], List[str]]: The pages scored confidently, and the URLs to send to the LLM.
+        """
+        confident = []
+        unsure = []
+        for page in self.predict(urls):
+            if self.is_confident(page):
+                confident.append(page)
+            else:
+                unsure.append(page.url)
+        return confident, unsure
+
+    def evaluate(self, pages: List[PageRanked]):
+        """
+        Compares the local predictions with LLM labels.
+
+        Returns:
+            dict: Per score accuracy, precision and recall over all pages and over the confidently scored ones,
+                and the share of pages the pre-ranker would answer without the LLM.
+        """
+        predictions = self.predict([page.url for page in pages])
+        confident = [self.is_confident(prediction) for prediction in predictions]
+        report = {"samples": len(pages), "local_share": round(sum(confident) / len(pages), 3) if pages else 0.0}
+        for target in TARGETS:
+            labels = [getattr(page, target) > RELEVANT_LIKELIHOOD for page in pages]
+            predicted = [getattr(prediction, target) > 0.5 for prediction in predictions]
+            report[target] = {
+                "all": _classification_report(labels, predicted),
+                "confident": _classification_report(
+                    [label for label, sure in zip(labels, confident) if sure],
+                    [guess for guess, sure in zip(predicted, confident) if sure]),
+            }
+        return report
+
+
+def _classification_report(labels, predicted):
+    true_positives = sum(1 for label, guess in zip(labels, predicted) if label and guess)
+    return {
+        "count": len(labels),
+        "accuracy": round(sum(1 for label, guess in zip(labels, predicted) if label == guess) / len(labels), 3)
+        if labels else 0.0,
+        "precision": round(true_positives / sum(predicted), 3) if sum(predicted) else 0.0,
+        "recall": round(true_positives / sum(labels), 3) if sum(labels) else 0.0,
+    }
+
+
+def append_ranking_log(pages: List[PageRanked], path=None):
+    """
+    Appends LLM rankings to the JSONL log the pre-ranker is trained from. An empty SCRAPER_RANKING_LOG disables it.
+    """
+    path = path if path is not None else os.getenv("SCRAPER_RANKING_LOG", "tmp/url_rankings.jsonl")
+    if not path or not pages:
+        return
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            for page in pages:
+                f.write(json.dumps(page.model_dump(mode="json")) + "\n")
+    except OSError as e:
+        print(f"Failed to write ranking log {path}: {e}")
+
+
+def load_ranking_log(path) -> List[PageRanked]:
+    pages = []
+    if not os.path.exists(path):
+        return pages
+    with open(path) as f:
+        for line in f:
+            try:
+                pages.append(PageRanked(**json.loads(line)))
+            except (ValueError, TypeError):
+                continue
+    return pages
+
+
+def load_stored_rankings() -> List[PageRanked]:
+    """Reads the scores kept in the metadata of the documents stored by earlier runs."""
+    from app.db.supabase_connection import SupabaseConnection
+
+    pages = []
+    for document in SupabaseConnection().get_documents():
+        metadata = document.get("metadata") or {}
+        if metadata.get("source") and all(target in metadata for target in TARGETS):
+            pages.append(PageRanked(url=metadata["source"], **{target: metadata[target] for target in TARGETS}))
+    return pages
+
+
+def _training_pages(args):
+    pages = load_ranking_log(args.log)
+    if args.supabase:
+        pages += load_stored_rankings()
+    # One label per page, the most recent one wins
+    return list({canonicalize_url(page.url): page for page in pages}.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train or evaluate the local URL pre-ranker.")
+    parser.add_argument("command", choices=["train", "report"])
+    parser.add_argument("--log", default=os.getenv("SCRAPER_RANKING_LOG", "tmp/url_rankings.jsonl"),
+                        help="JSONL log of LLM rankings")
+    parser.add_argument("--supabase", action="store_true", help="Also use the scores of stored web documents")
+    parser.add_argument("--model", default=None, help="Model path (defaults to SCRAPER_PRERANKER_PATH)")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of labels held out for the train report")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    pages = _training_pages(args)
+    print(f"Loaded {len(pages)} LLM-ranked URLs")
+    if args.command == "report":
+        preranker = URLPreRanker.load(args.model)
+        if preranker is None:
+            parser.error("No trained model found")
+        print(json.dumps(preranker.evaluate(pages), indent=2))
+        return
+
+    if args.holdout:
+        shuffled = pages[:]
+        random.Random(args.seed).shuffle(shuffled)
+        cut = int(len(shuffled) * (1 - args.holdout))
+        held_out_model = URLPreRanker().fit(shuffled[:cut])
+        print("Held-out report:")
+        print(json.dumps(held_out_model.evaluate(shuffled[cut:]), indent=2))
+    path = URLPreRanker().fit(pages).save(args.model)
+    print(f"Saved URL pre-ranker trained on {len(pages)} URLs to {path}")
+
+
+if __name__ == "__main__":
+    main()
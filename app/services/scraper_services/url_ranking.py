@@ -1,4 +1,6 @@
 # url_ranking.py
+import asyncio
+import os
 from typing import List
 
 from dotenv import load_dotenv
@@ -6,25 +8,40 @@ from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 
 from app.models.scraper_models import PageRanked, RankedPages
+from app.services.scraper_services.ranking_cache import get_ranking_cache
+from app.services.scraper_services.url_preranker import URLPreRanker, append_ranking_log
 
 load_dotenv()
 
+# URL keywords that signal pages about the people at a company and pages about the company itself
+PEOPLE_KEYWORDS = ["team", "people", "staff", "leadership", "executive", "management"]
+COMPANY_KEYWORDS = ["about", "info", "company", "home"]
+# Estimated tokens of the scores the LLM returns for one URL, on top of the URL itself
+URL_ANSWER_TOKENS = 25
+# Bump when the ranking prompt changes so cached rankings from the old prompt are not reused
+RANKING_PROMPT_VERSION = "1"
+
 
 # Define your Pydantic models
 
 class URLRanker:
-    def __init__(self, model_name="gpt-4o-mini"):
+    def __init__(self, model_name="gpt-4o-mini", preranker=None, batch_tokens=None, max_concurrency=None, retries=None,
+                 cache=None):
         self.model = ChatOpenAI(model=model_name, temperature=0)
+        # Rankings from earlier runs are reused, so only URLs missing from the cache are scored again
+        self.cache = cache if cache is not None else get_ranking_cache(f"{model_name}:{RANKING_PROMPT_VERSION}")
+        self.cache_lookups = 0
+        self.cache_hits = 0
+        # The local pre-ranker scores the URLs it is sure about so only the rest are sent to the LLM
+        self.preranker = preranker if preranker is not None else URLPreRanker.load()
+        # Estimated tokens of URLs and answers per LLM call, used to size the batches
+        self.batch_tokens = batch_tokens or int(os.getenv("SCRAPER_RANKING_BATCH_TOKENS", "1500"))
+        self.max_concurrency = max_concurrency or int(os.getenv("SCRAPER_RANKING_CONCURRENCY", "4"))
+        self.retries = retries if retries is not None else int(os.getenv("SCRAPER_RANKING_RETRIES", "2"))
 
-    def rank_urls(self, urls: List[str], batch_size: int = 20) -> List[PageRanked]:
-        # print(os.getenv("OPENAI_API_KEY"))
-        form_model = self.model.with_structured_output(RankedPages)
-        ranked_urls = []
-        len_urls = len(urls)
-        print(f"Ranking {len_urls} URLs in batches of {batch_size}")
-        for chunk in [urls[i:i + batch_size] for i in range(0, len_urls, batch_size)]:
-            pages_string = "\n".join([f'{{"url": "{url}"}}' for url in chunk])
-            find_form_prompt = f"""
+    def _prompt(self, chunk: List[str]) -> str:
+        pages_string = "\n".join([f'{{"url": "{url}"}}' for url in chunk])
+        return f"""
             Out of the following urls, please rate the pages from 0 to 1 with the likelihood that the pages have information on what the company does and the people that work there.
             Respond in JSON format.
             If the url contains words like "about", "info", "company" or is the root page, it is very likely to have information on what the company does so give it a rating of 1.
@@ -32,7 +49,100 @@ class URLRanker:
             if the url contains words like "blog", "customers", "contact", "careers", "jobs", "case studies", "news", "events", "partners", it is very unlikely to have information on what the company does or the people that work there so give it a rating of 0.
             {pages_string}
             """
-            urls_response = form_model.invoke(find_form_prompt)
+
+    def _batches(self, urls: List[str], batch_size: int) -> List[List[str]]:
+        """
+        Splits URLs into batches whose estimated tokens (about 4 characters per token for the URL, which is
+        repeated in the answer, plus the answer's scores) stay within `batch_tokens`, with at most `batch_size` URLs.
+        """
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for url in urls:
+            url_tokens = 2 * len(url) // 4 + URL_ANSWER_TOKENS
+            if batch and (batch_tokens + url_tokens > self.batch_tokens or len(batch) >= batch_size):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(url)
+            batch_tokens += url_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _prerank(self, urls: List[str]):
+        """Scores what it can from the ranking cache and the local pre-ranker, and returns the URLs left for the LLM."""
+        ranked_urls = []
+        if self.cache is not None and urls:
+            cached = self.cache.lookup(urls)
+            self.cache_lookups += len(urls)
+            self.cache_hits += len(cached)
+            ranked_urls = [cached[url] for url in urls if url in cached]
+            urls = [url for url in urls if url not in cached]
+            print(f"Ranking cache: {len(cached)} hits, {len(urls)} misses "
+                  f"(hit rate this run {self.cache_hits / self.cache_lookups:.0%})")
+        if self.preranker is None or not urls:
+            return ranked_urls, urls
+        preranked_urls, urls = self.preranker.split(urls)
+        print(f"Pre-ranker scored {len(preranked_urls)} URLs locally, {len(urls)} left for the LLM")
+        return ranked_urls + preranked_urls, urls
+
+    def _record(self, pages: List[PageRanked]):
+        """Keeps LLM answers in the ranking cache and as training data for the pre-ranker."""
+        if self.cache is not None:
+            self.cache.store(pages)
+        append_ranking_log(pages)
+
+    async def arank_urls(self, urls: List[str], batch_size: int = 40) -> List[PageRanked]:
+        """
+        Ranks URLs with the LLM, sending all batches at once under the concurrency limit.
+
+        Args:
+            urls (List[str]): The URLs to rank.
+            batch_size (int, optional): The most URLs per LLM call; batches are usually cut earlier by the token budget.
+
+        Returns:
+            List[PageRanked]: The scores, in batch order. A batch that still fails after its retries is left out.
+        """
+        form_model = self.model.with_structured_output(RankedPages)
+        ranked_urls, urls = self._prerank(urls)
+        batches = self._batches(urls, batch_size)
+        if not batches:
+            return ranked_urls
+        print(f"Ranking {len(urls)} URLs in {len(batches)} concurrent batches")
+        results = [None] * len(batches)
+        pending = list(range(len(batches)))
+        for attempt in range(self.retries + 1):
+            if attempt:
+                print(f"Retrying {len(pending)} failed ranking batches (attempt {attempt + 1})")
+                await asyncio.sleep(attempt)
+            responses = await form_model.abatch([self._prompt(batches[i]) for i in pending],
+                                                config={"max_concurrency": self.max_concurrency},
+                                                return_exceptions=True)
+            failed = []
+            for i, response in zip(pending, responses):
+                if isinstance(response, Exception) or response is None:
+                    print(f"Ranking batch {i} failed: {response}")
+                    failed.append(i)
+                else:
+                    results[i] = response.pages
+                    self._record(response.pages)
+            pending = failed
+            if not pending:
+                break
+        for pages in results:
+            ranked_urls.extend(pages or [])
+        return ranked_urls
+
+    def rank_urls(self, urls: List[str], batch_size: int = 20) -> List[PageRanked]:
+        # print(os.getenv("OPENAI_API_KEY"))
+        form_model = self.model.with_structured_output(RankedPages)
+        ranked_urls, urls = self._prerank(urls)
+        len_urls = len(urls)
+        print(f"Ranking {len_urls} URLs in batches of {batch_size}")
+        for chunk in [urls[i:i + batch_size] for i in range(0, len_urls, batch_size)]:
+            urls_response = form_model.invoke(self._prompt(chunk))
             print(urls_response)
             ranked_urls.extend(urls_response.pages)
+            self._record(urls_response.pages)
         return ranked_urls
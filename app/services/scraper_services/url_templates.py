@@ -0,0 +1,175 @@
+# url_templates.py
+import os
+import re
+from collections import defaultdict
+from typing import List, NamedTuple
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from app.services.scraper_services.url_normalization import canonicalize_url
+from app.services.scraper_services.url_ranking import COMPANY_KEYWORDS, PEOPLE_KEYWORDS
+
+load_dotenv()
+
+# ISO 639-1 codes commonly used as a locale prefix, e.g. /fr/, /de-at/ or /pt_BR/
+LANGUAGE_CODES = {
+    "ar", "bg", "cs", "da", "de", "el", "en", "es", "et", "fi", "fr", "he", "hi", "hr", "hu", "id", "it", "ja",
+    "ko", "lt", "lv", "ms", "nb", "nl", "no", "pl", "pt", "ro", "ru", "sk", "sl", "sr", "sv", "th", "tr", "uk",
+    "vi", "zh",
+}
+LOCALE_SEGMENT = re.compile(r"^([a-z]{2})(?:[-_][a-z]{2,4})?$", re.IGNORECASE)
+# Codes that are also common path words (/hr/ for human resources, /it/ for IT services, /id/ for an id)
+AMBIGUOUS_CODES = {"hr", "id", "it", "no"}
+DEFAULT_LANGUAGES = {None, "en"}
+# Path segments that are identifiers rather than words (numbers, hashes, UUIDs)
+ID_SEGMENT = re.compile(r"^(\d+|[0-9a-f]{8,}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})$", re.IGNORECASE)
+# Generated slugs: segments with a digit (post-42, 2024-recap) or of three or more hyphenated words
+SLUG_SEGMENT = re.compile(r"^(?=.*\d)[\w-]+$|^\w+(-\w+){2,}$")
+
+
+class UrlGroup(NamedTuple):
+    """URLs that share a path template. `members` holds one URL per page; translations are only counted."""
+    template: str
+    members: List[str]
+    locale_variants: int
+
+    @property
+    def representative(self):
+        return self.members[0]
+
+
+def split_locale(url, languages=None):
+    """
+    Splits a leading locale segment off the path of a URL.
+
+    Args:
+        url (str): The URL.
+        languages (set, optional): The language codes the site is known to use as a prefix. Other codes are kept
+            as path segments. All of LANGUAGE_CODES by default.
+
+    Returns:
+        tuple[str | None, list]: The language code (None when there is no locale prefix) and the remaining path
+            segments.
+    """
+    segments = [segment for segment in urlsplit(canonicalize_url(url)).path.split("/") if segment]
+    if segments:
+        match = LOCALE_SEGMENT.match(segments[0])
+        if match and match.group(1).lower() in (LANGUAGE_CODES if languages is None else languages):
+            return match.group(1).lower(), segments[1:]
+    return None, segments
+
+
+def site_languages(urls):
+    """
+    Finds the language codes each host uses as a path prefix. A code only counts when the host has sibling locale
+    prefixes, at least one of which is not also a common path word, so /hr/benefits on its own stays a page.
+
+    Returns:
+        dict: {host: set of language codes}.
+    """
+    codes = defaultdict(set)
+    for url in urls:
+        language, _ = split_locale(url)
+        if language is not None:
+            codes[urlsplit(canonicalize_url(url)).netloc].add(language)
+    return {host: languages for host, languages in codes.items()
+            if len(languages) >= 2 and languages - AMBIGUOUS_CODES}
+
+
+def cluster_urls(urls, min_group_size=None, large_group_size=None):
+    """
+    Groups URLs by path template and collapses locale variants of the same page.
+
+    Only pages generated from a template share a group, since the group is ranked through its first member. A
+    second-level or deeper path joins its parent's template group (e.g. /blog/*) when its last segment is an id or
+    a slug and the parent has at least `min_group_size` such children, or when the parent has at least
+    `large_group_size` children (e.g. /products/*). Children named after people or company pages (/company/team,
+    /company/about) are never grouped; other paths are a group of their own. Translations of a page (/fr/about,
+    /de/about) collapse into one member, preferring the unprefixed or English URL; a prefix is only read as a locale
+    when the site has sibling locale prefixes (see `site_languages`).
+
+    Args:
+        urls (List[str]): URLs, most promising first.
+        min_group_size (int, optional): Id or slug children a parent needs before they are treated as one template,
+            SCRAPER_TEMPLATE_MIN_GROUP (3) by default.
+        large_group_size (int, optional): Children of any name a parent needs before they are treated as one
+            template, SCRAPER_TEMPLATE_LARGE_GROUP (10) by default.
+
+    Returns:
+        List[UrlGroup]: The groups in the order their first URL appears in `urls`.
+    """
+    min_group_size = min_group_size or int(os.getenv("SCRAPER_TEMPLATE_MIN_GROUP", "3"))
+    large_group_size = large_group_size or int(os.getenv("SCRAPER_TEMPLATE_LARGE_GROUP", "10"))
+    parsed = []
+    children = defaultdict(set)
+    slug_children = defaultdict(set)
+    languages = site_languages(urls)
+    for url in urls:
+        host = urlsplit(canonicalize_url(url)).netloc
+        language, segments = split_locale(url, languages.get(host, set()))
+        shape = tuple("{id}" if ID_SEGMENT.match(segment) else segment.lower() for segment in segments)
+        parsed.append((url, language, host, tuple(segments), shape))
+        if len(shape) >= 2 and not _keyword_segment(shape[-1]):
+            children[(host, shape[:-1])].add(shape[-1])
+            if _slug_segment(shape[-1]):
+                slug_children[(host, shape[:-1])].add(shape[-1])
+
+    def templated(host, shape):
+        if len(shape) < 2 or _keyword_segment(shape[-1]):
+            return False
+        parent = (host, shape[:-1])
+        if len(children[parent]) >= large_group_size:
+            return True
+        return _slug_segment(shape[-1]) and len(slug_children[parent]) >= min_group_size
+
+    groups = {}
+    for url, language, host, segments, shape in parsed:
+        if templated(host, shape):
+            template = f"{host}/{'/'.join(shape[:-1])}/*"
+        else:
+            template = f"{host}/{'/'.join(shape)}"
+        members, variants = groups.setdefault(template, ({}, [0]))
+        page = (host, tuple(segment.lower() for segment in segments))
+        if page not in members:
+            members[page] = (url, language)
+            continue
+        variants[0] += 1
+        if members[page][1] not in DEFAULT_LANGUAGES and language in DEFAULT_LANGUAGES:
+            members[page] = (url, language)
+
+    return [UrlGroup(template, [url for url, _ in members.values()], variants[0])
+            for template, (members, variants) in groups.items()]
+
+
+def _slug_segment(segment):
+    return segment == "{id}" or bool(SLUG_SEGMENT.match(segment))
+
+
+def _keyword_segment(segment):
+    return any(keyword in segment for keyword in PEOPLE_KEYWORDS + COMPANY_KEYWORDS)
+
+
+def expand_rankings(ranked_pages, groups, max_members=None):
+    """
+    Carries the scores of ranked group representatives over to the other members of their group.
+
+    Args:
+        ranked_pages (List[PageRanked]): The ranker's scores for the representatives.
+        groups (List[UrlGroup]): The groups the representatives were picked from.
+        max_members (int, optional): The most members per group that receive the representative's score.
+
+    Returns:
+        List[PageRanked]: The ranked pages followed, for each one, by copies for the rest of its group.
+    """
+    max_members = max_members or int(os.getenv("SCRAPER_TEMPLATE_MAX_MEMBERS", "10"))
+    by_representative = {canonicalize_url(group.representative): group for group in groups}
+    expanded = []
+    for page in ranked_pages:
+        expanded.append(page)
+        group = by_representative.get(canonicalize_url(page.url))
+        if group is None:
+            continue
+        for member in group.members[1:max_members]:
+            expanded.append(page.model_copy(update={"url": member}))
+    return expanded
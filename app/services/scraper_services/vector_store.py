@@ -0,0 +1,396 @@
+# vector_store.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import vecs
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, func, literal, select, text, union_all, update
+from vecs.collection import build_filters
+
+load_dotenv()
+
+
+class VectorQuery(NamedTuple):
+    """One search of `SalesQAAgent.retrieve_many`."""
+    query: str
+    filters: Optional[dict] = None
+    top_k: int = 5
+
+
+class VectorStore:
+    """
+    Where `SalesQAAgent` keeps the chunk embeddings of a site. Records are (id, vector, metadata) triples, and
+    searches return (id, cosine distance, metadata) rows, closest first. Filters use the vecs metadata filter syntax.
+    """
+
+    def open(self) -> bool:
+        """Prepares the store, creating it if needed, and returns whether it already holds records."""
+        raise NotImplementedError
+
+    def upsert(self, records, index=True):
+        """Inserts or replaces records. With `index`, the vector index is brought up to date afterwards."""
+        raise NotImplementedError
+
+    def create_index(self):
+        """Builds the vector index, for writers that upsert in many chunks with `index=False`."""
+
+    def delete(self, ids=None, filters=None):
+        """Deletes the records with the given ids, or the records matching the filters."""
+        raise NotImplementedError
+
+    def metadata(self, sources=None):
+        """Returns the (id, metadata) pairs of all records, or of the records of the given page URLs."""
+        raise NotImplementedError
+
+    def update_metadata(self, records):
+        """Replaces the metadata of existing records, given as (id, metadata) pairs, keeping their vectors."""
+        raise NotImplementedError
+
+    def records(self, limit=None):
+        """Returns the (id, vector, metadata) records, at most `limit` of them."""
+        raise NotImplementedError
+
+    def count(self, limit=None):
+        """Returns the number of records, counting at most `limit` of them."""
+        raise NotImplementedError
+
+    def query_many(self, vectors, queries: List[VectorQuery]) -> List[List[tuple]]:
+        """Searches each query vector with the filters and top_k of the matching `VectorQuery`."""
+        raise NotImplementedError
+
+
+_domain_indexed = set()
+
+
+def ensure_domain_index(collection):
+    """Creates the index on the domain metadata of a shared collection, once per process."""
+    if collection.name in _domain_indexed:
+        return
+    with collection.client.Session() as sess:
+        with sess.begin():
+            sess.execute(text(f'create index if not exists ix_{collection.name}_domain '
+                              f'on vecs."{collection.name}" ((metadata -> \'domain\'))'))
+    _domain_indexed.add(collection.name)
+
+
+class VecsVectorStore(VectorStore):
+    """
+    Records in a vecs (pgvector) collection. With a `domain` the collection is shared by all sites: records are
+    tagged with the domain and every statement is filtered by it.
+    """
+
+    def __init__(self, client, name, domain=None, dimension=1536):
+        self.client = client
+        self.name = name
+        self.domain = domain
+        self.dimension = dimension
+        self.collection = None
+
+    def open(self):
+        if self.domain:
+            self.collection = self.client.get_or_create_collection(self.name, dimension=self.dimension)
+            ensure_domain_index(self.collection)
+            # A single indexed lookup instead of listing and counting collections
+            stmt = select(self.collection.table.c.id).where(self._domain_filter()).limit(1)
+            with self.client.Session() as sess:
+                return sess.execute(stmt).first() is not None
+        names = [x.name for x in self.client.list_collections()]
+        print(names)
+        if self.name not in names:
+            print(f"Creating collection '{self.name}'.")
+            self.collection = self.client.create_collection(self.name, dimension=self.dimension)
+            return False
+        self.collection = self.client.get_collection(self.name)
+        return len(self.collection) > 0
+
+    def _domain_filter(self):
+        return build_filters(self.collection.table.c.metadata, {"domain": {"$eq": self.domain}})
+
+    def _filters(self, filters=None):
+        """Restricts metadata filters to the site's domain in the shared collection."""
+        if not self.domain:
+            return filters
+        domain_filter = {"domain": {"$eq": self.domain}}
+        return {"$and": [domain_filter, filters]} if filters else domain_filter
+
+    def _metadata(self, metadata):
+        return {**metadata, "domain": self.domain} if self.domain else metadata
+
+    def upsert(self, records, index=True):
+        self.collection.upsert(records=[(id, vector, self._metadata(metadata)) for id, vector, metadata in records])
+        if index:
+            self.create_index()
+
+    def create_index(self):
+        # Create an index if not already created. The shared HNSW index is built once and kept up to date on upsert
+        if not self.domain or self.collection.index is None:
+            self.collection.create_index()
+
+    def delete(self, ids=None, filters=None):
+        if ids is not None:
+            self.collection.delete(ids=list(ids))
+        else:
+            self.collection.delete(filters=self._filters(filters))
+
+    def _select(self, *columns, sources=None, limit=None):
+        table = self.collection.table
+        stmt = select(*columns)
+        if self.domain:
+            stmt = stmt.where(self._domain_filter())
+        if sources is not None:
+            stmt = stmt.where(table.c.metadata["source"].astext.in_(list(dict.fromkeys(sources))))
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        with self.client.Session() as sess:
+            return sess.execute(stmt).fetchall()
+
+    def metadata(self, sources=None):
+        table = self.collection.table
+        return [(id, metadata) for id, metadata in self._select(table.c.id, table.c.metadata, sources=sources)]
+
+    def update_metadata(self, records):
+        if not records:
+            return
+        table = self.collection.table
+        stmt = (update(table)
+                .where(table.c.id == bindparam("record_id"))
+                .values(metadata=bindparam("record_metadata", type_=table.c.metadata.type)))
+        with self.client.Session() as sess:
+            with sess.begin():
+                sess.execute(stmt, [{"record_id": id, "record_metadata": self._metadata(metadata)}
+                                    for id, metadata in records])
+
+    def records(self, limit=None):
+        table = self.collection.table
+        return [(id, np.asarray(vector, dtype=np.float32), metadata)
+                for id, vector, metadata in self._select(table.c.id, table.c.vec, table.c.metadata, limit=limit)]
+
+    def count(self, limit=None):
+        # Counts ids only, so sizing a collection does not read its vectors
+        stmt = select(self.collection.table.c.id)
+        if self.domain:
+            stmt = stmt.where(self._domain_filter())
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        with self.client.Session() as sess:
+            return sess.execute(select(func.count()).select_from(stmt.subquery())).scalar()
+
+    def query_many(self, vectors, queries):
+        """
+        Runs all searches as one UNION ALL statement, so they take a single database round-trip.
+
+        In the shared collection the searches are exact. The HNSW index would apply the domain filter only to the
+        candidates of its scan, which for a small site in a large table usually include none of its rows. Plain
+        index scans are disabled for the transaction instead, so the rows are found through the domain index (a
+        bitmap scan) and ranked by their exact distance.
+        """
+        if not queries:
+            return []
+        table = self.collection.table
+        searches = []
+        for i, (query, vector) in enumerate(zip(queries, vectors)):
+            distance = table.c.vec.cosine_distance(vector)
+            stmt = select(literal(i).label("query_index"), table.c.id, distance.label("distance"), table.c.metadata)
+            filters = self._filters(query.filters)
+            if filters:
+                stmt = stmt.where(build_filters(table.c.metadata, filters))
+            searches.append(stmt.order_by(distance).limit(query.top_k))
+
+        results = [[] for _ in queries]
+        with self.client.Session() as sess:
+            with sess.begin():
+                if self.domain:
+                    sess.execute(text("set local enable_indexscan = off"))
+                for query_index, id, distance, metadata in sess.execute(union_all(*searches)):
+                    results[query_index].append((id, distance, metadata))
+        # UNION ALL keeps no order across the searches
+        for rows in results:
+            rows.sort(key=lambda row: row[1])
+        return results
+
+
+def matches_filters(metadata, filters):
+    """Evaluates a vecs metadata filter against one record's metadata in Python."""
+    if not filters:
+        return True
+    (key, value), = filters.items()
+    if key == "$and":
+        return all(matches_filters(metadata, condition) for condition in value)
+    if key == "$or":
+        return any(matches_filters(metadata, condition) for condition in value)
+    (operator, clause), = value.items()
+    if key not in metadata:
+        # Comparisons with a missing key are NULL in Postgres, which never matches
+        return False
+    field = metadata[key]
+    try:
+        if operator == "$eq":
+            return field == clause
+        if operator == "$ne":
+            return field != clause
+        if operator == "$gt":
+            return field > clause
+        if operator == "$gte":
+            return field >= clause
+        if operator == "$lt":
+            return field < clause
+        if operator == "$lte":
+            return field <= clause
+        if operator == "$in":
+            return field in clause
+        if operator == "$contains":
+            return isinstance(field, list) and clause in field
+    except TypeError:
+        # Values of different JSON types do not compare
+        return False
+    raise ValueError(f"Unknown filter operator {operator}")
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Records kept in process as one contiguous matrix of L2-normalized float32 vectors, so a batch of searches is a
+    single matrix product followed by a top-k per query.
+
+    With a `backing` store the records are loaded from it when the store is opened, and every write goes through to
+    it, which makes this store a read cache. The loaded copy is reused for `ttl_seconds`. Collections with more than
+    `max_records` records are not loaded and are searched in the backing store instead.
+    """
+
+    def __init__(self, backing: Optional[VectorStore] = None, max_records=None, ttl_seconds=None):
+        self.backing = backing
+        self.max_records = max_records or int(os.getenv("SCRAPER_NUMPY_MAX_RECORDS", "20000"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.getenv("SCRAPER_NUMPY_TTL_SECONDS", "300"))
+        # {id: (normalized vector, metadata)} in insertion order; the matrix is rebuilt from it after writes
+        self._records = {}
+        self._ids = []
+        self._matrix = None
+        self.loaded_at = None
+        self.too_large = False
+
+    def open(self):
+        if self.backing is None:
+            return bool(self._records)
+        if self.loaded_at is not None and time.time() - self.loaded_at < self.ttl_seconds:
+            return self.too_large or bool(self._records)
+        has_records = self.backing.open()
+        self.too_large = has_records and self.backing.count(limit=self.max_records + 1) > self.max_records
+        self._records = {}
+        if has_records and not self.too_large:
+            self._put(self.backing.records())
+        self._matrix = None
+        self.loaded_at = time.time()
+        print(f"Loaded {len(self._records)} records into memory" if not self.too_large else
+              f"Collection has more than {self.max_records} records, searching it in the backing store")
+        return has_records
+
+    def _put(self, records):
+        for id, vector, metadata in records:
+            vector = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            self._records[id] = (vector / norm if norm else vector, metadata)
+        self._matrix = None
+
+    def upsert(self, records, index=True):
+        if self.backing is not None:
+            self.backing.upsert(records, index=index)
+        if not self.too_large:
+            self._put(records)
+
+    def create_index(self):
+        if self.backing is not None:
+            self.backing.create_index()
+
+    def delete(self, ids=None, filters=None):
+        if self.backing is not None:
+            self.backing.delete(ids=ids, filters=filters)
+        if ids is None:
+            ids = [id for id, (_, metadata) in self._records.items() if matches_filters(metadata, filters)]
+        for id in ids:
+            self._records.pop(id, None)
+        self._matrix = None
+
+    def metadata(self, sources=None):
+        if self.too_large:
+            return self.backing.metadata(sources)
+        sources = set(sources) if sources is not None else None
+        return [(id, metadata) for id, (_, metadata) in self._records.items()
+                if sources is None or metadata.get("source") in sources]
+
+    def update_metadata(self, records):
+        if self.backing is not None:
+            self.backing.update_metadata(records)
+        for id, metadata in records:
+            if id in self._records:
+                self._records[id] = (self._records[id][0], metadata)
+
+    def records(self, limit=None):
+        if self.too_large:
+            return self.backing.records(limit)
+        return [(id, vector, metadata) for id, (vector, metadata) in list(self._records.items())[:limit]]
+
+    def count(self, limit=None):
+        if self.too_large:
+            return self.backing.count(limit)
+        return min(len(self._records), limit) if limit is not None else len(self._records)
+
+    def query_many(self, vectors, queries):
+        if self.too_large:
+            return self.backing.query_many(vectors, queries)
+        if not queries:
+            return []
+        if not self._records:
+            return [[] for _ in queries]
+        if self._matrix is None:
+            self._ids = list(self._records)
+            self._matrix = np.ascontiguousarray(np.stack([self._records[id][0] for id in self._ids]))
+        query_matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(query_matrix, axis=1, keepdims=True)
+        similarities = (query_matrix / np.where(norms == 0, 1, norms)) @ self._matrix.T
+
+        results = []
+        masks = {}
+        for query, query_similarities in zip(queries, similarities):
+            # Queries sharing a filter share its mask
+            key = repr(query.filters)
+            if key not in masks:
+                masks[key] = np.flatnonzero([matches_filters(self._records[id][1], query.filters) for id in self._ids])
+            candidates = masks[key] if query.top_k > 0 else masks[key][:0]
+            if len(candidates) > query.top_k:
+                candidates = candidates[np.argpartition(-query_similarities[candidates], query.top_k - 1)[:query.top_k]]
+            candidates = candidates[np.argsort(-query_similarities[candidates], kind="stable")]
+            results.append([(self._ids[i], float(1 - query_similarities[i]), self._records[self._ids[i]][1])
+                            for i in candidates])
+        return results
+
+
+_vecs_clients = {}
+_vecs_clients_lock = threading.Lock()
+
+
+def get_vecs_client(connection):
+    """Returns the process-wide vecs client of a database, so agents share its connection pool."""
+    with _vecs_clients_lock:
+        if connection not in _vecs_clients:
+            _vecs_clients[connection] = vecs.Client(connection)
+        return _vecs_clients[connection]
+
+
+_numpy_stores = OrderedDict()
+
+
+def get_numpy_store(key, backing: VectorStore):
+    """
+    Returns the in-memory store of a collection, loaded from `backing` on first use. The stores of the
+    SCRAPER_NUMPY_CACHE_DOMAINS most recently used collections are kept between runs. A reused store keeps the
+    backing it was opened with; with the shared client of `get_vecs_client` that backing uses the same connections.
+    """
+    store = _numpy_stores.pop(key, None) or NumpyVectorStore(backing)
+    _numpy_stores[key] = store
+    while len(_numpy_stores) > int(os.getenv("SCRAPER_NUMPY_CACHE_DOMAINS", "32")):
+        _numpy_stores.popitem(last=False)
+    return store
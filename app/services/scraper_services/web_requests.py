@@ -1,122 +1,330 @@
 # web_requests.py
-import requests
+import asyncio
+import os
+import zlib
+from contextlib import aclosing
+from typing import NamedTuple, Optional
+from xml.etree import ElementTree
+
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 from dotenv import load_dotenv
+
+from app.services.scraper_services.http_fetcher import AsyncFetcher, DEFAULT_HEADERS
 load_dotenv()
 
+# Common sitemap locations (generic, WordPress, Yoast and other CMS defaults), probed when discovering sitemaps
+SITEMAP_PATHS = [
+    "/sitemap.xml",
+    "/sitemap_index.xml",
+    "/sitemap-index.xml",
+    "/wp-sitemap.xml",
+    "/sitemap.xml.gz",
+    "/sitemap/sitemap.xml",
+    "/sitemaps.xml",
+]
+
+
+class SitemapEntry(NamedTuple):
+    """A page URL from a sitemap together with its optional <lastmod>, <priority> and <changefreq> values."""
+    loc: str
+    lastmod: Optional[str] = None
+    priority: Optional[float] = None
+    changefreq: Optional[str] = None
+
+
 class WebRequestHandler:
-    def __init__(self, timeout=10):
+    def __init__(self, timeout=10, fetcher=None, sitemap_fanout=None, probe_max_bytes=None):
         self.timeout = timeout
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
-        }
+        self.sitemap_fanout = sitemap_fanout or int(os.getenv("SCRAPER_SITEMAP_FANOUT", "8"))
+        # Sitemap bodies up to this size downloaded during discovery are parsed from memory instead of again
+        self.probe_max_bytes = probe_max_bytes or int(float(os.getenv("SCRAPER_SITEMAP_PROBE_MAX_MB", "10")) * 1024 * 1024)
+        self._sitemap_bodies = {}
+        self.headers = DEFAULT_HEADERS
+        # Share the run's fetcher when given one so all requests reuse its connection pool and budget
+        self._owns_fetcher = fetcher is None
+        self.fetcher = fetcher or AsyncFetcher(timeout=timeout, headers=self.headers)
+
+    async def aclose(self):
+        if self._owns_fetcher:
+            await self.fetcher.aclose()
 
-    def fetch_sitemap(self, url):
+    async def fetch_sitemap(self, url):
         sitemap_url = urljoin(url, "/sitemap.xml")
-        try:
-            response = requests.get(sitemap_url, headers=self.headers, timeout=self.timeout)
-            response.raise_for_status()
-            return response.text
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to fetch sitemap: {e}")
-            return None
-
-    def fetch_page_content(self, url):
-        try:
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
-            response.raise_for_status()
-            return response.content
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to fetch page content: {e}")
-            return None
-
-    def get_favicon(self, url):
-        response = requests.get(url, headers=self.headers, timeout=self.timeout)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        icon_link = soup.find("link", rel="icon")
+        response = await self.fetcher.get(sitemap_url, budgeted=False)
+        return response.text if response else None
+
+    async def fetch_page_content(self, url):
+        response = await self.fetcher.get(url)
+        return response.content if response else None
+
+    async def get_favicon(self, url):
+        response = await self.fetcher.get(url, budgeted=False)
+        icon_link = None
+        if response:
+            soup = BeautifulSoup(response.text, 'html.parser')
+            icon_link = soup.find("link", rel="icon")
         favicon_url = urljoin(url, icon_link['href']) if icon_link else urljoin(url, "/favicon.ico")
         return favicon_url
-    def parse_sitemap(self, ogurl, url, timeout=10, max_urls=10000, depth=0, processed_sitemaps=None, urls=None):
+
+    async def discover_sitemaps(self, url, timeout=10):
+        """
+        Finds the sitemap(s) of a website. robots.txt and the usual sitemap locations (SITEMAP_PATHS) are requested at
+        the same time. The `Sitemap:` lines of robots.txt win when at least one of them serves a sitemap; otherwise
+        the first of SITEMAP_PATHS in list order that serves a sitemap does, so the result does not depend on which
+        request answers first. The bodies of the chosen sitemaps are kept for `parse_sitemap_entries`.
+
+        Args:
+            url (str): The base URL of the website (e.g., 'https://example.com').
+            timeout (int, optional): Timeout for HTTP requests. Defaults to 10 seconds.
+
+        Returns:
+            List[str]: The sitemap URLs to parse, or an empty list if no sitemap was found.
+        """
+        probes = {}
+
+        def probe(sitemap_url):
+            if sitemap_url not in probes:
+                probes[sitemap_url] = asyncio.create_task(self._probe_sitemap(sitemap_url, timeout))
+            return probes[sitemap_url]
+
+        robots = asyncio.create_task(self._probe_robots(url, timeout))
+        probe_urls = list(dict.fromkeys(urljoin(url, path) for path in SITEMAP_PATHS))
+        for probe_url in probe_urls:
+            probe(probe_url)
+        try:
+            robots_urls = await robots
+            # The robots.txt sitemaps are checked like the probed ones, so a stale entry falls back to the probes
+            robots_results = await asyncio.gather(*[probe(robots_url) for robots_url in robots_urls])
+            sitemap_urls = [robots_url for robots_url, (valid, _) in zip(robots_urls, robots_results) if valid]
+            if sitemap_urls:
+                print(f"Discovered sitemaps in robots.txt: {sitemap_urls}")
+            else:
+                if robots_urls:
+                    print(f"None of the sitemaps in robots.txt could be parsed: {robots_urls}")
+                for probe_url in probe_urls:
+                    if (await probes[probe_url])[0]:
+                        sitemap_urls = [probe_url]
+                        print(f"Discovered sitemaps: {sitemap_urls}")
+                        break
+            for sitemap_url in sitemap_urls:
+                body = probes[sitemap_url].result()[1]
+                if body is not None:
+                    self._sitemap_bodies[sitemap_url] = body
+            return sitemap_urls
+        finally:
+            tasks = [robots, *probes.values()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _probe_robots(self, url, timeout):
+        """Returns the sitemaps declared in robots.txt."""
+        response = await self.fetcher.get(urljoin(url, "/robots.txt"), timeout=timeout, budgeted=False)
+        if not response:
+            return []
+        sitemap_urls = []
+        for line in response.text.splitlines():
+            key, _, value = line.partition(":")
+            if key.strip().lower() == "sitemap" and value.strip():
+                sitemap_urls.append(urljoin(url, value.strip()))
+        return list(dict.fromkeys(sitemap_urls))
+
+    async def _probe_sitemap(self, sitemap_url, timeout):
+        """
+        Checks whether a URL serves a parseable sitemap with at least one entry.
+
+        Returns:
+            tuple[bool, bytes | None]: Whether it does, and the body as downloaded, or None when it is larger than
+                `probe_max_bytes` and only its beginning was read.
+        """
+        chunks = []
+        size = 0
+        complete = True
+        async with aclosing(self.fetcher.iter_bytes(sitemap_url, timeout=timeout, budgeted=False)) as stream:
+            async for chunk in stream:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > self.probe_max_bytes:
+                    complete = False
+                    break
+        async with aclosing(self._parse_sitemap_chunks(sitemap_url, _iterate(chunks))) as entries:
+            async for _ in entries:
+                return True, b"".join(chunks) if complete else None
+        return False, None
+    async def parse_sitemap(self, ogurl, url, timeout=10, max_urls=10000, depth=0, processed_sitemaps=None):
         """
         Fetch and parse a sitemap, handling nested sitemaps and limiting the number of URLs returned.
+        See `parse_sitemap_entries` for the URLs together with their lastmod, priority and changefreq.
+
+        Returns:
+            List[str]: A sorted list of URLs found in the sitemap(s), limited by max_urls if provided.
+        """
+        entries = await self.parse_sitemap_entries(ogurl, url, timeout, max_urls, depth, processed_sitemaps)
+        return [entry.loc for entry in entries]
+
+    async def parse_sitemap_entries(self, ogurl, url, timeout=10, max_urls=10000, depth=0, processed_sitemaps=None):
+        """
+        Fetch and parse a sitemap, handling nested sitemaps and limiting the number of entries returned.
+
+        At depth 0 the sitemaps are found with `discover_sitemaps`. Nested sitemaps of a sitemap index are fetched concurrently, at most `sitemap_fanout` at a time. Their URLs
+        are merged in the order the index lists them, so the result does not depend on which fetch finishes first.
 
         Args:
+            ogurl (str): Only URLs containing this base URL are kept.
             url (str): The base URL of the website (e.g., 'https://example.com').
             timeout (int, optional): Timeout for HTTP requests. Defaults to 10 seconds.
-            max_urls (int, optional): Maximum number of URLs to return. Defaults to None (no limit).
+            max_urls (int, optional): Maximum number of URLs to return. Defaults to 10000; None means no limit.
             depth (int, optional): Current depth of sitemap parsing (used for nested sitemaps).
             processed_sitemaps (set, optional): Set of already processed sitemap URLs.
-            urls (set, optional): Set of URLs collected so far.
 
         Returns:
-            List[str]: A sorted list of URLs found in the sitemap(s), limited by max_urls if provided.
+            List[SitemapEntry]: The entries found in the sitemap(s) sorted by URL length, one per URL,
+                limited by max_urls if provided.
         """
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
-        }
-        def fetch_sitemap(sitemap_url):
-            try:
-                response = requests.get(sitemap_url, headers=headers, timeout=timeout)
-                response.raise_for_status()
-                return response.text
-            except requests.exceptions.RequestException as e:
-                print(f"Failed to fetch {sitemap_url}: {e}")
-                return None
-
-        # Initialize processed_sitemaps and urls if not provided
         if processed_sitemaps is None:
             processed_sitemaps = set()
-        if urls is None:
-            urls = set()
-
-        # Check if max_urls limit has been reached
-        if max_urls and len(urls) >= max_urls:
-            return sorted(urls, key=len)[:max_urls] if max_urls else sorted(urls, key=len)
-
-        # Fetch and parse the sitemap
-        sitemap_url = urljoin(url, "/sitemap.xml") if depth == 0 else url
-        sitemap_content = fetch_sitemap(sitemap_url)
-
-        if not sitemap_content:
-            return urls
-
-        soup = BeautifulSoup(sitemap_content, 'xml')
-        print(f"Processing sitemap at depth {depth}")
-
-        # Process nested sitemaps
-        sitemaps = soup.find_all('sitemap')
-        for sitemap in sitemaps:
-            if max_urls and len(urls) >= max_urls:
-                break  # Stop fetching more sitemaps if max_urls limit is reached
-
-            nested_sitemap_url = sitemap.find('loc').text
-            if nested_sitemap_url not in processed_sitemaps:
-                print(f"Fetching nested sitemap: {nested_sitemap_url}")
-                processed_sitemaps.add(nested_sitemap_url)
-                nested_urls = self.parse_sitemap(ogurl, nested_sitemap_url, timeout, max_urls, depth + 1, processed_sitemaps, urls)
-                urls.update(nested_urls)
-                if max_urls and len(urls) >= max_urls:
-                    return sorted(urls, key=len)[:max_urls] if max_urls else sorted(urls, key=len)
-
-        # Process href links (URLs)
-        url_tags = soup.find_all('loc')
-        if not url_tags:
-            url_tags = soup.find_all('url')  # Check for 'url' tag if 'loc' tag is not found
-
-        # Skip sitemaps with more than 50 pages to avoid overwhelming the system
-        if len(url_tags) > 1000:
-            print(f"Skipping sitemap with {len(url_tags)} pages at depth {depth}")
-            return urls
-
-        for url_tag in url_tags:
-            page_url = url_tag.text.strip()
-            if not page_url.endswith('.xml') and ogurl in page_url:  # Filter out XML URLs
-                urls.add(page_url)
-
-            if max_urls and len(urls) >= max_urls:
-                print(f"Max URLs limit reached: {max_urls}")
-                return sorted(urls, key=len)[:max_urls] if max_urls else sorted(urls, key=len)
-
-        # Return the list of URLs, limited by max_urls if provided and sorted by url length in ascending order
-        return sorted(urls, key=len)[:max_urls] if max_urls else sorted(urls, key=len)
\ No newline at end of file
+        sitemap_urls = await self.discover_sitemaps(url, timeout) if depth == 0 else [url]
+        if not sitemap_urls:
+            print(f"No sitemap found for {url}")
+            return []
+        processed_sitemaps.update(sitemap_urls)
+        fanout = asyncio.Semaphore(self.sitemap_fanout)
+
+        entries = await self._collect_nested_sitemaps(ogurl, sitemap_urls, timeout, max_urls, depth, processed_sitemaps, fanout)
+        # Keep the first entry listed for each URL
+        entries = list({entry.loc: entry for entry in reversed(entries)}.values())[::-1]
+        if max_urls:
+            entries = entries[:max_urls]
+
+        # Sort once, by url length in ascending order
+        return sorted(entries, key=lambda entry: len(entry.loc))
+
+    async def _collect_sitemap(self, ogurl, sitemap_url, timeout, max_urls, depth, processed_sitemaps, fanout):
+        """
+        Returns the page entries of one sitemap and its nested sitemaps in document order, possibly with duplicates.
+        The sitemap is parsed as it streams in and reading stops as soon as max_urls page URLs were found.
+        """
+        urls = []
+        seen = set()
+        nested_sitemap_urls = []
+        async with fanout, aclosing(self._stream_sitemap(sitemap_url, timeout)) as entries:
+            print(f"Processing sitemap at depth {depth}")
+            async for kind, entry in entries:
+                if kind == "sitemap":
+                    # Claim the nested sitemap before fetching it so no sitemap is processed twice
+                    if entry.loc not in processed_sitemaps:
+                        processed_sitemaps.add(entry.loc)
+                        nested_sitemap_urls.append(entry.loc)
+                elif not entry.loc.endswith('.xml') and ogurl in entry.loc:  # Filter out XML URLs
+                    urls.append(entry)
+                    seen.add(entry.loc)
+                    if max_urls and len(seen) >= max_urls:
+                        print(f"Max URLs limit reached: {max_urls}")
+                        return urls
+
+        nested_urls = await self._collect_nested_sitemaps(ogurl, nested_sitemap_urls, timeout,
+                                                          max_urls - len(seen) if max_urls else max_urls,
+                                                          depth + 1, processed_sitemaps, fanout)
+        urls.extend(nested_urls)
+        return urls
+
+    async def _stream_sitemap(self, sitemap_url, timeout):
+        """
+        Incrementally parses a sitemap, plain or gzip-compressed (.xml.gz), with constant memory. A body already
+        downloaded by `discover_sitemaps` is parsed from memory.
+
+        Yields:
+            tuple[str, SitemapEntry]: ("sitemap", entry) for entries of a sitemap index and ("url", entry) for
+                page entries.
+        """
+        body = self._sitemap_bodies.pop(sitemap_url, None)
+        if body is not None:
+            chunks = _iterate([body[offset:offset + 65536] for offset in range(0, len(body), 65536)])
+        else:
+            chunks = self.fetcher.iter_bytes(sitemap_url, timeout=timeout, budgeted=False)
+        async with aclosing(self._parse_sitemap_chunks(sitemap_url, chunks)) as entries:
+            async for entry in entries:
+                yield entry
+
+    async def _parse_sitemap_chunks(self, sitemap_url, chunks):
+        """Parses the chunks of a sitemap body as they arrive, see `_stream_sitemap`."""
+        parser = ElementTree.XMLPullParser(events=("start", "end"))
+        decompressor = None
+        first_chunk = True
+        path = []
+        root = None
+        fields = {}
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                if first_chunk:
+                    first_chunk = False
+                    if chunk[:2] == b"\x1f\x8b":
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                try:
+                    parser.feed(decompressor.decompress(chunk) if decompressor else chunk)
+                    for event, element in parser.read_events():
+                        tag = element.tag.rsplit('}', 1)[-1]
+                        if event == "start":
+                            if root is None:
+                                root = element
+                            path.append(tag)
+                            continue
+                        path.pop()
+                        # Only fields directly under <url> or <sitemap>, not e.g. <image:loc>
+                        if tag in SitemapEntry._fields and element.text and path and path[-1] in ("url", "sitemap"):
+                            fields[tag] = element.text.strip()
+                        elif tag in ("url", "sitemap"):
+                            if fields.get("loc"):
+                                yield ("sitemap" if tag == "sitemap" else "url"), _sitemap_entry(fields)
+                            fields = {}
+                            # Drop finished entries so the tree never grows past one entry
+                            if root is not None:
+                                root.clear()
+                except (ElementTree.ParseError, zlib.error) as e:
+                    print(f"Failed to parse sitemap {sitemap_url}: {e}")
+                    return
+
+    async def _collect_nested_sitemaps(self, ogurl, sitemap_urls, timeout, max_urls, depth, processed_sitemaps, fanout):
+        """
+        Fetches sitemaps at the given depth concurrently and merges their entries in the order they are listed.
+        Outstanding fetches are cancelled as soon as the merged URLs reach max_urls.
+        """
+        if not sitemap_urls:
+            return []
+        for nested_sitemap_url in sitemap_urls:
+            print(f"Fetching sitemap at depth {depth}: {nested_sitemap_url}")
+        tasks = [
+            asyncio.create_task(self._collect_sitemap(ogurl, nested_sitemap_url, timeout, max_urls, depth,
+                                                      processed_sitemaps, fanout))
+            for nested_sitemap_url in sitemap_urls
+        ]
+        urls = []
+        seen = set()
+        try:
+            for task in tasks:
+                nested_urls = await task
+                urls.extend(nested_urls)
+                seen.update(entry.loc for entry in nested_urls)
+                if max_urls and len(seen) >= max_urls:
+                    print(f"Max URLs limit reached: {max_urls}")
+                    break
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return urls
+
+
+async def _iterate(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _sitemap_entry(fields):
+    try:
+        priority = float(fields["priority"]) if "priority" in fields else None
+    except ValueError:
+        priority = None
+    return SitemapEntry(fields["loc"], fields.get("lastmod"), priority, fields.get("changefreq"))
@@ -0,0 +1,51 @@
+# test_document_handling.py
+from langchain_core.documents import Document
+
+from app.services.scraper_services.document_handling import DocumentHandler
+
+NAV = "Home\nProducts\nAbout us\nCareers"
+FOOTER = "We use cookies to improve your experience.  Accept\n© 2024 Acme Inc."
+
+
+def _page(path, body, header=NAV):
+    return Document(page_content=f"{header}\n\n{body}\n{FOOTER}", metadata={"source": f"https://acme.com/{path}"})
+
+
+def test_lines_on_most_pages_are_removed_even_when_one_page_differs():
+    docs = [
+        _page("about", "Acme builds rockets.\nFounded in 1999."),
+        _page("team", "Ada Lovelace, CEO\nGrace Hopper, CTO"),
+        # A different header and whitespace do not stop the shared lines from being removed elsewhere
+        _page("blog", "Launch recap\nAbout us", header="Blog home\nSubscribe"),
+        _page("careers", "We are hiring.\n  We use cookies to improve your   experience. Accept"),
+        _page("contact", "Write to hello@acme.com"),
+        _page("pricing", "Rockets from $1M"),
+    ]
+    DocumentHandler().remove_duplicate_content(docs)
+    assert docs[0].page_content == "Acme builds rockets.\nFounded in 1999."
+    assert docs[1].page_content == "Ada Lovelace, CEO\nGrace Hopper, CTO"
+    assert docs[2].page_content == "Blog home\nSubscribe\nLaunch recap"
+    assert docs[3].page_content == "We are hiring."
+    assert docs[5].page_content == "Rockets from $1M"
+
+
+def test_small_sites_keep_their_content():
+    docs = [_page("", "Acme builds rockets."), _page("team", "Ada Lovelace, CEO")]
+    DocumentHandler().remove_duplicate_content(docs)
+    assert "Acme builds rockets." in docs[0].page_content and "Home" in docs[0].page_content
+
+
+def test_person_lines_shared_by_people_pages_survive():
+    ada = "Ada Lovelace\nCEO"
+    # An incremental run of a few people pages
+    docs = [_page("team", f"Our team\n{ada}\nGrace Hopper\nCTO"), _page("leadership", f"Leadership\n{ada}"),
+            _page("team/ada", f"{ada}\nAda founded Acme.")]
+    DocumentHandler().remove_duplicate_content(docs)
+    assert all("Ada Lovelace\nCEO" in doc.page_content for doc in docs)
+
+    # Ranked pages of a larger run, where the people lines are on four of six pages
+    docs += [_page("team/grace", f"{ada}\nGrace Hopper\nCTO"), _page("about", "Acme builds rockets."),
+             _page("careers", "We are hiring.")]
+    DocumentHandler().remove_duplicate_content(docs)
+    assert all("Ada Lovelace\nCEO" in doc.page_content for doc in docs[:4])
+    assert all(NAV.split("\n")[0] not in doc.page_content.split("\n") for doc in docs)
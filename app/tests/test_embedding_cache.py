@@ -0,0 +1,50 @@
+# test_embedding_cache.py
+from app.services.scraper_services.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+class CountingEmbeddings:
+    model = "fake-embedding"
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return [float(len(text)), 1.0]
+
+
+def test_each_distinct_text_is_embedded_once_across_runs(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    first_model = CountingEmbeddings()
+    first_run = CachedEmbeddings(first_model, EmbeddingCache(path))
+
+    vectors = first_run.embed_documents(["Cookie policy", "About  us\n", "Cookie policy", "About us"])
+    assert vectors[0] == vectors[2] == [13.0, 1.0]
+    assert vectors[1] == vectors[3]
+    assert first_model.embedded == ["Cookie policy", "About us"]
+    first_run.embed_query("What company does this website belong to?")
+
+    # A later run, e.g. another site sharing the same footer, reads everything from disk
+    second_model = CountingEmbeddings()
+    second_run = CachedEmbeddings(second_model, EmbeddingCache(path))
+    second_run.embed_documents(["Cookie policy", "Our team"])
+    second_run.embed_query("What company does this website belong to?")
+    assert second_model.embedded == ["Our team"]
+    assert second_run.cache.stats()["hits"] == 2
+
+    # Another embedding model never reuses these vectors
+    other_model = CountingEmbeddings()
+    CachedEmbeddings(other_model, EmbeddingCache(path), model="other-model").embed_documents(["Cookie policy"])
+    assert other_model.embedded == ["Cookie policy"]
+
+
+def test_least_recently_used_embeddings_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"), max_entries=2)
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    cache.get_many(["a"])
+    cache.put_many({"c": [3.0]})
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
@@ -0,0 +1,97 @@
+# test_http_cache.py
+import httpx
+import pytest
+
+from app.services.scraper_services.http_cache import HttpCache
+from app.services.scraper_services.http_fetcher import AsyncFetcher
+
+
+def conditional_transport(bodies, seen):
+    """Serves {url: body} with an ETag per body and answers matching If-None-Match headers with a 304."""
+    def handler(request):
+        url = str(request.url)
+        seen.append((url, request.headers.get("if-none-match")))
+        body = bodies.get(url)
+        if body is None:
+            return httpx.Response(404)
+        etag = f'"{hash(body)}"'
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"etag": etag})
+        return httpx.Response(200, headers={"etag": etag, "content-type": "text/html"}, content=body)
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.asyncio
+async def test_unchanged_pages_are_revalidated_and_served_from_disk(tmp_path):
+    bodies = {"https://example.com/about": b"<p>about</p>", "https://example.com/sitemap.xml": b"<urlset/>" * 100}
+    seen = []
+    cache = HttpCache(cache_dir=str(tmp_path))
+    fetcher = AsyncFetcher(transport=conditional_transport(bodies, seen), cache=cache)
+
+    first = await fetcher.get("https://example.com/about")
+    again = await fetcher.get("https://example.com/about")
+    assert again.content == first.content == b"<p>about</p>"
+    assert again.headers.get("content-type") == "text/html"
+    assert seen[1][1] is not None  # revalidated with If-None-Match
+
+    streamed = b"".join([chunk async for chunk in fetcher.iter_bytes("https://example.com/sitemap.xml", chunk_size=64)])
+    restreamed = b"".join([chunk async for chunk in fetcher.iter_bytes("https://example.com/sitemap.xml", chunk_size=64)])
+    assert streamed == restreamed == bodies["https://example.com/sitemap.xml"]
+
+    # A changed page is downloaded again and replaces the cached copy
+    bodies["https://example.com/about"] = b"<p>new</p>"
+    assert (await fetcher.get("https://example.com/about")).content == b"<p>new</p>"
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 3
+    assert stats["bytes_saved"] == len(b"<p>about</p>") + len(b"<urlset/>" * 100)
+    await fetcher.aclose()
+
+    # The cache survives a restart
+    reopened = HttpCache(cache_dir=str(tmp_path))
+    assert reopened.lookup("https://example.com/about").size == len(b"<p>new</p>")
+
+
+@pytest.mark.asyncio
+async def test_partial_streams_are_not_cached_and_lru_entries_are_evicted(tmp_path):
+    bodies = {f"https://example.com/{i}": bytes([i]) * 400 for i in range(4)}
+    cache = HttpCache(cache_dir=str(tmp_path), max_bytes=1000, max_entry_bytes=500)
+    fetcher = AsyncFetcher(transport=conditional_transport(bodies, []), cache=cache)
+
+    async for _ in fetcher.iter_bytes("https://example.com/0", chunk_size=100):
+        break
+    assert cache.lookup("https://example.com/0") is None
+
+    for i in (1, 2):
+        await fetcher.get(f"https://example.com/{i}")
+    await fetcher.get("https://example.com/1")  # 1 is now more recently used than 2
+    await fetcher.get("https://example.com/3")
+
+    assert cache.lookup("https://example.com/2") is None
+    assert cache.lookup("https://example.com/1") is not None
+    assert cache.total_bytes <= 1000
+    assert cache.stats()["evictions"] == 1
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_a_cached_redirect_keeps_its_final_url(tmp_path):
+    bodies = {"https://www.example.com/about": b"<p>about</p>"}
+    seen = []
+    serve = conditional_transport(bodies, seen)
+
+    def handler(request):
+        if request.url.host == "example.com":
+            return httpx.Response(301, headers={"location": f"https://www.example.com{request.url.path}"})
+        return serve.handler(request)
+
+    cache = HttpCache(cache_dir=str(tmp_path))
+    fetcher = AsyncFetcher(transport=httpx.MockTransport(handler), cache=cache)
+    cold = await fetcher.get("https://example.com/about")
+    warm = await fetcher.get("https://example.com/about")
+    await fetcher.aclose()
+
+    assert cache.stats()["hits"] == 1
+    assert warm.url == cold.url == "https://www.example.com/about"
+    assert HttpCache(cache_dir=str(tmp_path)).lookup("https://example.com/about").final_url == cold.url
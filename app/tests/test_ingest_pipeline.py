@@ -0,0 +1,88 @@
+# test_ingest_pipeline.py
+import httpx
+import pytest
+
+from app.controllers.scraper_controller import load_page
+from app.services.scraper_services import sales_qa_agent
+from app.services.scraper_services.document_handling import DocumentHandler
+from app.services.scraper_services.http_fetcher import AsyncFetcher
+from app.services.scraper_services.ingest_pipeline import IngestPipeline
+from app.services.scraper_services.sales_qa_agent import SalesQAAgent
+from app.services.scraper_services.vector_store import NumpyVectorStore
+from app.tests.test_sales_qa_agent import FakeEmbeddings
+
+NAV = "Home | About | Team | Careers | Contact"
+WORDS = ["widgets", "gears", "sensors", "valves", "pumps", "motors", "cables", "panels", "drones", "robots", "lasers",
+         "meters", "filters", "boards", "chips", "frames"]
+
+
+def _page(i):
+    # Every page has its own wording, so none of them is a near-duplicate of another
+    text = " ".join(f"Acme {WORDS[(i + j) % len(WORDS)]} {WORDS[(i * j + 3) % len(WORDS)]} line {i * 31 + j}."
+                    for j in range(12))
+    body = f"<div>{NAV}\n</div><div>{text}</div>"
+    return f"<html><head><title>Page {i}</title></head><body>{body}</body></html>".encode()
+
+
+def _fetcher(routes):
+    def handler(request):
+        status, body = routes.get(str(request.url), (404, b""))
+        return httpx.Response(status, content=body)
+    return AsyncFetcher(transport=httpx.MockTransport(handler))
+
+
+class FailingEmbeddings(FakeEmbeddings):
+    def embed_documents(self, texts):
+        raise RuntimeError("embedding service unavailable")
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("SCRAPER_EMBEDDING_CACHE", "false")
+    monkeypatch.setattr(sales_qa_agent, "EMBEDDING_DIMENSION", 2)
+    agent = SalesQAAgent(collection_name="test_ingest_pipeline", store=NumpyVectorStore())
+    agent.open_collection()
+    agent.embedding_model = FakeEmbeddings()
+    return agent
+
+
+@pytest.mark.asyncio
+async def test_pages_stream_from_fetch_to_store(agent):
+    urls = [f"https://acme.com/page-{i}" for i in range(12)]
+    routes = {url: (200, _page(i)) for i, url in enumerate(urls)}
+    # A variant of the first page declaring it as canonical, and a page that fails to load
+    routes["https://acme.com/page-0-print"] = (200, _page(0).replace(
+        b"<head>", b'<head><link rel="canonical" href="https://acme.com/page-0">'))
+    urls += ["https://acme.com/page-0-print", "https://acme.com/missing"]
+    fetcher = _fetcher(routes)
+    stored_pages = []
+    pipeline = IngestPipeline(agent, DocumentHandler(), fetcher, load_page, page_sink=stored_pages.extend,
+                              queue_size=2, embed_batch=3, upsert_batch=4)
+
+    pages = await pipeline.run(urls, {url: {"people_likelihood": 0.0, "company_likelihood": 1.0} for url in urls})
+    await fetcher.aclose()
+
+    assert pages == 12
+    assert sorted(doc.metadata["source"] for doc in stored_pages) == sorted(urls[:12])
+    assert sorted(pipeline.sources) == sorted(urls[:12])
+    records = agent.store.records()
+    assert len(records) == 12
+    # The navigation line is on every page, so it is dropped from the warm-up pages and from the later ones
+    assert all(NAV not in metadata["text"] and metadata["company_likelihood"] == 1.0 for _, _, metadata in records)
+    assert agent.embedding_model.calls <= 12 and all(len(text) > 100 for text in agent.embedding_model.embedded)
+    assert pipeline.stats["fetch"].items_in == 14 and pipeline.stats["fetch"].items_out == 13
+    assert pipeline.stats["parse"].items_out == 12 and pipeline.stats["upsert"].items_out == 12
+
+
+@pytest.mark.asyncio
+async def test_a_failing_stage_stops_the_pipeline(agent):
+    urls = [f"https://acme.com/page-{i}" for i in range(6)]
+    fetcher = _fetcher({url: (200, _page(i)) for i, url in enumerate(urls)})
+    agent.embedding_model = FailingEmbeddings()
+    pipeline = IngestPipeline(agent, DocumentHandler(), fetcher, load_page, queue_size=1)
+
+    with pytest.raises(RuntimeError, match="embedding service unavailable"):
+        await pipeline.run(urls)
+    await fetcher.aclose()
+    assert agent.store.records() == []
@@ -0,0 +1,172 @@
+# test_job_queue.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services.scraper_services.job_queue import LeasedScraperJobQueue, ScraperJob, ScraperJobQueue
+
+
+@pytest.mark.asyncio
+async def test_job_queue_limits_concurrency():
+    running = 0
+    peak = 0
+    processed = []
+
+    async def handler(run_id, request_body):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        processed.append(run_id)
+        running -= 1
+
+    queue = ScraperJobQueue(handler, workers=2, max_size=10)
+    await queue.start()
+    for run_id in range(6):
+        queue.enqueue(run_id, None)
+    await queue._queue.join()
+    await queue.stop()
+
+    assert sorted(processed) == list(range(6))
+    assert peak == 2
+    stats = queue.stats()
+    assert stats["completed"] == 6
+    assert stats["queue_depth"] == 0
+    assert stats["run_time"]["count"] == 6
+
+
+@pytest.mark.asyncio
+async def test_job_queue_rejects_when_full_and_counts_failures():
+    release = asyncio.Event()
+
+    async def handler(run_id, request_body):
+        await release.wait()
+        raise ValueError("boom")
+
+    queue = ScraperJobQueue(handler, workers=1, max_size=1)
+    await queue.start()
+    queue.enqueue("a", None)
+    await asyncio.sleep(0)  # let the worker pick up the first job
+    queue.enqueue("b", None)
+    with pytest.raises(asyncio.QueueFull):
+        queue.enqueue("c", None)
+
+    release.set()
+    await queue._queue.join()
+    await queue.stop()
+
+    stats = queue.stats()
+    assert stats["failed"] == 2
+    assert stats["rejected"] == 1
+
+
+class FakeLeaseStore:
+    lease_seconds = 0.06
+    owner = "test"
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.heartbeats = 0
+        self.released = []
+
+    def heartbeat(self, run_id):
+        self.heartbeats += 1
+        return self.alive
+
+    def release(self, run_id):
+        self.released.append(run_id)
+
+
+@pytest.mark.asyncio
+async def test_leases_are_renewed_while_a_run_blocks_the_event_loop():
+    async def handler(run_id, request_body):
+        # A synchronous call that holds the loop for several heartbeat intervals
+        time.sleep(0.1)
+
+    lease_store = FakeLeaseStore()
+    queue = LeasedScraperJobQueue(handler, lease_store, workers=1)
+    await queue._run_job(ScraperJob("run-1", None))
+
+    assert lease_store.heartbeats >= 3
+    assert lease_store.released == ["run-1"]
+
+
+@pytest.mark.asyncio
+async def test_a_run_whose_lease_is_lost_is_cancelled():
+    async def handler(run_id, request_body):
+        await asyncio.sleep(5)
+
+    lease_store = FakeLeaseStore(alive=False)
+    queue = LeasedScraperJobQueue(handler, lease_store, workers=1)
+    with pytest.raises(RuntimeError, match="was lost"):
+        await asyncio.wait_for(queue._run_job(ScraperJob("run-1", None)), timeout=2)
+    assert lease_store.released == ["run-1"]
+
+
+@pytest.mark.asyncio
+async def test_slow_runs_overlap_and_leave_the_api_responsive(monkeypatch):
+    from app.api.api_v1.endpoints import salesscraper
+    from app.controllers import scraper_controller
+    from app.models.scraper_models import SalesScraperRequestBody
+
+    lock = threading.Lock()
+    in_flight = {"now": 0, "peak": 0}
+
+    def slow_call(*args, **kwargs):
+        # A synchronous database, vector store or HTTP call
+        with lock:
+            in_flight["now"] += 1
+            in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        time.sleep(0.05)
+        with lock:
+            in_flight["now"] -= 1
+
+    class SlowDB:
+        def create_sales_scraper_run(self, **kwargs):
+            slow_call()
+            return {"id": kwargs["email"]}
+
+        def update_sales_scraper_run(self, **kwargs):
+            slow_call()
+
+    def unavailable_agent(**kwargs):
+        slow_call()
+        raise RuntimeError("vector store unavailable")
+
+    monkeypatch.setenv("SCRAPER_HTTP_CACHE", "false")
+    monkeypatch.setattr(salesscraper, "db", SlowDB())
+    monkeypatch.setattr(scraper_controller, "db", SlowDB())
+    monkeypatch.setattr(scraper_controller, "SalesQAAgent", unavailable_agent)
+    monkeypatch.setattr(scraper_controller.requests, "post", slow_call)
+    queue = ScraperJobQueue(salesscraper.process_scraper_run, workers=2, max_size=10)
+    monkeypatch.setattr(salesscraper, "job_queue", queue)
+
+    gaps = []
+
+    async def ticker():
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(0.005)
+            now = time.monotonic()
+            gaps.append(now - last)
+            last = now
+
+    await queue.start()
+    ticks = asyncio.create_task(ticker())
+    for email in ["a@example.com", "b@example.com"]:
+        body = SalesScraperRequestBody(company_description="", url="https://example.com", email=email)
+        assert (await salesscraper.handle_sales_scraper_request(body))["run_id"] == email
+    # The endpoints returned while the runs are still in flight
+    started = time.monotonic()
+    assert (await salesscraper.get_sales_scraper_metrics())["queue"]["running"] >= 1
+    assert time.monotonic() - started < 0.05
+    await asyncio.wait_for(queue._queue.join(), timeout=5)
+    ticks.cancel()
+    await queue.stop()
+
+    # Both runs waited on their slow calls at the same time, and the loop never stalled for one of them
+    assert in_flight["peak"] >= 2
+    assert max(gaps) < 0.045
+    assert queue.stats()["failed"] == 2
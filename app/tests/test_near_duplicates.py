@@ -0,0 +1,36 @@
+# test_near_duplicates.py
+from langchain_core.documents import Document
+
+from app.services.scraper_services.near_duplicates import hamming_distances, near_duplicate_mask, \
+    remove_near_duplicates, simhash_signatures
+
+BIO = ("Ada Lovelace is our Chief Executive Officer. Before founding Acme she led the analytical engine program "
+       "at Babbage and Co, where she wrote the first published algorithm and grew the team from three to forty "
+       "engineers across two continents.")
+
+
+def test_similar_texts_have_close_signatures():
+    other = ("Our platform helps logistics teams plan routes, track shipments in real time and cut fuel costs "
+             "with forecasts built on ten years of delivery data from customers around the world.")
+    signatures = simhash_signatures([BIO, "  " + BIO.replace(" ", "\n  ", 3) + "\n", BIO.replace("forty", "fifty"),
+                                     other])
+    distances = hamming_distances(signatures, signatures)
+    assert distances[0, 1] == 0
+    assert distances[0, 2] <= 6
+    assert distances[0, 3] > 16
+    assert (distances == distances.T).all()
+
+
+def test_first_of_each_near_duplicate_group_is_kept():
+    other = "Book a demo today and see how Acme can help your team ship faster. " * 3
+    texts = [BIO, other, BIO.replace("forty", "fifty"), other.replace("today", "now", 1), "Totally different text."]
+    assert near_duplicate_mask(texts, threshold=0.9).tolist() == [True, True, False, False, True]
+    # An exact-match threshold keeps near-duplicates
+    assert near_duplicate_mask(texts, threshold=1.0).tolist() == [True, True, True, True, True]
+
+    docs = [Document(page_content=text, metadata={"source": f"https://example.com/{i}"}) for i, text in enumerate(texts)]
+    kept, dropped = remove_near_duplicates(docs, threshold=0.9)
+    assert [doc.metadata["source"] for doc in kept] == ["https://example.com/0", "https://example.com/1",
+                                                        "https://example.com/4"]
+    assert dropped == 2
+    assert remove_near_duplicates([]) == ([], 0)
@@ -1,11 +1,13 @@
+import asyncio
 import sys
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
 import pytest
 
-from app.controllers.scraper_controller import run_scraper
-from app.models.scraper_models import SalesScraperRequestBody
+from app.controllers import scraper_controller
+from app.controllers.scraper_controller import DocumentWriter, run_scraper, verify_person
+from app.models.scraper_models import CheckResponse, Person, SalesScraperRequestBody, Summary
 
 # Add the project root to the Python path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
@@ -97,3 +99,61 @@ async def test_run_scraper_failure():
 
         assert exc_info.value.status_code == 500
         assert "Test exception" in str(exc_info.value.detail)
+
+
+class FakeQAAgent:
+    """Answers check and summary questions after a delay; people named "Bot" are not on the team."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+
+    async def aask_question(self, query, response_model, context_docs):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.02)
+        self.in_flight -= 1
+        if response_model is CheckResponse:
+            return CheckResponse(check="Bot" not in query)
+        return Summary(summary=f"Summary from {len(context_docs)} documents")
+
+
+@pytest.mark.asyncio
+async def test_people_are_verified_concurrently_under_the_limit():
+    agent = FakeQAAgent()
+    people = [Person(name=name) for name in ["Ada", "Bot", "Grace", "Alan", "Edsger"]]
+    limit = asyncio.Semaphore(2)
+    verified = await asyncio.gather(*[
+        verify_person(agent, person, f"Is {person.name} on the team?", f"What does {person.name} do?",
+                      [], [("id", 0.1, {"source": "https://example.com/team"})], limit)
+        for person in people
+    ])
+    assert verified == [True, False, True, True, True]
+    assert agent.peak == 2
+    assert people[0].summary == "Summary from 1 documents"
+    assert not people[1].summary
+
+
+@pytest.mark.asyncio
+async def test_document_writes_are_tracked_and_reported_per_run(monkeypatch):
+    release = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    class FakeDB:
+        def store_documents(self, documents):
+            if documents == ["slow"]:
+                asyncio.run_coroutine_threadsafe(release.wait(), loop).result()
+            return documents != ["broken"]
+
+    monkeypatch.setattr(scraper_controller, "db", FakeDB())
+    run, other_run = DocumentWriter(), DocumentWriter()
+    other_run.write(["slow"])
+    run.write(["page", "page"])
+    run.write(["broken"])
+
+    # A run only waits for its own writes, and reports the ones that failed
+    assert await asyncio.wait_for(run.wait(), timeout=2) is False
+    assert (run.written, run.failed) == (2, 1)
+    assert other_run.pending
+    release.set()
+    assert await other_run.wait() is True
@@ -0,0 +1,75 @@
+# test_supabase_connection.py
+import os
+
+import psycopg2
+import pytest
+from langchain_core.documents import Document
+
+from app.db.supabase_connection import SupabaseConnection
+from app.db.web_documents import ensure_web_documents_schema
+
+TEST_POSTGRES_URI = os.getenv("TEST_POSTGRES_URI")
+
+
+class FakeTable:
+    def __init__(self, requests):
+        self.requests = requests
+
+    def upsert(self, rows, **options):
+        self.requests.append((rows, options))
+        return self
+
+    def execute(self):
+        return None
+
+
+class FakeClient:
+    def __init__(self):
+        self.requests = []
+
+    def table(self, name):
+        assert name == "web_documents"
+        return FakeTable(self.requests)
+
+
+def test_documents_are_upserted_in_capped_batches():
+    connection = SupabaseConnection.__new__(SupabaseConnection)
+    connection.supabase = FakeClient()
+    docs = [Document(page_content=f"page {i} " + "x" * 100, metadata={"source": f"https://acme.com/{i}"})
+            for i in range(5)]
+    # The same page loaded twice in a run is sent once
+    docs.append(Document(page_content=docs[0].page_content, metadata={"source": "https://acme.com/0"}))
+
+    assert connection.store_documents(docs, batch_size=2)
+    assert [len(rows) for rows, _ in connection.supabase.requests] == [2, 2, 1]
+    rows, options = connection.supabase.requests[0]
+    assert options["on_conflict"] == "url,content_hash" and options["ignore_duplicates"]
+    assert rows[0]["url"] == "https://acme.com/0" and len(rows[0]["content_hash"]) == 64
+
+    connection.supabase = FakeClient()
+    assert connection.store_documents(docs, batch_bytes=250)
+    assert [len(rows) for rows, _ in connection.supabase.requests] == [2, 2, 1]
+
+
+@pytest.mark.skipif(not TEST_POSTGRES_URI, reason="TEST_POSTGRES_URI is not set")
+def test_web_documents_schema_is_added_once():
+    conn = psycopg2.connect(TEST_POSTGRES_URI)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS test_web_documents")
+            cur.execute("CREATE TABLE test_web_documents (id serial PRIMARY KEY, metadata jsonb, page_content text)")
+            cur.execute("INSERT INTO test_web_documents (metadata, page_content) VALUES ('{}', 'old'), ('{}', 'old')")
+        ensure_web_documents_schema(TEST_POSTGRES_URI, table="test_web_documents")
+        ensure_web_documents_schema(TEST_POSTGRES_URI, table="test_web_documents")
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO test_web_documents (url, content_hash, page_content) VALUES ('u', 'h', 'new') "
+                        "ON CONFLICT (url, content_hash) DO NOTHING")
+            cur.execute("INSERT INTO test_web_documents (url, content_hash, page_content) VALUES ('u', 'h', 'new') "
+                        "ON CONFLICT (url, content_hash) DO NOTHING")
+            cur.execute("SELECT count(*) FROM test_web_documents")
+            assert cur.fetchone()[0] == 3
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS test_web_documents")
+        conn.close()
@@ -0,0 +1,94 @@
+# test_url_normalization.py
+from app.models.scraper_models import PageRanked
+from app.services.scraper_services.url_normalization import canonicalize_url, dedupe_urls, resolve_canonical, \
+    site_domain
+from app.services.scraper_services.url_templates import cluster_urls, expand_rankings
+
+
+def test_canonicalize_url_collapses_variants():
+    variants = [
+        "https://example.com/about",
+        "http://example.com/about/",
+        "https://Example.com:443/about#team",
+        "https://example.com/about?utm_source=newsletter&utm_medium=email",
+        "https://example.com//about?gclid=abc",
+    ]
+    assert {canonicalize_url(url) for url in variants} == {"https://example.com/about"}
+    assert canonicalize_url("https://example.com/search?b=2&a=1") == canonicalize_url("https://example.com/search?a=1&b=2")
+    assert canonicalize_url("https://example.com/search?page=2") != canonicalize_url("https://example.com/search?page=3")
+    assert canonicalize_url("https://example.com") == "https://example.com/"
+
+
+def test_dedupe_urls_keeps_first_variant():
+    urls = ["http://example.com/team/", "https://example.com/team?fbclid=1", "https://example.com/about"]
+    assert dedupe_urls(urls) == ["http://example.com/team/", "https://example.com/about"]
+    entries = [{"loc": url} for url in urls]
+    assert dedupe_urls(entries, key=lambda entry: entry["loc"]) == [entries[0], entries[2]]
+
+
+def test_resolve_canonical():
+    assert resolve_canonical("https://example.com/a/b", "../team") == "https://example.com/team"
+    assert resolve_canonical("https://example.com/a", "javascript:void(0)") is None
+    assert resolve_canonical("https://example.com/a", "") is None
+
+
+def test_site_domain_keeps_the_full_host():
+    assert site_domain("https://www.Acme.com/about") == "acme.com"
+    assert site_domain("http://acme.io") == "acme.io"
+    assert site_domain("https://app.acme.com:8443/") == "app.acme.com:8443"
+
+
+def test_cluster_urls_groups_templates_and_collapses_locales():
+    urls = ["https://example.com/fr/about", "https://example.com/about", "https://example.com/de-at/about"]
+    urls += [f"https://example.com/blog/post-{i}" for i in range(30)]
+    urls += [f"https://example.com/fr/blog/post-{i}" for i in range(30)]
+    urls += ["https://example.com/team/jane", "https://example.com/team/john", "https://example.com/team/ann"]
+    urls += ["https://example.com/case-studies/acme", "https://example.com/case-studies/initech"]
+
+    groups = {group.template: group for group in cluster_urls(urls, min_group_size=3)}
+    assert groups["example.com/about"].members == ["https://example.com/about"]
+    assert groups["example.com/about"].locale_variants == 2
+    assert len(groups["example.com/blog/*"].members) == 30
+    assert groups["example.com/blog/*"].locale_variants == 30
+    # People pages and short lists of named pages are not generated from a template, so each is ranked on its own
+    assert "example.com/team/jane" in groups and "example.com/team/ann" in groups
+    assert "example.com/case-studies/acme" in groups
+    assert len(groups) == 7
+
+
+def test_cluster_urls_keeps_distinct_sections_apart():
+    urls = ["https://example.com/company/about", "https://example.com/company/team",
+            "https://example.com/company/careers", "https://example.com/company/press"]
+    urls += [f"https://example.com/products/{name}" for name in
+             ["anvil", "rocket", "magnet", "spring", "catapult", "glue", "skates", "kite", "sling", "tonic"]]
+    urls += [f"https://example.com/news/{slug}" for slug in ["q3-recap", "acme-opens-new-office", "2024-awards"]]
+
+    groups = {group.template: group for group in cluster_urls(urls, min_group_size=3, large_group_size=10)}
+    assert {"example.com/company/about", "example.com/company/team", "example.com/company/careers"} <= set(groups)
+    assert len(groups["example.com/products/*"].members) == 10
+    assert len(groups["example.com/news/*"].members) == 3
+
+
+def test_cluster_urls_reads_prefixes_as_locales_only_next_to_siblings():
+    urls = ["https://example.com/hr/benefits", "https://example.com/benefits", "https://example.com/it/services",
+            "https://example.com/services", "https://intl.example.com/en/team", "https://intl.example.com/hr/team"]
+
+    groups = {group.template: group for group in cluster_urls(urls)}
+    assert groups["example.com/hr/benefits"].members == ["https://example.com/hr/benefits"]
+    assert groups["example.com/benefits"].members == ["https://example.com/benefits"]
+    assert "example.com/it/services" in groups and "example.com/services" in groups
+    # Next to /en/, /hr/ is the Croatian translation
+    assert groups["intl.example.com/team"].locale_variants == 1
+    assert len(groups) == 5
+
+
+def test_expand_rankings_carries_scores_to_capped_group():
+    groups = cluster_urls([f"https://example.com/team/person-{i}" for i in range(20)] + ["https://example.com/about"])
+    ranked = [PageRanked(url="https://example.com/team/person-0", people_likelihood=0.9),
+              PageRanked(url="https://example.com/about", company_likelihood=0.8)]
+
+    expanded = expand_rankings(ranked, groups, max_members=5)
+    assert [page.url for page in expanded[:5]] == [f"https://example.com/team/person-{i}" for i in range(5)]
+    assert all(page.people_likelihood == 0.9 for page in expanded[:5])
+    assert expanded[5].url == "https://example.com/about"
+    assert len(expanded) == 6
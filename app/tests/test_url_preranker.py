@@ -0,0 +1,47 @@
+# test_url_preranker.py
+import json
+
+from app.models.scraper_models import PageRanked
+from app.services.scraper_services.url_preranker import URLPreRanker, load_ranking_log, main
+
+
+def llm_labels():
+    pages = []
+    for i in range(15):
+        pages.append(PageRanked(url=f"https://site{i}.com/about", company_likelihood=1, people_likelihood=0))
+        pages.append(PageRanked(url=f"https://site{i}.com/company/about-us", company_likelihood=1, people_likelihood=0))
+        pages.append(PageRanked(url=f"https://site{i}.com/team", company_likelihood=0, people_likelihood=1))
+        pages.append(PageRanked(url=f"https://site{i}.com/leadership", company_likelihood=0, people_likelihood=1))
+        pages.append(PageRanked(url=f"https://site{i}.com/blog/post-{i}", company_likelihood=0, people_likelihood=0))
+        pages.append(PageRanked(url=f"https://site{i}.com/careers/job-{i}", company_likelihood=0, people_likelihood=0))
+        pages.append(PageRanked(url=f"https://site{i}.com/news/{i}", company_likelihood=0, people_likelihood=0))
+    return pages
+
+
+def test_preranker_scores_lexical_urls_and_defers_unknown_ones(tmp_path):
+    preranker = URLPreRanker(low=0.2, high=0.8).fit(llm_labels())
+    path = preranker.save(str(tmp_path / "preranker.joblib"))
+    loaded = URLPreRanker.load(path)
+
+    confident, unsure = loaded.split(["https://new.com/about", "https://new.com/team", "https://new.com/blog/launch",
+                                      "https://new.com/xyzzy/plugh"])
+    scores = {page.url: page for page in confident}
+    assert scores["https://new.com/about"].company_likelihood > 0.7
+    assert scores["https://new.com/team"].people_likelihood > 0.7
+    assert scores["https://new.com/blog/launch"].people_likelihood < 0.3
+    assert unsure == ["https://new.com/xyzzy/plugh"]
+
+    report = loaded.evaluate(llm_labels())
+    assert report["company_likelihood"]["all"]["accuracy"] == 1.0
+    assert report["people_likelihood"]["confident"]["recall"] == 1.0
+
+
+def test_train_command_reports_on_held_out_labels(tmp_path, capsys):
+    log = tmp_path / "rankings.jsonl"
+    log.write_text("".join(json.dumps(page.model_dump()) + "\n" for page in llm_labels()) + "not json\n")
+    assert len(load_ranking_log(str(log))) == 105
+
+    main(["train", "--log", str(log), "--model", str(tmp_path / "model.joblib"), "--holdout", "0.3"])
+    output = capsys.readouterr().out
+    assert "Held-out report" in output
+    assert URLPreRanker.load(str(tmp_path / "model.joblib")).samples == 105
@@ -0,0 +1,109 @@
+# test_url_ranking.py
+import asyncio
+
+import pytest
+
+from app.models.scraper_models import PageRanked, RankedPages
+from app.services.scraper_services.ranking_cache import RankingCache
+from app.services.scraper_services.url_ranking import URLRanker
+
+
+class FakeStructuredModel:
+    """Answers ranking prompts after a delay, failing the first call for URLs listed in `flaky`."""
+
+    def __init__(self, flaky=()):
+        self.flaky = set(flaky)
+        self.calls = []
+        self.in_flight = 0
+        self.peak = 0
+
+    async def _answer(self, prompt):
+        urls = [line.split('"')[3] for line in map(str.strip, prompt.splitlines()) if line.startswith('{"url"')]
+        self.calls.append(urls)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.02)
+        self.in_flight -= 1
+        if self.flaky & set(urls):
+            self.flaky -= set(urls)
+            raise RuntimeError("rate limited")
+        return RankedPages(pages=[PageRanked(url=url, company_likelihood=1.0 if "about" in url else 0.0)
+                                  for url in urls])
+
+    async def abatch(self, prompts, config=None, return_exceptions=False):
+        limit = asyncio.Semaphore(config["max_concurrency"])
+
+        async def run(prompt):
+            async with limit:
+                try:
+                    return await self._answer(prompt)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    return e
+        return await asyncio.gather(*[run(prompt) for prompt in prompts])
+
+
+class FakeChatModel:
+    def __init__(self, structured):
+        self.structured = structured
+
+    def with_structured_output(self, schema):
+        return self.structured
+
+
+@pytest.mark.asyncio
+async def test_batches_run_concurrently_and_only_failed_batches_are_retried(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("SCRAPER_RANKING_LOG", str(tmp_path / "rankings.jsonl"))
+    monkeypatch.setenv("SCRAPER_PRERANKER", "false")
+    monkeypatch.setenv("SCRAPER_RANKING_CACHE", "false")
+    structured = FakeStructuredModel(flaky=["https://example.com/page-0"])
+    ranker = URLRanker(batch_tokens=400, max_concurrency=3, retries=1)
+    ranker.model = FakeChatModel(structured)
+
+    short_urls = [f"https://example.com/page-{i}" for i in range(40)]
+    long_urls = [f"https://example.com/{'very-long-slug-' * 8}{i}" for i in range(4)]
+    # Short URLs fill a batch with more URLs than long ones under the same token budget
+    assert len(ranker._batches(short_urls, 40)[0]) > 2 * len(ranker._batches(long_urls, 40)[0])
+
+    urls = short_urls + ["https://example.com/about"]
+    ranked = await ranker.arank_urls(urls)
+    assert [page.url for page in ranked] == urls
+    assert ranked[-1].company_likelihood == 1.0
+    batches = ranker._batches(urls, 40)
+    assert structured.peak == 3
+    # Every batch once, plus a single retry of the batch that failed
+    assert len(structured.calls) == len(batches) + 1
+    assert structured.calls[-1] == batches[0]
+    assert len((tmp_path / "rankings.jsonl").read_text().splitlines()) == len(urls)
+
+
+@pytest.mark.asyncio
+async def test_repeat_runs_are_served_from_the_ranking_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("SCRAPER_RANKING_LOG", "")
+    monkeypatch.setenv("SCRAPER_PRERANKER", "false")
+    cache = RankingCache(str(tmp_path / "rankings.sqlite"), version="test:1", max_entries=100)
+    urls = ["https://example.com/about", "https://example.com/blog/hello", "https://example.com/",
+            "https://example.com/acme-widgets-2024"]
+
+    first_run = URLRanker(cache=cache)
+    first_run.model = FakeChatModel(structured := FakeStructuredModel())
+    await first_run.arank_urls(urls)
+    assert len(structured.calls) == 1
+
+    second_run = URLRanker(cache=cache)
+    second_run.model = FakeChatModel(structured := FakeStructuredModel())
+    ranked = await second_run.arank_urls(["http://example.com/about/", "https://example.com/blog/hello",
+                                          "https://other.com/about", "https://other.com/blog/hello",
+                                          "https://other.com/", "https://other.com/acme-widgets-2024"])
+    # Variants of cached URLs and generic paths of other domains skip the LLM; the homepage and other paths do not
+    assert structured.calls == [["https://other.com/blog/hello", "https://other.com/",
+                                 "https://other.com/acme-widgets-2024"]]
+    assert ranked[0].company_likelihood == 1.0
+    assert (second_run.cache_hits, second_run.cache_lookups) == (3, 6)
+
+    # Another prompt version or an expired entry is a miss
+    assert RankingCache(cache.path, version="test:2").lookup(urls) == {}
+    assert RankingCache(cache.path, version="test:1", ttl_seconds=1e-9).lookup(urls) == {}
@@ -0,0 +1,132 @@
+# test_vector_store.py
+import os
+
+import numpy as np
+import pytest
+
+from app.services.scraper_services import vector_store
+from app.services.scraper_services.vector_store import NumpyVectorStore, VecsVectorStore, VectorQuery, \
+    get_numpy_store, matches_filters
+
+TEST_POSTGRES_URI = os.getenv("TEST_POSTGRES_URI")
+
+
+def _records(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(f"chunk-{i}", rng.normal(size=8).tolist(),
+             {"source": f"https://example.com/page-{i % 5}", "text": f"chunk {i}",
+              "company_likelihood": (i % 4) / 3, "people_likelihood": 1.0 if i % 2 else 0.0})
+            for i in range(count)]
+
+
+def test_metadata_filters_follow_vecs_semantics():
+    metadata = {"source": "https://example.com/team", "people_likelihood": 0.9, "tags": ["team"]}
+    assert matches_filters(metadata, {"people_likelihood": {"$gt": 0.7}})
+    assert not matches_filters(metadata, {"company_likelihood": {"$gt": 0.7}})
+    assert not matches_filters(metadata, {"company_likelihood": {"$ne": 1}})
+    assert matches_filters(metadata, {"source": {"$in": ["https://example.com/team", "https://example.com/"]}})
+    assert matches_filters(metadata, {"tags": {"$contains": "team"}})
+    assert matches_filters(metadata, {"$and": [{"people_likelihood": {"$gte": 0.9}},
+                                               {"$or": [{"source": {"$eq": "x"}}, {"tags": {"$contains": "team"}}]}]})
+    assert not matches_filters(metadata, {"people_likelihood": {"$gt": "a"}})
+
+
+def test_numpy_search_matches_brute_force_cosine():
+    store = NumpyVectorStore()
+    records = _records(60)
+    store.upsert(records)
+    queries = [VectorQuery("people", {"people_likelihood": {"$gt": 0.7}}, top_k=4),
+               VectorQuery("anything", top_k=3),
+               VectorQuery("nothing", {"company_likelihood": {"$gt": 2}})]
+    vectors = np.random.default_rng(1).normal(size=(3, 8))
+    results = store.query_many(vectors, queries)
+
+    for query, vector, rows in zip(queries, vectors, results):
+        expected = sorted(
+            (1 - np.dot(vector, record) / (np.linalg.norm(vector) * np.linalg.norm(record)), id)
+            for id, record, metadata in records if matches_filters(metadata, query.filters))[:query.top_k]
+        assert [row[0] for row in rows] == [id for _, id in expected]
+        assert [row[1] for row in rows] == pytest.approx([distance for distance, _ in expected], abs=1e-5)
+
+    store.delete(filters={"source": {"$eq": "https://example.com/page-0"}})
+    store.update_metadata([("chunk-1", {"source": "https://example.com/moved", "text": "chunk 1"})])
+    assert len(store.records()) == 48
+    assert store.metadata(["https://example.com/moved"]) == [("chunk-1", {"source": "https://example.com/moved",
+                                                                          "text": "chunk 1"})]
+
+
+def test_numpy_store_reads_through_and_writes_through_its_backing():
+    backing = NumpyVectorStore()
+    backing.upsert(_records(10))
+    cached = NumpyVectorStore(backing=backing, max_records=10)
+    assert cached.open() is True
+    assert len(cached.records()) == 10
+
+    cached.upsert(_records(12)[10:])
+    cached.delete(ids=["chunk-0"])
+    assert [id for id, _, _ in backing.records()] == [id for id, _, _ in cached.records()]
+
+    # Past max_records the collection is only counted, not copied, and searches go to the backing store
+    backing.records = lambda limit=None: pytest.fail("the vectors of a large collection were read")
+    too_large = NumpyVectorStore(backing=backing, max_records=5)
+    assert too_large.open() is True and too_large.too_large
+    del backing.records
+    vector = [_records(1)[0][1]]
+    assert too_large.query_many(vector, [VectorQuery("q")]) == backing.query_many(vector, [VectorQuery("q")])
+
+
+def test_numpy_stores_of_hot_collections_are_kept(monkeypatch):
+    monkeypatch.setenv("SCRAPER_NUMPY_CACHE_DOMAINS", "2")
+    monkeypatch.setattr(vector_store, "_numpy_stores", vector_store.OrderedDict())
+    first = get_numpy_store("acme", NumpyVectorStore())
+    get_numpy_store("globex", NumpyVectorStore())
+    assert get_numpy_store("acme", NumpyVectorStore()) is first
+    get_numpy_store("initech", NumpyVectorStore())
+    assert list(vector_store._numpy_stores) == ["acme", "initech"]
+
+
+@pytest.mark.skipif(not TEST_POSTGRES_URI, reason="TEST_POSTGRES_URI is not set")
+def test_numpy_store_over_vecs_returns_the_vecs_results():
+    import vecs
+
+    client = vecs.Client(TEST_POSTGRES_URI.replace("postgresql://", "postgresql+psycopg2://", 1))
+    client.delete_collection("test_vector_store")
+    backing = VecsVectorStore(client, "test_vector_store", dimension=8)
+    try:
+        assert backing.open() is False
+        backing.upsert(_records(40))
+        assert backing.count() == 40 and backing.count(limit=10) == 10
+        cached = NumpyVectorStore(backing=backing)
+        assert cached.open() is True
+        queries = [VectorQuery("people", {"people_likelihood": {"$gt": 0.7}}), VectorQuery("company", top_k=3)]
+        vectors = np.random.default_rng(2).normal(size=(2, 8)).tolist()
+        expected = backing.query_many(vectors, queries)
+        assert [[row[0] for row in rows] for rows in cached.query_many(vectors, queries)] == \
+               [[row[0] for row in rows] for rows in expected]
+    finally:
+        client.delete_collection("test_vector_store")
+
+
+@pytest.mark.skipif(not TEST_POSTGRES_URI, reason="TEST_POSTGRES_URI is not set")
+def test_small_domain_is_found_in_a_large_shared_collection():
+    import vecs
+
+    client = vecs.Client(TEST_POSTGRES_URI.replace("postgresql://", "postgresql+psycopg2://", 1))
+    client.delete_collection("test_vector_store_shared")
+    rng = np.random.default_rng(3)
+    large = VecsVectorStore(client, "test_vector_store_shared", domain="large.com", dimension=8)
+    small = VecsVectorStore(client, "test_vector_store_shared", domain="small.com", dimension=8)
+    try:
+        large.open()
+        small.open()
+        # The large site's chunks all sit next to the query, the small site's far from it
+        large.upsert([(f"large-{i}", (1 + 0.1 * rng.normal(size=8)).tolist(), {"source": f"https://large.com/{i}"})
+                      for i in range(20000)], index=False)
+        small.upsert([(f"small-{i}", (-1 + 0.1 * rng.normal(size=8)).tolist(), {"source": "https://small.com/"})
+                      for i in range(3)])
+        assert small.collection.index is not None
+
+        rows, = small.query_many([np.ones(8).tolist()], [VectorQuery("q", top_k=5)])
+        assert sorted(row[0] for row in rows) == ["small-0", "small-1", "small-2"]
+    finally:
+        client.delete_collection("test_vector_store_shared")
@@ -1,22 +1,284 @@
 # test_web_requests.py
+import asyncio
+import gzip
 import sys
+import time
 from pathlib import Path
-from unittest.mock import patch, MagicMock
+
+import httpx
+import pytest
 
 # Add the project root to the Python path
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from app.services.scraper_services.web_requests import WebRequestHandler
+from app.controllers.scraper_controller import record_loaded_entries
+from app.services.scraper_services.crawl_state import CrawlStateStore, prioritize_entries
+from app.services.scraper_services.http_fetcher import AsyncFetcher, CrawlBudget
+from app.services.scraper_services.link_crawler import LinkCrawler
+from app.services.scraper_services.web_requests import SitemapEntry, WebRequestHandler
+
+
+def mock_fetcher(routes, budget=None):
+    """Builds a fetcher whose transport answers from a {url: (status, body)} mapping."""
+    def handler(request):
+        status, body = routes.get(str(request.url), (404, b""))
+        return httpx.Response(status, content=body)
+    return AsyncFetcher(transport=httpx.MockTransport(handler), budget=budget)
 
-def test_parse_sitemap():
-    handler = WebRequestHandler()
+
+@pytest.mark.asyncio
+async def test_parse_sitemap():
+    fetcher = mock_fetcher({
+        "https://example.com/sitemap.xml": (200, b"<urlset><url><loc>https://example.com/about</loc></url></urlset>"),
+    })
+    handler = WebRequestHandler(fetcher=fetcher)
     url = "https://example.com"
 
-    with patch('app.services.scraper_services.web_requests.requests.get') as mock_get:
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.content = b"<urlset><url><loc>https://example.com/about</loc></url></urlset>"
-        mock_get.return_value = mock_response
+    sitemap_urls = await handler.parse_sitemap(url, url)
+    assert sitemap_urls == ["https://example.com/about"]
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_fetcher_get_many_keeps_order_and_respects_budget():
+    fetcher = mock_fetcher({
+        "https://example.com/a": (200, b"a"),
+        "https://example.com/b": (500, b"b"),
+        "https://example.com/c": (200, b"c"),
+    }, budget=CrawlBudget(max_pages=2, max_seconds=0))
+
+    results = await fetcher.get_many(["https://example.com/a", "https://example.com/b", "https://example.com/c"])
+    assert results[0].content == b"a"
+    assert results[1] is None  # error status
+    assert results[2] is None  # over the page budget
+    assert fetcher.budget.pages == 2
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_parse_sitemap_index_is_concurrent_and_deterministic():
+    index = "".join(f"<sitemap><loc>https://example.com/sitemap-{i}.xml</loc></sitemap>" for i in range(5))
+    routes = {"https://example.com/sitemap.xml": f"<sitemapindex>{index}</sitemapindex>"}
+    for i in range(5):
+        pages = "".join(f"<url><loc>https://example.com/s{i}/page-{j}</loc></url>" for j in range(3))
+        routes[f"https://example.com/sitemap-{i}.xml"] = f"<urlset>{pages}</urlset>"
+    in_flight = 0
+    peak = 0
+
+    delays = {f"https://example.com/sitemap-{i}.xml": 0.05 - 0.01 * i for i in range(5)}
+
+    async def respond(request):
+        nonlocal in_flight, peak
+        delay = delays.get(str(request.url))
+        if delay is not None:
+            in_flight += 1
+            peak = max(peak, in_flight)
+            # Later sitemaps answer first so completion order differs from index order
+            await asyncio.sleep(delay)
+            in_flight -= 1
+        body = routes.get(str(request.url))
+        return httpx.Response(200 if body else 404, content=(body or "").encode())
+
+    fetcher = AsyncFetcher(transport=httpx.MockTransport(respond))
+    handler = WebRequestHandler(fetcher=fetcher, sitemap_fanout=2)
+
+    all_urls = await handler.parse_sitemap("https://example.com", "https://example.com")
+    assert len(all_urls) == 15
+    assert peak == 2
+
+    capped = await handler.parse_sitemap("https://example.com", "https://example.com", max_urls=4)
+    assert capped == sorted(["https://example.com/s0/page-0", "https://example.com/s0/page-1",
+                             "https://example.com/s0/page-2", "https://example.com/s1/page-0"], key=len)
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_parse_sitemap_streams_gzip_and_stops_at_max_urls():
+    pages = "".join(f"<url><loc>https://example.com/page-{i}</loc>"
+                    f"<image:image><image:loc>https://cdn.example.com/{i}.png</image:loc></image:image></url>"
+                    for i in range(5000))
+    sitemap = ('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+               'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">' + pages + '</urlset>')
+    fetcher = mock_fetcher({
+        "https://example.com/sitemap.xml": (200, b"<sitemapindex><sitemap><loc>https://example.com/pages.xml.gz</loc></sitemap></sitemapindex>"),
+        "https://example.com/pages.xml.gz": (200, gzip.compress(sitemap.encode())),
+    })
+    handler = WebRequestHandler(fetcher=fetcher)
+
+    # Sitemaps with more than 1000 entries are no longer skipped
+    all_urls = await handler.parse_sitemap("https://example.com", "https://example.com")
+    assert len(all_urls) == 5000
+    assert all("cdn" not in url for url in all_urls)
+
+    capped = await handler.parse_sitemap("https://example.com", "https://example.com", max_urls=1500)
+    assert len(capped) == 1500
+    assert capped[0] == "https://example.com/page-0"
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_discover_sitemaps_uses_robots_or_cms_defaults():
+    urlset = b"<urlset><url><loc>https://example.com/about</loc></url></urlset>"
+    fetcher = mock_fetcher({
+        "https://example.com/robots.txt": (200, b"User-agent: *\nSitemap: https://example.com/custom-map.xml\n"),
+        "https://example.com/custom-map.xml": (200, urlset),
+        "https://other.com/wp-sitemap.xml": (200, urlset.replace(b"example.com", b"other.com")),
+        "https://other.com/sitemap.xml": (200, b"<html>not a sitemap</html>"),
+    })
+    handler = WebRequestHandler(fetcher=fetcher)
+
+    assert await handler.discover_sitemaps("https://example.com") == ["https://example.com/custom-map.xml"]
+    assert await handler.discover_sitemaps("https://other.com") == ["https://other.com/wp-sitemap.xml"]
+    assert await handler.parse_sitemap("https://other.com", "https://other.com") == ["https://other.com/about"]
+    assert await handler.discover_sitemaps("https://missing.com") == []
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_discover_sitemaps_prefers_robots_then_the_listed_order():
+    urlset = b"<urlset><url><loc>https://example.com/about</loc></url></urlset>"
+    requested = []
+
+    async def handler(request):
+        requested.append(str(request.url))
+        if request.url.path == "/robots.txt" and request.url.host == "robots.com":
+            return httpx.Response(200, content=b"Sitemap: https://robots.com/sitemap.xml\n")
+        if request.url.path == "/sitemap.xml":
+            # The first listed location answers last
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, content=urlset.replace(b"example.com", request.url.host.encode()))
+        if request.url.path == "/wp-sitemap.xml":
+            return httpx.Response(200, content=urlset)
+        return httpx.Response(404)
+
+    fetcher = AsyncFetcher(transport=httpx.MockTransport(handler))
+    web_handler = WebRequestHandler(fetcher=fetcher)
+
+    assert await web_handler.discover_sitemaps("https://example.com") == ["https://example.com/sitemap.xml"]
+    assert await web_handler.parse_sitemap("https://robots.com", "https://robots.com") == ["https://robots.com/about"]
+    # The sitemap declared in robots.txt is downloaded once, for discovery and parsing alike
+    assert requested.count("https://robots.com/sitemap.xml") == 1
+    assert requested.count("https://robots.com/robots.txt") == 1
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_discover_sitemaps_falls_back_from_a_stale_robots_entry():
+    urlset = b"<urlset><url><loc>https://example.com/about</loc></url></urlset>"
+    requested = []
+
+    async def handler(request):
+        requested.append(str(request.url))
+        if request.url.path == "/robots.txt":
+            # robots.txt answers last, while the probes are already under way
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, content=b"Sitemap: https://example.com/old-sitemap.xml\n")
+        if request.url.path == "/sitemap_index.xml":
+            return httpx.Response(200, content=urlset)
+        return httpx.Response(404)
+
+    fetcher = AsyncFetcher(transport=httpx.MockTransport(handler))
+    web_handler = WebRequestHandler(fetcher=fetcher)
+
+    assert await web_handler.parse_sitemap("https://example.com", "https://example.com") == ["https://example.com/about"]
+    assert requested.index("https://example.com/sitemap_index.xml") < requested.index("https://example.com/old-sitemap.xml")
+    assert requested.count("https://example.com/sitemap_index.xml") == 1
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_link_crawler_fetches_promising_pages_first_and_stops_early():
+    blog_links = "".join(f'<a href="/blog/post-{i}">Post {i}</a>' for i in range(50))
+    routes = {
+        "https://example.com/": (200, f'<a href="/about-us">About</a><a href="/our-team">Team</a>'
+                                      f'<a href="https://twitter.com/example">Twitter</a>{blog_links}'.encode()),
+        "https://example.com/our-team": (200, b'<a href="/leadership">Leadership</a><a href="/people/jane#bio">Jane</a>'),
+        "https://example.com/about-us": (200, b'<a href="/company/info">Company</a><a href="mailto:hi@example.com">Mail</a>'),
+    }
+    for i in range(50):
+        routes[f"https://example.com/blog/post-{i}"] = (200, f'<a href="/blog/post-{i}/more">More</a>'.encode())
+    fetcher = mock_fetcher(routes)
+    crawler = LinkCrawler(fetcher, target_pages=5, concurrency=1)
+
+    urls = await crawler.crawl("https://example.com")
+    assert urls == sorted(urls, key=len)
+    assert {"https://example.com/our-team", "https://example.com/leadership", "https://example.com/people/jane"} <= set(urls)
+    assert all(url.startswith("https://example.com") for url in urls)
+    # Home, team, leadership, people and about pages are enough; none of the 50 blog posts are fetched
+    assert crawler.pages_fetched == 5
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_link_crawler_follows_links_after_a_redirect_to_www():
+    routes = {
+        "https://www.acme.com/": b'<a href="/our-team">Team</a><a href="https://acme.com/about">About</a>'
+                                 b'<a href="https://other.com/team">Partner</a>',
+        "https://www.acme.com/our-team": b'<a href="/people/ada">Ada</a>',
+    }
+
+    def handler(request):
+        if str(request.url) == "https://acme.com/":
+            return httpx.Response(301, headers={"Location": "https://www.acme.com/"})
+        if str(request.url) in routes:
+            return httpx.Response(200, content=routes[str(request.url)])
+        return httpx.Response(404)
+
+    fetcher = AsyncFetcher(transport=httpx.MockTransport(handler))
+    urls = await LinkCrawler(fetcher, target_pages=3, concurrency=1).crawl("https://acme.com")
+    assert {"https://www.acme.com/our-team", "https://acme.com/about", "https://www.acme.com/people/ada"} <= set(urls)
+    assert not any("other.com" in url for url in urls)
+    await fetcher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_sitemap_entries_keep_lastmod_and_skip_unchanged_pages(tmp_path):
+    def sitemap(about_lastmod):
+        return (f"<urlset><url><loc>https://example.com/about</loc><lastmod>{about_lastmod}</lastmod>"
+                "<priority>0.3</priority></url>"
+                "<url><loc>https://example.com/team</loc><lastmod>2024-03-01</lastmod><priority>0.9</priority>"
+                "<changefreq>monthly</changefreq></url>"
+                "<url><loc>https://example.com/blog/a-long-post</loc><priority>bad</priority></url></urlset>").encode()
+    routes = {"https://example.com/sitemap.xml": (200, sitemap("2024-01-01"))}
+    fetcher = mock_fetcher(routes)
+    handler = WebRequestHandler(fetcher=fetcher)
+    state = CrawlStateStore(str(tmp_path / "crawl_state.sqlite"))
+
+    entries = await handler.parse_sitemap_entries("https://example.com", "https://example.com")
+    assert entries[0] == SitemapEntry("https://example.com/team", "2024-03-01", 0.9, "monthly")
+    assert [entry.loc for entry in prioritize_entries(entries)] == [
+        "https://example.com/team", "https://example.com/blog/a-long-post", "https://example.com/about"]
+    assert not state.known_domain("example.com")
+    state.record("example.com", entries)
+
+    # Only the page whose lastmod moved is processed on the next run
+    routes["https://example.com/sitemap.xml"] = (200, sitemap("2024-06-01"))
+    entries = await handler.parse_sitemap_entries("https://example.com", "https://example.com")
+    assert state.known_domain("example.com")
+    assert [entry.loc for entry in state.changed_entries("example.com", entries)] == ["https://example.com/about"]
+    await fetcher.aclose()
+
+
+def test_entries_without_lastmod_are_processed_again_once_expired(tmp_path, monkeypatch):
+    state = CrawlStateStore(str(tmp_path / "crawl_state.sqlite"), max_age_days=7)
+    entries = [SitemapEntry("https://example.com/team"), SitemapEntry("https://example.com/about", "2024-01-01")]
+    state.record("example.com", entries)
+    assert state.changed_entries("example.com", entries) == []
+
+    # A week later only the entry without a lastmod is due, and recording the run resets its age
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 8 * 86400)
+    assert state.changed_entries("example.com", entries) == [entries[0]]
+    state.record("example.com", entries)
+    assert state.changed_entries("example.com", entries) == []
+
+
+@pytest.mark.asyncio
+async def test_only_loaded_entries_are_recorded(tmp_path):
+    state = CrawlStateStore(str(tmp_path / "crawl_state.sqlite"))
+    entries = [SitemapEntry(f"https://example.com/page-{i}", "2024-01-01") for i in range(4)]
+    # Only the top of the ranking was selected, and page-1 failed to load
+    await record_loaded_entries(state, "example.com", entries, ["https://example.com/page-0/"])
 
-        sitemap_urls = handler.parse_sitemap(url, url)
-        assert sitemap_urls == ["https://example.com/about"]
+    assert [entry.loc for entry in state.changed_entries("example.com", entries)] == [
+        "https://example.com/page-1", "https://example.com/page-2", "https://example.com/page-3"]
@@ -1,5 +1,7 @@
+import asyncio
 import os
 import sys
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from pyppeteer import launch
 from fastapi.middleware.cors import CORSMiddleware
@@ -9,6 +11,8 @@ from dotenv import load_dotenv
 #from app.api.api_v1.endpoints import submission
 #from app.api.api_v1.endpoints import form
 from app.api.api_v1.endpoints import salesscraper
+from app.db.web_documents import ensure_web_documents_schema
+from app.services.scraper_services.sales_qa_agent import warm_query_embeddings
 
 print("Current working directory:", os.getcwd())
 sys.path.append(os.getcwd())
@@ -26,7 +30,22 @@ sentry_sdk.init(
     profiles_sample_rate=1.0,
 )
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the scraper worker pool on the server's event loop
+    await salesscraper.job_queue.start()
+    try:
+        await asyncio.to_thread(ensure_web_documents_schema)
+    except Exception as e:
+        print(f"Error: web_documents has no (url, content_hash) unique index, storing pages will fail: {e}")
+    try:
+        await asyncio.to_thread(warm_query_embeddings)
+    except Exception as e:
+        print(f"Failed to precompute query embeddings: {e}")
+    yield
+    await salesscraper.job_queue.stop()
+
+app = FastAPI(lifespan=lifespan)
 origins = ["*"]
 
 app.add_middleware(